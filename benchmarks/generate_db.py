@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Generate a synthetic watchlist database for the benchmarks.
+
+The database has the schema of src/database.py and is filled with random (but reproducible)
+movies, tv shows, users, watched movies and episodes. It scales to millions of rows.
+
+Typical usage example:
+> python benchmarks/generate_db.py bench.db --movies 1000000 --shows 100000 --watched 2000000
+"""
+from typing import Iterator
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import database
+import migrations
+
+BATCH_SIZE = 50000
+WORDS = ("the of night house last star dark city return king lost river secret war world love "
+         "game story blood empire shadow fire winter summer road island dream").split()
+# release dates between 1950 and 2030, so some movies are upcoming
+FIRST_RELEASE, LAST_RELEASE = -631152000, 1893456000
+# random pairs repeat, keep the first one
+INSERT_WATCHED_MOVIES = "INSERT OR IGNORE INTO watched (user_username, movie_id) VALUES (?,?);"
+
+
+def words(rng: random.Random, count: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(count)).capitalize()
+
+
+def titles(rng: random.Random, count: int, tv_show: bool) -> Iterator[tuple]:
+    for number in range(count):
+        if tv_show:
+            start = rng.randint(1950, 2025)
+            release_date = f"{start}–{start + rng.randint(1, 10)}" if rng.random() < 0.6 else f"{start}–"
+        else:
+            release_date = rng.uniform(FIRST_RELEASE, LAST_RELEASE)
+        yield (f"{number + (9000000 if tv_show else 1000000):07d}", words(rng, rng.randint(1, 4)), release_date,
+               f"{rng.randint(10, 99) / 10}/10", 'TV Series' if tv_show else 'Movie',
+               f"{rng.randint(0, 3)}h {rng.randint(0, 59)}m", words(rng, rng.randint(10, 30)))
+
+
+def batches(rows: Iterator[tuple], size: int = BATCH_SIZE) -> Iterator[list]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def generate(path: str, movies: int, shows: int, users: int, watched: int, episodes: int, seed: int = 0):
+    """
+    Create a database at path and fill it with random rows.
+    """
+    rng = random.Random(seed)
+    database.configure(path)
+    database.create_tables()
+    connection = database.get_connection()
+
+    with connection:
+        connection.executemany(database.INSERT_USER, [(f"user{number}",) for number in range(users)])
+    for batch in batches(titles(rng, movies, tv_show=False)):
+        database.add_movies(batch)
+    for batch in batches(titles(rng, shows, tv_show=True)):
+        database.add_shows(batch)
+
+    watched_rows = ((f"user{rng.randrange(users)}", rng.randint(1, movies)) for _ in range(watched))
+    for batch in batches(watched_rows):
+        with connection:
+            connection.executemany(INSERT_WATCHED_MOVIES, batch)
+
+    # a few seasons of episodes for the first shows
+    episode_rows = ((f"{9000000 + number // 30:07d}", number % 30 // 10 + 1, number % 10 + 1, words(rng, 3),
+                     None, rng.uniform(FIRST_RELEASE, LAST_RELEASE)) for number in range(episodes))
+    for batch in batches(episode_rows):
+        with connection:
+            connection.executemany(database.INSERT_EPISODES, batch)
+    migrations.backfill_show_dates() # next airdates of the shows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic watchlist database.")
+    parser.add_argument('path', help="database file to create (must not exist)")
+    parser.add_argument('--movies', type=int, default=100000)
+    parser.add_argument('--shows', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--watched', type=int, default=200000)
+    parser.add_argument('--episodes', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        parser.error(f"{args.path} already exists")
+
+    start = time.perf_counter()
+    generate(args.path, args.movies, args.shows, args.users, args.watched, args.episodes, args.seed)
+    print(f"Generated {args.path} ({os.path.getsize(args.path) / 2**20:.0f} MB) in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+Write the HTML fixtures used by the offline benchmarks.
+
+The fixtures mimic the IMDB pages scraped by the search module: the elements the parsers read
+(see SELECTORS in src/parsers.py) surrounded by the navigation, lists and inline scripts
+that make the real pages a few hundred KB. They are generated with a fixed seed, so every run
+writes the same files. Pages saved from imdb.com can be dropped next to them, named by the kind
+of page they are (title_search*.html, title*.html, episodes*.html).
+
+Typical usage example:
+> python benchmarks/make_fixtures.py
+"""
+import argparse
+import json
+import os
+import random
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+WORDS = ("the of night house last star dark city return king lost river secret war world love "
+         "game story blood empire shadow fire winter summer road island dream").split()
+
+
+def words(rng: random.Random, count: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(count)).capitalize()
+
+
+def noise(rng: random.Random, blocks: int) -> str:
+    """
+    Markup the parsers skip: navigation, recommendation lists and inline json.
+    """
+    parts = []
+    for block in range(blocks):
+        items = "".join(f'<li class="ipc-list__item"><a class="ipc-link" href="/title/tt{rng.randint(10**6, 10**7)}/">'
+                        f'{words(rng, 3)}</a><span class="ipc-rating-star">{rng.randint(10, 99) / 10}</span></li>'
+                        for _ in range(20))
+        parts.append(f'<section class="ipc-page-section" data-testid="section-{block}"><div class="ipc-title">'
+                     f'<h3>{words(rng, 2)}</h3></div><ul class="ipc-list">{items}</ul></section>')
+    state = {'props': {'pageProps': {'items': [{'id': f'tt{rng.randint(10**6, 10**7)}', 'text': words(rng, 12)}
+                                              for _ in range(blocks * 15)]}}}
+    parts.append(f'<script id="__NEXT_DATA__" type="application/json">{json.dumps(state)}</script>')
+    return "".join(parts)
+
+
+def page(rng: random.Random, body: str) -> str:
+    return (f'<!DOCTYPE html><html><head><title>{words(rng, 3)} - IMDb</title>'
+            f'<script>window.IMDbTimer={{starttime: new Date().getTime()}};</script></head>'
+            f'<body><nav class="ipc-nav">{noise(rng, 6)}</nav><main>{body}</main>'
+            f'<footer>{noise(rng, 18)}</footer></body></html>')
+
+
+def title_search(rng: random.Random) -> str:
+    results = []
+    for _ in range(25):
+        details = "".join(f'<li class="ipc-inline-list__item">{detail}</li>'
+                          for detail in (str(rng.randint(1950, 2030)), rng.choice(['TV Series', 'Movie', 'TV Mini Series']),
+                                         words(rng, 2)))
+        results.append(f'<li class="ipc-metadata-list-summary-item"><div class="ipc-metadata-list-summary-item__c">'
+                       f'<div class="ipc-metadata-list-summary-item__tc"><a class="ipc-metadata-list-summary-item__t" '
+                       f'href="/title/tt{rng.randint(10**6, 10**7)}/?ref_=fn_tt">{words(rng, 3)}</a>'
+                       f'<ul class="ipc-inline-list">{details}</ul></div></div></li>')
+    return page(rng, f'{noise(rng, 12)}<ul class="ipc-metadata-list">{"".join(results)}</ul>{noise(rng, 12)}')
+
+
+def title(rng: random.Random) -> str:
+    hero = (f'<h1 data-testid="hero-title-block__title">{words(rng, 3)}</h1>'
+            f'<ul data-testid="hero-title-block__metadata">'
+            f'<li><span>TV Series</span></li><li><a><span>2019–2023</span></a></li><li><a>TV-MA</a></li><li>1h</li></ul>'
+            f'<div data-testid="hero-rating-bar__aggregate-rating__score"><span>8.7</span><span>/10</span></div>'
+            f'<p><span data-testid="plot-xl">{words(rng, 40)}</span></p>')
+    return page(rng, f'<section class="ipc-page-section">{hero}</section>{noise(rng, 36)}')
+
+
+def episodes(rng: random.Random) -> str:
+    selected = ' selected="selected"'
+    seasons = "".join(f'<option value="{season}"{selected if season == 4 else ""}>{season}</option>'
+                      for season in range(1, 6))
+    years = "".join(f'<option value="{year}">{year}</option>' for year in range(2015, 2025))
+    items = []
+    for number in range(1, 11):
+        items.append(f'<div class="list_item"><div class="image"><a href="/title/tt{rng.randint(10**6, 10**7)}/">'
+                     f'<img alt="{words(rng, 2)}"/></a></div><div class="info" itemprop="episodes">'
+                     f'<meta itemprop="episodeNumber" content="{number}"/>'
+                     f'<div class="airdate"> {rng.randint(1, 28)} Mar. 2024 </div>'
+                     f'<strong><a href="/title/tt{rng.randint(10**6, 10**7)}/" title="{words(rng, 3)}">{words(rng, 3)}</a></strong>'
+                     f'<div class="item_description">{words(rng, 30)}</div></div></div>')
+    body = (f'<div class="subpage_title_block"><div class="parent"><h3 itemprop="name"><a href="/title/tt0000001/">'
+            f'{words(rng, 3)}</a></h3></div></div><select id="bySeason">{seasons}</select>'
+            f'<select id="byYear">{years}</select><div class="list detail eplist">{"".join(items)}</div>')
+    return page(rng, f'{body}{noise(rng, 24)}')
+
+
+FIXTURES = {'title_search.html': title_search, 'title.html': title, 'episodes.html': episodes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write the HTML fixtures of the offline benchmarks.")
+    parser.add_argument('--output', default=FIXTURES_DIR, help="directory the fixtures are written to")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    for name, make in FIXTURES.items():
+        html = make(random.Random(name))
+        with open(os.path.join(args.output, name), 'w') as fixture:
+            fixture.write(html)
+        print(f"{name}: {len(html) / 1024:.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of the HTML parsers on the saved fixtures.
+
+For every fixture and every installed parser backend, times:
+- full: building a BeautifulSoup tree of the whole page (how the scrapers used to parse)
+- partial: the extractor of src/parsers.py, which only parses the elements its selectors need
+
+Typical usage example:
+> python benchmarks/make_fixtures.py
+> python benchmarks/parse_backends.py --repeat 20 --json parse_backends.json
+"""
+from typing import Callable, Dict, List
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'src'))
+
+import parsers
+
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, 'fixtures')
+
+# extractor of every kind of page, the longest matching file name prefix wins
+EXTRACTORS = {
+    'title_search': lambda html, backend: parsers.parse_title_search(html, backend),
+    'title': lambda html, backend: parsers.parse_title(html, '0000001', backend),
+    'episodes': lambda html, backend: parsers.parse_episodes(html, backend=backend),
+}
+
+
+def fixture_kind(path: str) -> str:
+    name = os.path.basename(path)
+    kinds = [kind for kind in EXTRACTORS if name.startswith(kind)]
+    return max(kinds, key=len) if kinds else None
+
+
+def median_ms(function: Callable, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def run(fixtures_dir: str, repeat: int) -> List[Dict]:
+    """
+    Time full and partial parsing of every fixture with every backend.
+    """
+    from bs4 import BeautifulSoup
+
+    results = []
+    for path in sorted(glob.glob(os.path.join(fixtures_dir, '*.html'))):
+        kind = fixture_kind(path)
+        if kind is None:
+            continue
+        with open(path, encoding='utf-8') as fixture:
+            html = fixture.read()
+        for backend in parsers.available_backends():
+            extractor = EXTRACTORS[kind]
+            results.append({
+                'fixture': os.path.basename(path),
+                'kind': kind,
+                'size_kb': round(len(html.encode()) / 1024, 1),
+                'backend': backend,
+                'full_ms': median_ms(lambda: BeautifulSoup(html, backend), repeat),
+                'partial_ms': median_ms(lambda: extractor(html, backend), repeat),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the HTML parser backends on saved pages.")
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help="directory of the saved pages")
+    parser.add_argument('--repeat', type=int, default=10, help="parses of every page, the median is reported")
+    parser.add_argument('--json', help="file the results are written to")
+    args = parser.parse_args()
+
+    results = run(args.fixtures, args.repeat)
+    print(f"{'fixture':<22}{'size':>9}  {'backend':<12}{'full':>10}{'partial':>10}{'speedup':>9}")
+    for result in results:
+        print(f"{result['fixture']:<22}{result['size_kb']:>6.0f} KB  {result['backend']:<12}"
+              f"{result['full_ms']:>7.2f} ms{result['partial_ms']:>7.2f} ms{result['full_ms'] / result['partial_ms']:>8.1f}x")
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
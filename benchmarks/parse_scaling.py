@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Benchmark of the parse pool: pages parsed per second by 1, 2, 4... worker processes.
+
+Parses a batch of saved fixtures (title, episode and search pages, like a bulk refresh) in the calling
+process, then with a ParsePool of every size up to the number of cores, fed by threads the way the
+search module feeds it. Speedup is relative to the calling process; it should grow with the workers
+until the cores run out (on one core, the pool only adds the cost of sending pages to the workers).
+
+Typical usage example:
+> python benchmarks/make_fixtures.py
+> python benchmarks/parse_scaling.py --pages 200 --json parse_scaling.json
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
+import argparse
+import json
+import os
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'src'))
+
+from parse_pool import ParsePool
+import parsers
+
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, 'fixtures')
+
+
+def workload(fixtures_dir: str, pages: int) -> List[Tuple[Callable, str, tuple]]:
+    """
+    Return pages (parser, html, extra arguments) mixing the fixtures like a refresh of tv shows:
+    an episodes page and a title page for every search page.
+    """
+    def fixture(name: str) -> str:
+        with open(os.path.join(fixtures_dir, name), encoding='utf-8') as page:
+            return page.read()
+
+    mix = [(parsers.parse_episodes, fixture('episodes.html'), ()),
+           (parsers.parse_title, fixture('title.html'), ('0000001',)),
+           (parsers.parse_episodes, fixture('episodes.html'), ()),
+           (parsers.parse_title_search, fixture('title_search.html'), ())]
+    return [mix[index % len(mix)] for index in range(pages)]
+
+
+def inline(pages: List[Tuple]) -> float:
+    for parser, html, args in pages[:4]: # warm up, like the workers
+        parser(html, *args)
+    start = time.perf_counter()
+    for parser, html, args in pages:
+        parser(html, *args)
+    return time.perf_counter() - start
+
+
+def pooled(pages: List[Tuple], workers: int) -> float:
+    pool = ParsePool(workers)
+    try:
+        # warm up every worker before timing
+        for future in [pool.submit(parser, html, *args) for parser, html, args in pages[:workers * 2]]:
+            future.result()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers * 2) as threads:
+            list(threads.map(lambda page: pool.submit(page[0], page[1], *page[2]).result(), pages))
+        return time.perf_counter() - start
+    finally:
+        pool.close()
+
+
+def worker_counts(max_workers: int) -> List[int]:
+    counts, workers = [], 1
+    while workers < max_workers:
+        counts.append(workers)
+        workers *= 2
+    return counts + [max_workers]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the parse pool against parsing in one process.")
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help="directory of the saved pages")
+    parser.add_argument('--pages', type=int, default=200, help="pages parsed by every run")
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1, help="largest pool tried")
+    parser.add_argument('--json', help="file the results are written to")
+    args = parser.parse_args()
+
+    pages = workload(args.fixtures, args.pages)
+    baseline = inline(pages)
+    results = [{'workers': 0, 'seconds': baseline, 'pages_per_second': len(pages) / baseline, 'speedup': 1.0}]
+    for workers in worker_counts(args.max_workers):
+        seconds = pooled(pages, workers)
+        results.append({'workers': workers, 'seconds': seconds, 'pages_per_second': len(pages) / seconds,
+                        'speedup': baseline / seconds})
+
+    print(f"{len(pages)} pages, {os.cpu_count()} cores, html parser {parsers.default_backend()}")
+    print(f"{'workers':<10}{'seconds':>10}{'pages/s':>10}{'speedup':>9}")
+    for result in results:
+        workers = result['workers'] or 'inline'
+        print(f"{workers:<10}{result['seconds']:>10.2f}{result['pages_per_second']:>10.1f}{result['speedup']:>8.2f}x")
+
+    if args.json:
+        meta = {'pages': len(pages), 'cores': os.cpu_count(), 'html_parser': parsers.default_backend()}
+        with open(args.json, 'w') as output:
+            json.dump({'meta': meta, 'results': results}, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""
+Offline benchmark suite: database queries, HTML parsing and cleaning of search results.
+
+Runs without network access, against a synthetic database (see generate_db.py) and the saved
+HTML fixtures (see make_fixtures.py). Results are written to JSON, and can be compared
+with a previous run to catch regressions. The database benchmarks time the queries, the query cache is
+cleared before every call; the *.cached ones time the same reads answered by the cache.
+
+Typical usage example:
+> python benchmarks/generate_db.py bench.db --movies 1000000
+> python benchmarks/run.py --db bench.db --json before.json
+> python benchmarks/run.py --db bench.db --json after.json --compare before.json
+"""
+from typing import Callable, Dict
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'src'))
+
+import database
+import parsers
+
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, 'fixtures')
+
+
+def measure(function: Callable, repeat: int, warmup: int = 1) -> Dict:
+    """
+    Call function repeat times (after warmup calls) and summarize the durations in milliseconds.
+    """
+    for _ in range(warmup):
+        function()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return {
+        'runs': repeat,
+        'median_ms': statistics.median(times),
+        'min_ms': times[0],
+        'p95_ms': times[min(len(times) - 1, int(len(times) * 0.95))],
+    }
+
+
+def _uncached(function: Callable) -> Callable:
+    # the read functions keep their results in database.query_cache: clear it before every call, so that
+    # the query itself is timed (as on the first read after a write)
+    def call():
+        database.query_cache.invalidate()
+        return function()
+    return call
+
+
+def database_benchmarks(path: str) -> Dict[str, Callable]:
+    database.configure(path)
+    connection = database.get_connection()
+    username = connection.execute("SELECT user_username FROM watched LIMIT 1;").fetchone()
+    username = username[0] if username else ''
+    queries = {
+        'db.get_movies': lambda: database.get_movies(),
+        'db.get_movies_upcoming': lambda: database.get_movies(upcoming=True),
+        'db.iter_movies_first_page': lambda: list(database.iter_movies(order_by='release_date', limit=25)),
+        'db.get_shows': lambda: database.get_shows(),
+        'db.get_shows_upcoming': lambda: database.get_shows(upcoming=True),
+        'db.get_watched_movies': lambda: database.get_watched_movies(username),
+        'db.search_movies': lambda: database.search_movies('star'),
+        'db.search_shows': lambda: database.search_shows('night ho'),
+        'db.get_imdb_id': lambda: database.get_imdb_id(),
+        'db.get_upcoming_episodes': lambda: database.get_upcoming_episodes(),
+    }
+    benchmarks = {name: _uncached(function) for name, function in queries.items()}
+    # the same reads answered by the query cache, reported separately
+    for name in ('db.get_movies', 'db.search_movies', 'db.get_upcoming_episodes'):
+        benchmarks[f"{name}.cached"] = queries[name]
+    return benchmarks
+
+
+def parser_benchmarks(fixtures_dir: str) -> Dict[str, Callable]:
+    def fixture(name: str) -> str:
+        with open(os.path.join(fixtures_dir, name), encoding='utf-8') as page:
+            return page.read()
+
+    title_search, title, episodes = fixture('title_search.html'), fixture('title.html'), fixture('episodes.html')
+    return {
+        'parse.title_search': lambda: parsers.parse_title_search(title_search),
+        'parse.title': lambda: parsers.parse_title(title, '0000001'),
+        'parse.episode_guide': lambda: parsers.parse_episode_guide(episodes),
+        'parse.episodes': lambda: parsers.parse_episodes(episodes),
+    }
+
+
+def search_benchmarks(fixtures_dir: str) -> Dict[str, Callable]:
+    from search import clean_search_results
+
+    with open(os.path.join(fixtures_dir, 'title_search.html'), encoding='utf-8') as page:
+        search_results = parsers.parse_title_search(page.read())
+    return {
+        'search.clean_search_by_title_results': lambda: clean_search_results(search_results),
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARKS_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> bool:
+    """
+    Print the change of every benchmark against a baseline run. Returns whether any benchmark regressed.
+    """
+    regressed = False
+    print(f"\n{'benchmark':<40}{'baseline':>12}{'now':>12}{'ratio':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, now = baseline[name]['median_ms'], result['median_ms']
+        ratio = now / before if before else float('inf')
+        flag = '  REGRESSION' if ratio > threshold else ''
+        regressed = regressed or bool(flag)
+        print(f"{name:<40}{before:>9.3f} ms{now:>9.3f} ms{ratio:>7.2f}x{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline benchmark suite.")
+    parser.add_argument('--db', help="database generated by generate_db.py, database benchmarks are skipped without it")
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help="directory of the saved pages")
+    parser.add_argument('--repeat', type=int, default=10, help="timed runs of every benchmark")
+    parser.add_argument('--filter', default='', help="only run benchmarks whose name contains this text")
+    parser.add_argument('--json', help="file the results are written to")
+    parser.add_argument('--compare', help="results of a previous run to compare with")
+    parser.add_argument('--threshold', type=float, default=1.2, help="slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    benchmarks = {}
+    if args.db:
+        benchmarks.update(database_benchmarks(args.db))
+    benchmarks.update(parser_benchmarks(args.fixtures))
+    benchmarks.update(search_benchmarks(args.fixtures))
+
+    results = {}
+    for name, function in benchmarks.items():
+        if args.filter in name:
+            results[name] = measure(function, args.repeat)
+            print(f"{name:<40}{results[name]['median_ms']:>9.3f} ms (median of {args.repeat})")
+
+    if args.json:
+        meta = {'date': datetime.datetime.now().isoformat(timespec='seconds'), 'revision': git_revision(),
+                'python': platform.python_version(), 'sqlite': database.sqlite3.sqlite_version,
+                'html_parser': parsers.default_backend(), 'database': args.db}
+        with open(args.json, 'w') as output:
+            json.dump({'meta': meta, 'results': results}, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as previous:
+            baseline = json.load(previous)['results']
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
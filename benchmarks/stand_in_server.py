@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+"""
+Local stand-in for IMDB, to exercise the fetch layer (rate limit, retries, circuit breaker) without network access.
+
+Serves the saved fixtures (see make_fixtures.py) on the urls scraped by the search module, with ETag
+validators, and can misbehave on purpose:
+- --fail-rate: answer a fraction of the requests with 503 Service Unavailable
+- --fail-first: answer the first requests of every url with 503, then recover
+- --throttle: answer 429 Too Many Requests (with a Retry-After header) above a number of requests per second
+- --latency: wait before answering, to trigger read timeouts
+Point the app at it with WATCHLIST_IMDB_URL.
+
+Typical usage example:
+> python benchmarks/stand_in_server.py --port 8008 --fail-rate 0.2 --throttle 5
+> WATCHLIST_IMDB_URL=http://127.0.0.1:8008 python src/app.py
+> server = serve(port=0, fail_first=2); server.server_address; server.shutdown()
+"""
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+import argparse
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# (url pattern, fixture), the first matching pattern wins
+ROUTES = [
+    (re.compile(r"^/title/tt\d+/episodes"), 'episodes.html'),
+    (re.compile(r"^/title/tt\d+/?$"), 'title.html'),
+    (re.compile(r"^/find/"), 'title_search.html'),
+]
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, fixtures_dir: str = FIXTURES_DIR, fail_rate: float = 0.0, fail_first: int = 0,
+                 throttle: float = None, retry_after: int = 1, latency: float = 0.0, seed: int = None):
+        super().__init__(address, StandInHandler)
+        self.pages = {}
+        for _, name in ROUTES:
+            with open(os.path.join(fixtures_dir, name), 'rb') as page:
+                self.pages[name] = page.read()
+        self.fail_rate = fail_rate
+        self.fail_first = fail_first
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests_per_url = Counter()
+        self.recent = deque() # times of the requests of the last second
+        self.statuses = Counter()
+        self.verbose = False
+
+    def verdict(self, path: str) -> int:
+        """
+        Return the status a request is answered with: 200, or the failure it was picked for.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.requests_per_url[path] += 1
+            while self.recent and self.recent[0] <= now - 1:
+                self.recent.popleft()
+            self.recent.append(now)
+            if self.throttle is not None and len(self.recent) > self.throttle:
+                return 429
+            if self.requests_per_url[path] <= self.fail_first or self.random.random() < self.fail_rate:
+                return 503
+            return 200
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {'requests': sum(self.statuses.values()), 'statuses': dict(self.statuses)}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        name = next((name for pattern, name in ROUTES if pattern.search(self.path)), None)
+        status = server.verdict(self.path) if name else 404
+        if server.latency:
+            time.sleep(server.latency)
+
+        body, headers = b'', {}
+        if status == 200:
+            body = server.pages[name]
+            etag = '"' + hashlib.md5(body).hexdigest() + '"'
+            headers['ETag'] = etag
+            if self.headers.get('If-None-Match') == etag:
+                status, body = 304, b''
+        elif status == 429:
+            headers['Retry-After'] = str(server.retry_after)
+        with server.lock:
+            server.statuses[status] += 1
+
+        try:
+            self.send_response(status)
+            for header, value in headers.items():
+                self.send_header(header, value)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass # the client gave up waiting (see --latency)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def serve(host: str = '127.0.0.1', port: int = 0, verbose: bool = False, **options) -> StandInServer:
+    """
+    Start a stand-in server in a background thread (port 0 picks a free port, see server.server_address).
+
+    Args:
+    options: fixtures_dir, fail_rate, fail_first, throttle, retry_after, latency and seed of StandInServer
+
+    Return:
+    StandInServer: the running server, stopped by server.shutdown()
+    """
+    server = StandInServer((host, port), **options)
+    server.verbose = verbose
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the saved fixtures as a misbehaving stand-in for IMDB.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8008)
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help="directory of the saved pages")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="fraction of the requests answered with 503")
+    parser.add_argument('--fail-first', type=int, default=0, help="requests of every url answered with 503 before it recovers")
+    parser.add_argument('--throttle', type=float, help="requests per second answered before 429 Too Many Requests")
+    parser.add_argument('--retry-after', type=int, default=1, help="seconds asked for by the Retry-After header of a 429")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds to wait before answering")
+    parser.add_argument('--seed', type=int, help="seed of the random failures")
+    args = parser.parse_args()
+
+    server = StandInServer((args.host, args.port), args.fixtures, args.fail_rate, args.fail_first, args.throttle,
+                           args.retry_after, args.latency, args.seed)
+    server.verbose = True
+    print(f"Serving {args.fixtures} on http://{args.host}:{server.server_address[1]} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n{server.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Measure how long the app takes to start.
+
+Imports app.py in fresh interpreters and reports:
+- wall clock time of the import (median and best of several runs), next to an empty interpreter
+- the slowest imports, as reported by `python -X importtime`
+- which heavy dependencies (pandas, numpy, bs4, requests) got imported, which should be none
+
+Every run appends one JSON line to the history file, so startup time can be tracked over time.
+
+Typical usage example:
+> python benchmarks/startup.py --runs 10 --history benchmarks/startup_history.jsonl
+"""
+from typing import Dict, List
+import argparse
+import datetime
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+HEAVY_MODULES = ['pandas', 'numpy', 'bs4', 'requests']
+STATEMENT = "import app"
+
+
+def run_python(args: List[str], cwd: str) -> subprocess.CompletedProcess:
+    env = dict(os.environ, PYTHONPATH=SRC)
+    return subprocess.run([sys.executable, *args], cwd=cwd, env=env, capture_output=True, text=True, check=True)
+
+
+def wall_clock(statement: str, runs: int, cwd: str) -> List[float]:
+    """
+    Return the seconds it took to run statement in a fresh interpreter, for every run.
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        run_python(['-c', statement], cwd)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def import_times(cwd: str) -> List[Dict]:
+    """
+    Return the self and cumulative import time (in microseconds) of every module imported by app.
+    """
+    stderr = run_python(['-X', 'importtime', '-c', STATEMENT], cwd).stderr
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append({'module': name.strip(), 'self_us': int(self_us), 'cumulative_us': int(cumulative_us)})
+    return modules
+
+
+def heavy_modules_loaded(cwd: str) -> List[str]:
+    statement = f"{STATEMENT}, sys, json; print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    return json.loads(run_python(['-c', statement], cwd).stdout)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SRC, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the startup time of the app.")
+    parser.add_argument('--runs', type=int, default=10, help="number of fresh interpreters to time")
+    parser.add_argument('--top', type=int, default=10, help="number of slowest imports to report")
+    parser.add_argument('--history', help="JSON lines file the result is appended to")
+    parser.add_argument('--fail-on-heavy', action='store_true', help="exit with an error if a heavy dependency is imported")
+    args = parser.parse_args()
+
+    # importing the database module creates data.db in the working directory
+    with tempfile.TemporaryDirectory() as cwd:
+        baseline = wall_clock('pass', args.runs, cwd)
+        app = wall_clock(STATEMENT, args.runs, cwd)
+        modules = import_times(cwd)
+        heavy = heavy_modules_loaded(cwd)
+
+    slowest = sorted(modules, key=lambda module: module['self_us'], reverse=True)[:args.top]
+    app_module = next((module for module in modules if module['module'] == 'app'), None)
+    result = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': sys.version.split()[0],
+        'runs': args.runs,
+        'interpreter_median_s': statistics.median(baseline),
+        'startup_median_s': statistics.median(app),
+        'startup_best_s': min(app),
+        'app_import_us': app_module['cumulative_us'] if app_module else None,
+        'slowest_imports': slowest,
+        'heavy_modules': heavy,
+    }
+
+    print(f"Empty interpreter:  {result['interpreter_median_s'] * 1000:.1f} ms (median)")
+    print(f"Start app:          {result['startup_median_s'] * 1000:.1f} ms (median), {result['startup_best_s'] * 1000:.1f} ms (best)")
+    print(f"Import of app:      {result['app_import_us'] / 1000:.1f} ms (importtime, cumulative)")
+    print(f"Heavy dependencies: {', '.join(heavy) if heavy else 'none'}")
+    print("\n-- Slowest imports (self time) --")
+    for module in slowest:
+        print(f"{module['self_us'] / 1000:8.2f} ms  {module['module']}")
+
+    if args.history:
+        with open(args.history, 'a') as history:
+            history.write(json.dumps(result) + '\n')
+
+    if args.fail_on_heavy and heavy:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
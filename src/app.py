@@ -7,10 +7,19 @@ Features:
 - View upcoming movies or episodes in your watchlist. 
 - Interact with a local database (your watchlist) using sqlite3: store, view, and delete information.
 - Supports multiple users
+- Keep the watchlist fresh in the background: python app.py --daemon
+- See where the time goes: python app.py --profile (or --metrics watchlist.prom)
+- Script it without the menus, with JSON output: python app.py list movies (see cli.py)
+- Statistics of the watchlist: watched movies per user, ratings, runtimes and releases per year
+- One timeline of the upcoming movies and episodes, in date order
 """
 
-from model import MovieWatchlist, TVWatchlist
+from typing import List, Optional
+import argparse
+import sys
+import cli
 import database
+import metrics
 
 __author__ = "Pejman Memar"
 __license__ = "MIT"
@@ -23,15 +32,19 @@ PROMPT = """Please select one of the following options:
 1) Movies watchlist.
 2) TV shows watchlist.
 3) Add user to the app.
-4) Exit.
+4) Statistics.
+5) Timeline of upcoming movies and episodes.
+6) Exit.
 
 Your selection: """
 
 def open_movie_watchlist(): # Movie watchlist menu
+    from model import MovieWatchlist
     movie_watchlist = MovieWatchlist()
     movie_watchlist.menu()
 
 def open_tv_watchlist(): # TV watchlist menu
+    from model import TVWatchlist
     tv_watchlist = TVWatchlist()
     tv_watchlist.menu()
 
@@ -42,15 +55,49 @@ def add_user(): # add user to the app
     except:
         print(f"\n{username} is already existed. Try a different username.\n")
 
+def show_stats(): # statistics of the watchlist
+    import stats
+    print(f"\n-- Statistics --\n{stats.format_stats(stats.watchlist_stats())}\n-- End --\n")
+
+def show_timeline(): # upcoming movies and episodes in date order
+    import datetime
+    from model import print_paged
+    username = input("Username (empty for everyone): ")
+    def format_item(item) -> str:
+        at, kind, title, show_title, season, episode, _, _, watched = item
+        day = datetime.date.fromtimestamp(at)
+        if kind == 'episode':
+            return f"{day}: {show_title!r} S{season:02}E{episode:02} - {title!r}"
+        return f"{day}: {title!r} (movie{', watched' if watched else ''})"
+    if not print_paged("Timeline", database.get_timeline(username=username or None), format_item):
+        print("\nThere are no upcoming movies or episodes in the watchlist!\n")
+
 MENU_OPTIONS = {
 "1": open_movie_watchlist,
 "2": open_tv_watchlist,
-"3": add_user
+"3": add_user,
+"4": show_stats,
+"5": show_timeline
 }
 
+# options followed by a value, which is not a command even when it looks like one (--metrics stats)
+OPTIONS_WITH_VALUE = {'--metrics', '--budget', '--format'}
+
+def command_name(argv: List[str]) -> Optional[str]:
+    """
+    Return the first positional argument: the command of cli.py, or None for the menu and the daemon.
+    """
+    arguments = iter(argv)
+    for arg in arguments:
+        if arg in OPTIONS_WITH_VALUE:
+            next(arguments, None)
+        elif not arg.startswith('-'):
+            return arg
+    return None
+
 def menu():
     database.create_tables()
-    while (selection := input(PROMPT)) != "4":
+    while (selection := input(PROMPT)) != "6":
         try:
             MENU_OPTIONS[selection]()
 
@@ -59,6 +106,25 @@ def menu():
 
 
 if __name__ == "__main__":
-    print("Welcome to your watchlist app!\n")
-    menu()
+    if command_name(sys.argv[1:]) in cli.COMMANDS: # python app.py [--format ndjson] list movies
+        sys.exit(cli.main(sys.argv[1:]))
+    parser = argparse.ArgumentParser(description="Keep track of movies and tv shows locally.")
+    parser.add_argument('--daemon', action='store_true', help="refresh the watchlist from IMDB in the background instead of opening the menu")
+    parser.add_argument('--budget', type=int, help="requests to IMDB per hour of the daemon (300 by default)")
+    parser.add_argument('--profile', action='store_true', help="print the time spent downloading, parsing and querying on exit")
+    parser.add_argument('--metrics', help="file the metrics are written to on exit: Prometheus text format for a .prom file, JSON otherwise")
+    args = parser.parse_args()
+    try:
+        if args.daemon:
+            import daemon
+            database.create_tables()
+            daemon.run(args.budget or daemon.REQUEST_BUDGET)
+        else:
+            print("Welcome to your watchlist app!\n")
+            menu()
+    finally:
+        if args.profile:
+            print(f"\n-- Profile --\n{metrics.summary()}")
+        if args.metrics:
+            metrics.export(args.metrics)
 
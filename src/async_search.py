@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""
+Look up many movies and tv shows on IMDB at once, on an asyncio event loop.
+
+AsyncSearch is the batch counterpart of search.Search: pages are downloaded through the same fetch_page
+(response cache, rate limit, retries) and parsed by the same parsers, in a thread pool so the event loop
+never blocks. At most max_concurrency pages are downloaded at the same time, and concurrent lookups of
+the same url share a single download (single-flight).
+
+Batch methods return one result per input, in the order of the input. A lookup that fails does not stop
+the others: its result is the exception (search_many_by_id, search_many_by_title) or an error message
+(upcoming_episodes_many).
+
+Typical usage example:
+> async with AsyncSearch() as search:
+>     records = await search.search_many_by_id(["16358384", "0944947"])
+> asyncio.run(AsyncSearch(tv_show=True).upcoming_episodes_many(["0944947"]))
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Iterable, List, Union
+import asyncio
+import parse_pool
+from parsers import parse_episode_guide, parse_episodes, parse_title, parse_title_search
+from records import EpisodeRecord, SearchResult, TitleRecord
+from search import clean_search_results, episodes_url, fetch_page, title_search_url, title_url
+
+MAX_CONCURRENCY = 16 # pages downloaded at the same time (fetch still limits the requests per host)
+
+
+class AsyncSearch:
+    """
+    Search IMDB for many titles concurrently.
+
+    Attributes:
+    tv_show: a boolean flag to determine whether search for movies or tv shows
+    max_concurrency: pages downloaded at the same time
+    """
+    def __init__(self, tv_show: bool = False, max_concurrency: int = MAX_CONCURRENCY):
+        self.tv_show = tv_show
+        self.max_concurrency = max_concurrency
+        self.__executor = None
+        self.__semaphore = None # created on the running loop
+        self.__in_flight = {} # url: download shared by every concurrent lookup of the url
+        self.__stats = {'downloads': 0, 'shared': 0}
+
+    async def __aenter__(self) -> "AsyncSearch":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Stop the worker threads.
+        """
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False)
+            self.__executor = None
+
+    def stats(self) -> Dict:
+        """
+        Return the pages downloaded and the lookups that joined a download already in flight.
+        """
+        return dict(self.__stats)
+
+    async def __run(self, function: Callable, *args):
+        """
+        Run a blocking function (a download or a parser) in the worker threads.
+        """
+        if self.__executor is None:
+            self.__executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        return await asyncio.get_running_loop().run_in_executor(self.__executor, partial(function, *args))
+
+    async def __download(self, url: str) -> str:
+        if self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self.__semaphore:
+            self.__stats['downloads'] += 1
+            return await self.__run(fetch_page, url)
+
+    async def get_page(self, url: str) -> str:
+        """
+        Get the html of a page, joining the download of the url if one is already in flight.
+
+        Args:
+        url (str): input web address
+
+        return:
+        str: html of the page
+        """
+        download = self.__in_flight.get(url)
+        if download is None:
+            download = asyncio.ensure_future(self.__download(url))
+            self.__in_flight[url] = download
+            download.add_done_callback(lambda _: self.__in_flight.pop(url, None))
+        else:
+            self.__stats['shared'] += 1
+        # a cancelled caller must not cancel the download of the others
+        return await asyncio.shield(download)
+
+    async def search_by_id(self, imdb_id: str) -> TitleRecord:
+        """
+        Find a movie or tv show from IMDB based on the entered ID, see Search.search_by_id.
+        """
+        return await self.__run(parse_pool.parse, parse_title, await self.get_page(title_url(imdb_id)), imdb_id)
+
+    async def search_by_title(self, title: str) -> List[SearchResult]:
+        """
+        Find relevent movies and tv shows from IMDB based on the entered title.
+
+        Return:
+        list: SearchResult of every result, movies and tv shows alike (see SearchResult.is_tv_show)
+        """
+        search_results = await self.__run(parse_pool.parse, parse_title_search, await self.get_page(title_search_url(title)))
+        return clean_search_results(search_results)
+
+    async def upcoming_episodes(self, imdb_id: str) -> List:
+        """
+        Find upcoming episodes from IMDB based on the entered ID, see Search.upcoming_episodes.
+
+        Return:
+        list: EpisodeRecord of the upcoming episodes (or a message when there are none) and the title of the show
+        """
+        guide = await self.get_page(episodes_url(imdb_id))
+        movie_title, all_seasons, selected_season = await self.__run(parse_pool.parse, parse_episode_guide, guide)
+
+        # the guide opens on the selected season, so only later seasons need a new download
+        later_seasons = [episodes_url(imdb_id, season) for season in all_seasons if int(season) > int(selected_season)]
+        season_results = await asyncio.gather(self.__run(parse_pool.parse, parse_episodes, guide, True),
+                                              *(self.__scrape_episodes(url) for url in later_seasons))
+        results = [episode for episodes in season_results for episode in episodes]
+        if results:
+            return [results, movie_title]
+        return [f"Found no upcoming episodes for {movie_title}.", movie_title]
+
+    async def __scrape_episodes(self, url: str) -> List[EpisodeRecord]:
+        return await self.__run(parse_pool.parse, parse_episodes, await self.get_page(url), True)
+
+    async def search_many_by_id(self, imdb_ids: Iterable[str]) -> List[Union[TitleRecord, Exception]]:
+        """
+        Find several movies or tv shows concurrently.
+
+        Return:
+        list: TitleRecord of every id, or the exception raised by its lookup
+        """
+        return await asyncio.gather(*(self.search_by_id(imdb_id) for imdb_id in imdb_ids), return_exceptions=True)
+
+    async def search_many_by_title(self, titles: Iterable[str]) -> List[Union[List[SearchResult], Exception]]:
+        """
+        Search several titles concurrently.
+
+        Return:
+        list: SearchResults of every title, or the exception raised by its search
+        """
+        return await asyncio.gather(*(self.search_by_title(title) for title in titles), return_exceptions=True)
+
+    async def upcoming_episodes_many(self, imdb_ids: Iterable[str]) -> List[List]:
+        """
+        Find upcoming episodes of several tv shows concurrently.
+
+        Return:
+        list: [imdb_id, results, title] for every show, same results and title as upcoming_episodes,
+        or an error message and the imdb_id when the show failed to download or parse
+        """
+        imdb_ids = list(imdb_ids)
+        found = await asyncio.gather(*(self.upcoming_episodes(imdb_id) for imdb_id in imdb_ids), return_exceptions=True)
+        return [[imdb_id] + (result if not isinstance(result, Exception)
+                             else [f"Unable to find upcoming episodes for tt{imdb_id}: {result}", imdb_id])
+                for imdb_id, result in zip(imdb_ids, found)]
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""
+Cache web pages downloaded by the search module in a local sqlite database.
+
+Every page is kept with the ETag / Last-Modified validators sent by the server and an expiry time
+that depends on the kind of page (title pages change rarely, episode guides change often).
+Stale pages are revalidated with a conditional request, and the least recently used pages
+are evicted once the cache grows over its size limit.
+
+The cache is cache.db next to the watchlist database, unless WATCHLIST_CACHE_DB sets another path. Several
+processes can share it: the size limit applies to the pages stored in the file, whoever stored them.
+
+Typical usage example:
+> cache = ResponseCache()
+> entry = cache.lookup(url)
+> if entry is None or not entry.fresh:
+>     cache.store(url, body, etag, last_modified, elapsed)
+> cache.stats()
+"""
+from typing import Dict, NamedTuple, Optional
+from metrics import timed
+import database
+import os
+import re
+import sqlite3
+import threading
+import time
+
+CACHE_PATH = os.environ.get("WATCHLIST_CACHE_DB") # None: cache.db in the directory of the watchlist database
+MAX_CACHE_BYTES = 200 * 1024 * 1024
+
+DEFAULT_TTL = 60 * 60
+# (url pattern, seconds a page stays fresh), the first matching pattern wins
+TTL_RULES = [
+    (re.compile(r"/title/tt\d+/episodes"), 6 * 60 * 60), # episode guides: airdates change often
+    (re.compile(r"/title/tt\d+/?$"), 3 * 24 * 60 * 60), # title pages: only the rating moves
+    (re.compile(r"/find/"), 24 * 60 * 60), # search results
+]
+
+CREATE_RESPONSES_TABLE = """CREATE TABLE IF NOT EXISTS responses(
+    url TEXT PRIMARY KEY,
+    body TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    expires_at REAL,
+    last_used REAL,
+    size INTEGER,
+    elapsed REAL
+    );"""
+CREATE_LAST_USED_INDEX = "CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used);"
+CREATE_SIZE_INDEX = "CREATE INDEX IF NOT EXISTS idx_responses_size ON responses(size);" # sums the sizes without reading the pages
+
+SELECT_RESPONSE = "SELECT body, etag, last_modified, expires_at, elapsed FROM responses WHERE url = ?;"
+INSERT_RESPONSE = "INSERT OR REPLACE INTO responses (url, body, etag, last_modified, expires_at, last_used, size, elapsed) VALUES (?,?,?,?,?,?,?,?);"
+TOUCH_RESPONSE = "UPDATE responses SET last_used = ? WHERE url = ?;"
+REVALIDATE_RESPONSE = "UPDATE responses SET expires_at = ?, last_used = ? WHERE url = ?;"
+SELECT_TOTAL_SIZE = "SELECT COALESCE(SUM(size), 0) FROM responses;"
+SELECT_LEAST_RECENTLY_USED = "SELECT url, size FROM responses ORDER BY last_used LIMIT ?;"
+DELETE_RESPONSE = "DELETE FROM responses WHERE url = ?;"
+
+
+def ttl_for(url: str) -> int:
+    """
+    Return how many seconds a page downloaded from url stays fresh.
+    """
+    for pattern, ttl in TTL_RULES:
+        if pattern.search(url):
+            return ttl
+    return DEFAULT_TTL
+
+
+def default_path() -> str:
+    """
+    Return WATCHLIST_CACHE_DB, or cache.db in the directory of the watchlist database.
+    """
+    return CACHE_PATH or os.path.join(os.path.dirname(os.path.abspath(database.database_path)), "cache.db")
+
+
+class CacheEntry(NamedTuple):
+    """ A cached page and the validators needed to revalidate it """
+    body: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fresh: bool
+    elapsed: float
+
+
+class ResponseCache:
+    """
+    Persistent cache of downloaded pages.
+
+    Attributes:
+    path: sqlite file the pages are stored in (see default_path)
+    max_bytes: total size of cached pages before least recently used pages are evicted
+    """
+    def __init__(self, path: str = None, max_bytes: int = MAX_CACHE_BYTES):
+        self.path = path or default_path()
+        self.max_bytes = max_bytes
+        self.__lock = threading.Lock()
+        # other processes may be storing pages too, wait for them like the watchlist database does
+        self.__connection = sqlite3.connect(self.path, timeout=database.BUSY_TIMEOUT, check_same_thread=False)
+        self.__stats = {"hits": 0, "misses": 0, "revalidated": 0, "stored": 0, "evicted": 0,
+                        "bytes_saved": 0, "seconds_saved": 0.0}
+        with self.__lock, self.__connection:
+            self.__connection.execute(CREATE_RESPONSES_TABLE)
+            self.__connection.execute(CREATE_LAST_USED_INDEX)
+            self.__connection.execute(CREATE_SIZE_INDEX)
+
+    @timed('cache.lookup')
+    def lookup(self, url: str) -> Optional[CacheEntry]:
+        """
+        Find a cached page. Fresh pages count as a hit, stale or missing pages as a miss.
+
+        Args:
+        url (str): web address of the page
+
+        Return:
+        CacheEntry: the cached page, or None when the page is not cached
+        """
+        now = time.time()
+        with self.__lock, self.__connection:
+            row = self.__connection.execute(SELECT_RESPONSE, (url,)).fetchone()
+            if row is None:
+                self.__stats["misses"] += 1
+                return None
+
+            body, etag, last_modified, expires_at, elapsed = row
+            fresh = expires_at > now
+            if fresh:
+                self.__connection.execute(TOUCH_RESPONSE, (now, url))
+                self.__count_saved(body, elapsed)
+            else:
+                self.__stats["misses"] += 1
+            return CacheEntry(body, etag, last_modified, fresh, elapsed)
+
+    def revalidated(self, url: str):
+        """
+        Mark a stale page as fresh again after the server answered 304 Not Modified.
+        """
+        now = time.time()
+        with self.__lock, self.__connection:
+            self.__connection.execute(REVALIDATE_RESPONSE, (now + ttl_for(url), now, url))
+            self.__stats["revalidated"] += 1
+
+    @timed('cache.store')
+    def store(self, url: str, body: str, etag: Optional[str] = None, last_modified: Optional[str] = None, elapsed: float = 0.0):
+        """
+        Store a downloaded page and evict least recently used pages if the cache is too big.
+
+        Args:
+        url (str): web address of the page
+        body (str): html of the page
+        etag (str): ETag header of the response
+        last_modified (str): Last-Modified header of the response
+        elapsed (float): seconds it took to download the page
+        """
+        now = time.time()
+        size = len(body.encode())
+        with self.__lock, self.__connection:
+            self.__connection.execute(INSERT_RESPONSE, (url, body, etag, last_modified, now + ttl_for(url), now, size, elapsed))
+            self.__stats["stored"] += 1
+            self.__evict()
+
+    def stats(self) -> Dict:
+        """
+        Return hit / miss counters of this process and the network time the cache saved.
+        """
+        with self.__lock:
+            stats = dict(self.__stats)
+            stats["size"] = self.__connection.execute(SELECT_TOTAL_SIZE).fetchone()[0]
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def __count_saved(self, body: str, elapsed: float):
+        self.__stats["hits"] += 1
+        self.__stats["bytes_saved"] += len(body)
+        self.__stats["seconds_saved"] += elapsed
+
+    def __evict(self):
+        # the size of the stored pages, in the write transaction of store(): no other process changes it meanwhile
+        total_size = self.__connection.execute(SELECT_TOTAL_SIZE).fetchone()[0]
+        while total_size > self.max_bytes:
+            rows = self.__connection.execute(SELECT_LEAST_RECENTLY_USED, (100,)).fetchall()
+            if not rows:
+                break
+            for url, size in rows:
+                self.__connection.execute(DELETE_RESPONSE, (url,))
+                total_size -= size
+                self.__stats["evicted"] += 1
+                if total_size <= self.max_bytes:
+                    break
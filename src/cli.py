@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+"""
+Script the watchlist without the menus: one command per operation, JSON output.
+
+Every command prints its result to stdout as one JSON document (--format json, the default)
+or one JSON object per line (--format ndjson, streamed as rows are read). Progress messages go
+to stderr. Only the modules a command needs are imported, so commands that only read the
+database start without loading the scrapers.
+
+Commands:
+- add: look up titles on IMDB by id and add them to the watchlist
+- search: search IMDB by title (or the watchlist with --local)
+- list: list the movies, tv shows or watched movies of the watchlist
+- upcoming: list the upcoming episodes (--refresh syncs the episodes first)
+- watch: mark a movie as watched by a user
+- add-user: add a user to the app
+- import: import a file of IMDB ids
+- serve: share the watchlist through a local HTTP server with a JSON API (see server.py)
+- stats: statistics of the watchlist (watched movies per user, ratings, runtimes, releases per year)
+- datasets: download and ingest the IMDb datasets, for offline lookups (see datasets.py)
+- timeline: list the releases of movies and the airdates of episodes between two dates, in date order
+
+The exit status is 1 when a title, file or user could not be processed.
+
+Typical usage example:
+> python app.py add 0944947 16358384
+> python app.py list movies --upcoming --order-by release_date --format ndjson
+> python app.py upcoming --refresh | jq '.[].show_title'
+> python app.py timeline --days 30 --user alice --unwatched
+"""
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Sequence, TextIO
+import argparse
+import contextlib
+import json
+import os
+import sys
+import database
+
+COMMANDS = ['add', 'search', 'list', 'upcoming', 'watch', 'add-user', 'import', 'serve', 'stats', 'datasets', 'timeline']
+
+
+def record_to_dict(record: NamedTuple) -> Dict:
+    """
+    Convert a record of the records module to a dict, named like the columns of records.to_dataframe.
+    """
+    return {field.rstrip('_'): value for field, value in zip(record._fields, record)}
+
+
+def row_to_dict(row: Sequence, columns: Sequence[str]) -> Dict:
+    """
+    Convert a database row to a dict (the trailing '_' of column names like type_ is dropped).
+    """
+    return {column.rstrip('_'): value for column, value in zip(columns, row)}
+
+
+def write(items: Iterable[Dict], output_format: str, output: TextIO = None):
+    """
+    Write items as a JSON list, or as one JSON object per line (written as soon as each item is ready).
+    """
+    output = output or sys.stdout
+    if output_format == 'ndjson':
+        for item in items:
+            output.write(json.dumps(item, ensure_ascii=False) + "\n")
+    else:
+        json.dump(list(items), output, ensure_ascii=False, indent=2)
+        output.write("\n")
+
+
+def _lookup_many(imdb_ids: List[str]) -> List:
+    import search
+    if search.METADATA == 'datasets': # local lookups, nothing to wait for
+        offline_search, records = search.new_search(), []
+        for imdb_id in imdb_ids:
+            try:
+                records.append(offline_search.search_by_id(imdb_id))
+            except Exception as e:
+                records.append(e)
+        return records
+    import asyncio
+    from async_search import AsyncSearch
+    return asyncio.run(AsyncSearch().search_many_by_id(imdb_ids))
+
+
+def add(args) -> List[Dict]:
+    records = _lookup_many(args.imdb_ids)
+    results = []
+    for imdb_id, record in zip(args.imdb_ids, records):
+        if isinstance(record, Exception):
+            results.append({'imdb_id': imdb_id, 'error': str(record)})
+        elif args.kind is not None and record.is_tv_show != (args.kind == 'show'):
+            results.append({'imdb_id': imdb_id, 'title': record.title, 'error': f"not a {args.kind} but a {record.type_!r}"})
+        else:
+            database.add_title(record)
+            results.append(dict(record_to_dict(record), kind='show' if record.is_tv_show else 'movie', added=True))
+    return results
+
+
+def search(args) -> Iterable[Dict]:
+    if args.local:
+        kinds = [args.kind] if args.kind else ['movie', 'show']
+        for kind in kinds:
+            rows = database.search_movies(args.title) if kind == 'movie' else database.search_shows(args.title)
+            columns = database.MOVIE_COLUMNS if kind == 'movie' else database.SHOW_COLUMNS
+            for row in rows[:args.limit]:
+                yield dict(row_to_dict(row, columns), kind=kind)
+        return
+
+    from search import clean_search_results, new_search
+    results = clean_search_results(new_search().search_by_title(args.title))
+    if args.kind is not None:
+        results = [result for result in results if result.is_tv_show == (args.kind == 'show')]
+    for result in results[:args.limit]:
+        yield dict(record_to_dict(result), kind='show' if result.is_tv_show else 'movie')
+
+
+def list_titles(args) -> Iterable[Dict]:
+    options = {'order_by': args.order_by, 'descending': args.desc, 'limit': args.limit}
+    if args.what == 'shows':
+        rows, columns = database.iter_shows(upcoming=args.upcoming, running=args.running, **options), database.SHOW_COLUMNS
+    elif args.what == 'watched':
+        rows, columns = database.iter_watched_movies(args.user, **options), database.MOVIE_COLUMNS
+    else:
+        rows, columns = database.iter_movies(upcoming=args.upcoming, **options), database.MOVIE_COLUMNS
+    return (row_to_dict(row, columns) for row in rows)
+
+
+def upcoming(args) -> Iterable[Dict]:
+    if args.refresh:
+        import sync
+        imdb_ids = [id_[0] for id_ in database.get_imdb_id()]
+        for _, title, message in sync.sync_shows(imdb_ids):
+            print(f"{title}: {message}", file=sys.stderr)
+    return (row_to_dict(row, database.UPCOMING_EPISODE_COLUMNS) for row in database.get_upcoming_episodes())
+
+
+def watch(args) -> List[Dict]:
+    result = {'username': args.username, 'movie_id': args.movie_id}
+    try:
+        added = database.watch_movie(args.username, args.movie_id)
+    except database.NotFoundError as e:
+        return [dict(result, watched=False, error=str(e))]
+    result['watched'] = added
+    if not added:
+        result['error'] = "already watched"
+    return [result]
+
+
+def add_user(args) -> List[Dict]:
+    try:
+        database.add_user(args.username)
+    except database.sqlite3.IntegrityError:
+        return [{'username': args.username, 'error': "already exists"}]
+    return [{'username': args.username, 'added': True}]
+
+
+def import_file(args) -> List[Dict]:
+    import importer
+    try:
+        with contextlib.redirect_stdout(sys.stderr): # progress messages
+            summary = importer.import_file(args.path)
+    except OSError as e:
+        return [{'path': args.path, 'error': str(e)}]
+    return [dict(summary, path=args.path)]
+
+
+def serve(args):
+    import server
+    server.serve(args.host, args.port, args.workers)
+
+
+def watchlist_stats(args) -> List[Dict]:
+    import stats
+    return [stats.watchlist_stats()]
+
+
+def ingest_datasets(args) -> List[Dict]:
+    import datasets
+    if args.database:
+        datasets.configure(args.database)
+    with contextlib.redirect_stdout(sys.stderr): # progress messages
+        if args.download:
+            datasets.download_all(args.directory)
+        summaries = datasets.ingest(args.directory, args.force)
+    if not summaries:
+        return [{'directory': args.directory, 'error': "no dataset files (title.basics.tsv.gz...), try --download"}]
+    return [dict(summary, dataset=name) for name, summary in summaries.items()]
+
+
+def _date(text: str) -> date:
+    try:
+        return datetime.strptime(text, "%Y-%m-%d").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date {text!r} (expected YYYY-MM-DD)")
+
+
+def _timestamp(day: date) -> float:
+    return datetime.combine(day, datetime.min.time()).timestamp()
+
+
+def timeline(args) -> Iterable[Dict]:
+    start = args.start or date.today()
+    end = None
+    if args.end:
+        end = _timestamp(args.end + timedelta(days=1)) # --to is included
+    elif args.days:
+        end = _timestamp(start + timedelta(days=args.days))
+    rows = database.get_timeline(_timestamp(start), end, args.limit, args.user, args.unwatched)
+    for row in rows:
+        item = row_to_dict(row, database.TIMELINE_COLUMNS)
+        item['date'] = datetime.fromtimestamp(item['at']).date().isoformat()
+        yield item
+
+
+def build_parser() -> argparse.ArgumentParser:
+    # the output options are accepted before and after the command. The parser and the commands get
+    # their own copies: set_defaults changes the default of the arguments it is called on, and a default
+    # in a command would replace the value given before the command
+    def new_output_options() -> argparse.ArgumentParser:
+        options = argparse.ArgumentParser(add_help=False, argument_default=argparse.SUPPRESS)
+        options.add_argument('--format', choices=['json', 'ndjson'], help="one JSON list (default), or one JSON object per line")
+        options.add_argument('--profile', action='store_true', help="print the time spent downloading, parsing and querying to stderr")
+        options.add_argument('--metrics', help="file the metrics are written to: Prometheus text format for a .prom file, JSON otherwise")
+        return options
+    parser = argparse.ArgumentParser(prog="app.py", description="Script the watchlist, with JSON output.", parents=[new_output_options()])
+    parser.set_defaults(format='json', profile=False, metrics=None)
+    output_options = new_output_options()
+    commands = parser.add_subparsers(dest='command', required=True, metavar='command')
+
+    def kind_options(command: argparse.ArgumentParser):
+        kind = command.add_mutually_exclusive_group()
+        kind.add_argument('--movie', dest='kind', action='store_const', const='movie', help="movies only")
+        kind.add_argument('--tv', dest='kind', action='store_const', const='show', help="tv shows only")
+
+    command = commands.add_parser('add', parents=[output_options], help="look up titles on IMDB by id and add them to the watchlist")
+    command.add_argument('imdb_ids', nargs='+', metavar='imdb_id', help="IMDB id (only numbers)")
+    kind_options(command)
+    command.set_defaults(function=add)
+
+    command = commands.add_parser('search', parents=[output_options], help="search IMDB by title")
+    command.add_argument('title', help="(partial) title")
+    command.add_argument('--local', action='store_true', help="search the watchlist instead of IMDB")
+    command.add_argument('--limit', type=int, default=25, help="results per kind of title")
+    kind_options(command)
+    command.set_defaults(function=search)
+
+    command = commands.add_parser('list', parents=[output_options], help="list the titles of the watchlist")
+    command.add_argument('what', choices=['movies', 'shows', 'watched'])
+    command.add_argument('--upcoming', action='store_true', help="upcoming movies, or shows with an upcoming episode")
+    command.add_argument('--running', action='store_true', help="shows still running")
+    command.add_argument('--user', help="user of the watched movies")
+    command.add_argument('--order-by', choices=sorted(database.PAGE_SORT_COLUMNS), default='id', help="next_airdate for shows only")
+    command.add_argument('--desc', action='store_true', help="descending order")
+    command.add_argument('--limit', type=int)
+    command.set_defaults(function=list_titles)
+
+    command = commands.add_parser('upcoming', parents=[output_options], help="list the upcoming episodes")
+    command.add_argument('--refresh', action='store_true', help="sync the episodes with IMDB first")
+    command.set_defaults(function=upcoming)
+
+    command = commands.add_parser('watch', parents=[output_options], help="mark a movie as watched")
+    command.add_argument('username')
+    command.add_argument('movie_id', help="id of the movie in the watchlist (NOT the IMDB id)")
+    command.set_defaults(function=watch)
+
+    command = commands.add_parser('add-user', parents=[output_options], help="add a user to the app")
+    command.add_argument('username')
+    command.set_defaults(function=add_user)
+
+    command = commands.add_parser('import', parents=[output_options], help="import a file of IMDB ids (a list of ids or an IMDb CSV export)")
+    command.add_argument('path')
+    command.set_defaults(function=import_file)
+
+    command = commands.add_parser('serve', parents=[output_options], help="share the watchlist through a local HTTP server")
+    command.add_argument('--host', default='127.0.0.1', help="address to listen on (0.0.0.0 for every interface)")
+    command.add_argument('--port', type=int, default=8080)
+    command.add_argument('--workers', type=int, default=8, help="requests handled at the same time")
+    command.set_defaults(function=serve)
+
+    command = commands.add_parser('stats', parents=[output_options], help="statistics of the watchlist")
+    command.set_defaults(function=watchlist_stats)
+
+    command = commands.add_parser('datasets', parents=[output_options], help="ingest the IMDb datasets for offline lookups (WATCHLIST_METADATA=datasets)")
+    command.add_argument('--directory', default='.', help="directory of the .tsv.gz files")
+    command.add_argument('--download', action='store_true', help="download the files that changed first")
+    command.add_argument('--database', help="datasets database (imdb.db by default)")
+    command.add_argument('--force', action='store_true', help="ingest files even if they did not change")
+    command.set_defaults(function=ingest_datasets)
+
+    command = commands.add_parser('timeline', parents=[output_options], help="list the upcoming movies and episodes in date order")
+    command.add_argument('--from', dest='start', type=_date, help="first day (YYYY-MM-DD), today by default")
+    command.add_argument('--to', dest='end', type=_date, help="last day (YYYY-MM-DD)")
+    command.add_argument('--days', type=int, help="days from the first day, when there is no --to")
+    command.add_argument('--limit', type=int, help="at most this many items")
+    command.add_argument('--user', help="with whether this user watched each movie")
+    command.add_argument('--unwatched', action='store_true', help="without the movies the user watched (needs --user)")
+    command.set_defaults(function=timeline)
+    return parser
+
+
+def main(argv: List[str] = None) -> int:
+    """
+    Run a command.
+
+    Return:
+    int: exit status, 1 when an item of the output has an error
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'list' and args.what == 'watched' and not args.user:
+        parser.error("list watched needs --user")
+    if args.command == 'list':
+        table_name = 'shows' if args.what == 'shows' else 'movies'
+        if args.order_by not in database.PAGE_SORT_KEYS[table_name]:
+            parser.error(f"list {args.what} can be ordered by {', '.join(database.PAGE_SORT_KEYS[table_name])}")
+    if args.command == 'timeline' and args.unwatched and not args.user:
+        parser.error("timeline --unwatched needs --user")
+
+    failed = False
+    def check(items: Iterable[Dict]) -> Iterable[Dict]:
+        nonlocal failed
+        for item in items:
+            failed = failed or 'error' in item or bool(item.get('failed'))
+            yield item
+
+    with contextlib.redirect_stdout(sys.stderr): # progress of the migrations
+        database.create_tables()
+    try:
+        items = args.function(args)
+        if items is not None:
+            write(check(items), args.format)
+    except BrokenPipeError:
+        # the reader stopped early (e.g. | head), don't report it again when the interpreter flushes stdout
+        sys.stdout = open(os.devnull, 'w')
+    finally:
+        if args.profile or args.metrics:
+            import metrics
+            if args.profile:
+                print(metrics.summary(), file=sys.stderr)
+            if args.metrics:
+                metrics.export(args.metrics)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
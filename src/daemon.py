@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+Keep the watchlist fresh in the background.
+
+The refresh daemon keeps every movie and tv show of the watchlist in a priority queue, ordered by when
+it is next due for a refresh. How often a title is refreshed depends on how likely it is to change:
+shows with an episode airing soon every few hours, running shows daily, released movies rarely.
+Refreshed titles and episodes are written to the database only where they changed, so the menus
+always read fresh local data.
+
+All titles share a request budget: the rate limit of the fetch module is set to REQUEST_BUDGET
+requests to IMDB per hour (pages served from the response cache are free).
+
+Typical usage example:
+> python app.py --daemon
+> run(budget=200)
+"""
+from typing import Dict, List, Optional, Tuple
+import heapq
+import time
+from search import new_search
+import database
+import fetch
+import sync
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+REQUEST_BUDGET = 300 # requests to IMDB per hour
+RELOAD_INTERVAL = 5 * 60 # seconds between two reads of the watchlist, to pick up added and deleted titles
+RETRY_DELAY = HOUR # seconds before a title that failed to refresh is tried again
+
+
+def refresh_interval(kind: str, release_date_timestamp: Optional[float], next_airdate_timestamp: Optional[float],
+                     end_year: Optional[int], now: float) -> float:
+    """
+    Return how long a refresh of a title stays good, depending on how soon it is likely to change.
+    """
+    if kind == 'show':
+        if next_airdate_timestamp is not None and next_airdate_timestamp - now < 7 * DAY:
+            return 6 * HOUR # an episode airs soon: airdates and titles are still being corrected
+        if end_year is None:
+            return DAY # still running: new episodes can be announced any time
+        return 30 * DAY # ended
+    if release_date_timestamp is None or release_date_timestamp > now:
+        return DAY # upcoming: release date and details still change
+    if now - release_date_timestamp < 365 * DAY:
+        return 7 * DAY # recent: the rating still moves
+    return 90 * DAY
+
+
+def load_schedule(retry_at: Dict[str, float] = None) -> List[Tuple]:
+    """
+    Return the priority queue of every title of the watchlist: (due at, 'movie' or 'show', imdb_id).
+    Titles that failed to refresh are not due before their retry time (retry_at, by imdb_id).
+    """
+    now = time.time()
+    retry_at = retry_at or {}
+    schedule = [(max(due_at(row, now), retry_at.get(row[1], 0)), row[0], row[1]) for row in database.get_refresh_schedule()]
+    heapq.heapify(schedule)
+    return schedule
+
+
+def due_at(row: Tuple, now: float) -> float:
+    kind, _, release_date_timestamp, next_airdate_timestamp, end_year, refreshed_at = row
+    return (refreshed_at or 0) + refresh_interval(kind, release_date_timestamp, next_airdate_timestamp, end_year, now)
+
+
+def refresh_title(kind: str, imdb_id: str) -> str:
+    """
+    Download the information of a title (and the episodes of a show) and store what changed.
+
+    Return:
+    str: what was refreshed
+    """
+    record = new_search(kind == 'show').search_by_id(imdb_id)
+    if record.is_tv_show != (kind == 'show'):
+        raise Exception(f"IMDB lists it as a {record.type_!r} now")
+    database.add_title(record)
+    message = f"{record.title!r} ({record.rating})"
+    if kind == 'show':
+        _, episodes, seasons = sync.sync_show(imdb_id)
+        message += f", {episodes} episodes from {seasons} seasons"
+    return message
+
+
+def run(budget: int = REQUEST_BUDGET, reload_interval: float = RELOAD_INTERVAL):
+    """
+    Refresh the titles of the watchlist as they become due, until interrupted (Ctrl+C).
+
+    Args:
+    budget (int): requests to IMDB per hour
+    reload_interval (float): seconds between two reads of the watchlist
+    """
+    # requests wait in fetch for the budget, a burst of a minute's worth at most
+    fetch.configure(rate=budget / HOUR, burst=max(1, budget // 60))
+    retry_at = {}
+    schedule = load_schedule()
+    next_reload = time.time() + reload_interval
+    print(f"-- Refreshing {len(schedule)} titles, at most {budget} requests per hour (Ctrl+C to stop) --")
+    try:
+        while True:
+            now = time.time()
+            if now >= next_reload:
+                schedule, next_reload = load_schedule(retry_at), now + reload_interval
+            if not schedule or schedule[0][0] > now:
+                time.sleep(min(schedule[0][0] if schedule else next_reload, next_reload) - now)
+                continue
+
+            _, kind, imdb_id = heapq.heappop(schedule)
+            if not database.get_refresh_schedule(imdb_id):
+                continue # deleted from the watchlist since the last reload
+            try:
+                message = refresh_title(kind, imdb_id)
+                database.set_refreshed(kind, imdb_id, time.time())
+                retry_at.pop(imdb_id, None)
+                row = database.get_refresh_schedule(imdb_id)[0]
+                heapq.heappush(schedule, (due_at(row, time.time()), kind, imdb_id))
+            except Exception as e:
+                message = f"unable to refresh tt{imdb_id}: {e}"
+                retry_at[imdb_id] = time.time() + RETRY_DELAY
+                heapq.heappush(schedule, (retry_at[imdb_id], kind, imdb_id))
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {kind} tt{imdb_id}: {message}")
+    except KeyboardInterrupt:
+        print("\n-- Refresh stopped --")
@@ -2,16 +2,46 @@
 """
 Create a local database and interact with it.
 
-This database consists of 4 tables:
+This database consists of 7 tables:
 1) movies: to keep tarck of movies.
 2) shows: to keep track of tv shows.
 3) users: to keep track of users.
 4) watched: to keep track of watched movies (only for the movie wachlist).
+5) episodes: to keep track of the episodes of tv shows and their airdates.
+6) seasons: to keep track of which seasons of a tv show are synced and whether they finished airing.
+7) timeline: the releases of movies and the airdates of episodes by date, kept up to date by triggers.
+
+When sqlite is compiled with FTS5, movies_fts and shows_fts index the title and description
+of movies and shows for the local search.
+
+A movie or tv show is stored once per IMDB id: adding it again refreshes its information in place.
+
+create_tables() creates the tables of a new database and upgrades older ones, see migrations.py.
+
+The database file is data.db in the working directory, unless WATCHLIST_DB or configure() set another path.
+Every thread gets its own connection, in WAL mode so that readers never block the writer. Writes from
+concurrent workers can go through the write queue, which batches them into few transactions.
+
+The results of the read functions (get_movies, get_shows, get_imdb_id...) are kept in an LRU cache
+until the database changes: a write function of this module ran, or another process committed (seen
+through PRAGMA data_version). query_cache.stats() counts its hits and misses.
 """
 
-from typing import Tuple
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import wraps
+from typing import Callable, Dict, Hashable, Iterator, List, Optional, Sequence, Set, Tuple
+from metrics import count, timed
+from parsers import parse_years
+from records import TitleRecord
+import migrations
+import copy
 import datetime
+import os
+import queue
 import sqlite3
+import threading
+import time
 
 CREATE_MOVIES_TABLE = """CREATE TABLE IF NOT EXISTS movies(
     id INTEGER PRIMARY KEY,
@@ -21,10 +51,13 @@ CREATE_MOVIES_TABLE = """CREATE TABLE IF NOT EXISTS movies(
     rating TEXT,
     type_ TEXT,
     runtime TEXT,
-    description TEXT
+    description TEXT,
+    refreshed_at REAL
     );"""
 
 # seperate table for future extentions
+# release_date_timestamp of a show is its release date as shown on IMDB (e.g. '2019–2023'),
+# start_year / end_year / next_airdate_timestamp are the numbers used to query by date
 CREATE_SHOWS_TABLE = """CREATE TABLE IF NOT EXISTS shows(
     id INTEGER PRIMARY KEY,
     imdb_id TEXT,
@@ -33,9 +66,18 @@ CREATE_SHOWS_TABLE = """CREATE TABLE IF NOT EXISTS shows(
     rating TEXT,
     type_ TEXT,
     runtime TEXT,
-    description TEXT
+    description TEXT,
+    start_year INTEGER,
+    end_year INTEGER,
+    next_airdate_timestamp REAL,
+    refreshed_at REAL
     );"""
 
+# columns of the rows of movies and shows returned by the iter_* / get_* / search_* functions
+MOVIE_COLUMNS = ('id', 'imdb_id', 'title', 'release_date_timestamp', 'rating', 'type_', 'runtime', 'description', 'refreshed_at')
+SHOW_COLUMNS = ('id', 'imdb_id', 'title', 'release_date_timestamp', 'rating', 'type_', 'runtime', 'description',
+                'start_year', 'end_year', 'next_airdate_timestamp', 'refreshed_at')
+
 CREATE_USERS_TABLE = """CREATE TABLE IF NOT EXISTS users(
     username TEXT PRIMARY KEY,
     unique (username)
@@ -51,104 +93,861 @@ CREATE_WATCHED_TABLE = """CREATE TABLE IF NOT EXISTS watched(
 
 INSERT_USER = "INSERT INTO users (username) VALUES (?);"
 
-INSERT_MOVIES = "INSERT INTO movies (imdb_id, title, release_date_timestamp, rating, type_, runtime, description) VALUES (?,?,?,?,?,?,?);"
-SELECT_UPCOMING_MOVIES = "SELECT * FROM movies WHERE release_date_timestamp > ?;"
-SELECT_WATCHED_MOVIES = """SELECT DISTINCT movies.* FROM movies
+# adding a title that is already stored refreshes its information in place (the id stays the same),
+# the row is only written when something changed
+INSERT_MOVIES = """INSERT INTO movies (imdb_id, title, release_date_timestamp, rating, type_, runtime, description) VALUES (?,?,?,?,?,?,?)
+ON CONFLICT(imdb_id) DO UPDATE SET
+    title = excluded.title,
+    release_date_timestamp = excluded.release_date_timestamp,
+    rating = excluded.rating,
+    type_ = excluded.type_,
+    runtime = excluded.runtime,
+    description = excluded.description
+WHERE (title, release_date_timestamp, rating, type_, runtime, description)
+    IS NOT (excluded.title, excluded.release_date_timestamp, excluded.rating, excluded.type_, excluded.runtime, excluded.description);"""
+SELECT_UPCOMING_MOVIES_PAGE = """SELECT * FROM movies WHERE movies.release_date_timestamp > :today AND ({page})
+ORDER BY {order_by} LIMIT :limit;"""
+SELECT_WATCHED_MOVIES_PAGE = """SELECT movies.* FROM movies
 JOIN watched ON movies.id = watched.movie_id
 JOIN users ON users.username = watched.user_username
-WHERE users.username = ?;"""
+WHERE users.username = :username AND ({page})
+ORDER BY {order_by} LIMIT :limit;"""
 INSERT_WATCHED_MOVIE = "INSERT INTO watched (user_username, movie_id) VALUES (?,?);"
-SET_WATCHED_MOVIE = "UPDATE movies SET watched = 1 WHERE title = ?;"
+# foreign keys are not enforced (deleting a movie keeps who watched it), watch_movie checks them itself
+SELECT_USER = "SELECT 1 FROM users WHERE username = ?;"
+SELECT_MOVIE_ID = "SELECT 1 FROM movies WHERE id = ?;"
 CREATE_RELEASE_INDEX = "CREATE INDEX IF NOT EXISTS idx_movies_release ON movies(release_date_timestamp);"
 
 
 DELETE = "DELETE FROM {table_name} WHERE id = ?;"
-SELECT_ALL = "SELECT * FROM {table_name};"
-SEARCH = "SELECT * FROM {table_name} WHERE title LIKE ?;"
+SELECT_ALL_PAGE = "SELECT * FROM {table_name} WHERE {page} ORDER BY {order_by} LIMIT :limit;"
+# keyset pagination: a page starts after the (sort key, id) of the last row of the previous page, so every
+# page is a short indexed query whatever its position. Rows without a sort key come first in ascending
+# order (like ORDER BY does), they are listed as a segment of their own so that no condition needs an OR.
+PAGE_SORT_COLUMNS = {
+    'id': None,
+    'release_date': 'release_date_timestamp',
+    'next_airdate': 'next_airdate_timestamp',
+}
+# the sort keys of every table (only tv shows have a next airdate)
+PAGE_SORT_KEYS = {
+    'movies': ('id', 'release_date'),
+    'shows': ('id', 'release_date', 'next_airdate'),
+}
+PAGE_SEGMENTS = {
+    # sorted by a column: (condition of the first page, condition of the rows after :key, :id) of every segment, ascending
+    False: [("1", "{table_name}.id {after} :id")],
+    True: [
+        ("{table_name}.{column} IS NULL", "{table_name}.{column} IS NULL AND {table_name}.id {after} :id"),
+        ("{table_name}.{column} IS NOT NULL", "({table_name}.{column}, {table_name}.id) {after} (:key, :id)"),
+    ],
+}
+SEARCH = "SELECT * FROM {table_name} WHERE title LIKE ? OR description LIKE ?;"
+
+# full-text index over title and description, kept in sync with the table by triggers
+CREATE_FTS_TABLE = "CREATE VIRTUAL TABLE IF NOT EXISTS {table_name}_fts USING fts5(title, description, content='{table_name}', content_rowid='id');"
+CREATE_FTS_INSERT_TRIGGER = """CREATE TRIGGER IF NOT EXISTS {table_name}_fts_insert AFTER INSERT ON {table_name} BEGIN
+    INSERT INTO {table_name}_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+END;"""
+CREATE_FTS_DELETE_TRIGGER = """CREATE TRIGGER IF NOT EXISTS {table_name}_fts_delete AFTER DELETE ON {table_name} BEGIN
+    INSERT INTO {table_name}_fts ({table_name}_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+END;"""
+CREATE_FTS_UPDATE_TRIGGER = """CREATE TRIGGER IF NOT EXISTS {table_name}_fts_update AFTER UPDATE OF title, description ON {table_name} BEGIN
+    INSERT INTO {table_name}_fts ({table_name}_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+    INSERT INTO {table_name}_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+END;"""
+SELECT_FTS_TABLE = "SELECT name FROM sqlite_master WHERE type = 'table' AND name = '{table_name}_fts';"
+# matches in the title weigh ten times more than matches in the description
+SEARCH_FTS = """SELECT {table_name}.* FROM {table_name}_fts
+JOIN {table_name} ON {table_name}.id = {table_name}_fts.rowid
+WHERE {table_name}_fts MATCH ?
+ORDER BY bm25({table_name}_fts, 10.0, 1.0);"""
 #--------------------------------------
 
-INSERT_SHOWS = "INSERT INTO shows (imdb_id, title, release_date_timestamp, rating, type_, runtime, description) VALUES (?,?,?,?,?,?,?);"
+CREATE_EPISODES_TABLE = """CREATE TABLE IF NOT EXISTS episodes(
+    show_imdb_id TEXT,
+    season INTEGER,
+    episode INTEGER,
+    title TEXT,
+    airdate TEXT,
+    airdate_timestamp REAL,
+    PRIMARY KEY (show_imdb_id, season, episode)
+    );"""
+
+CREATE_SEASONS_TABLE = """CREATE TABLE IF NOT EXISTS seasons(
+    show_imdb_id TEXT,
+    season INTEGER,
+    synced_at REAL,
+    finished INTEGER,
+    PRIMARY KEY (show_imdb_id, season)
+    );"""
+
+CREATE_AIRDATE_INDEX = "CREATE INDEX IF NOT EXISTS idx_episodes_airdate ON episodes(airdate_timestamp);"
+
+INSERT_EPISODES = """INSERT INTO episodes (show_imdb_id, season, episode, title, airdate, airdate_timestamp) VALUES (?,?,?,?,?,?)
+ON CONFLICT (show_imdb_id, season, episode) DO UPDATE SET title = excluded.title, airdate = excluded.airdate, airdate_timestamp = excluded.airdate_timestamp
+WHERE (title, airdate, airdate_timestamp) IS NOT (excluded.title, excluded.airdate, excluded.airdate_timestamp);"""
+INSERT_SEASON = """INSERT INTO seasons (show_imdb_id, season, synced_at, finished) VALUES (?,?,?,?)
+ON CONFLICT (show_imdb_id, season) DO UPDATE SET synced_at = excluded.synced_at, finished = excluded.finished;"""
+SELECT_SEASONS = "SELECT season, finished FROM seasons WHERE show_imdb_id = ?;"
+UPCOMING_EPISODE_COLUMNS = ('airdate_timestamp', 'show_title', 'season', 'episode', 'title', 'airdate')
+SELECT_UPCOMING_EPISODES = """SELECT episodes.airdate_timestamp, shows.title, episodes.season, episodes.episode, episodes.title, episodes.airdate FROM episodes
+JOIN shows ON shows.imdb_id = episodes.show_imdb_id
+WHERE episodes.airdate_timestamp >= ?
+ORDER BY episodes.airdate_timestamp;"""
+DELETE_SHOW_EPISODES = "DELETE FROM {table_name} WHERE show_imdb_id IN (SELECT imdb_id FROM shows WHERE id = ?);"
+
+INSERT_SHOWS = """INSERT INTO shows (imdb_id, title, release_date_timestamp, rating, type_, runtime, description, start_year, end_year)
+VALUES (?,?,?,?,?,?,?,?,?)
+ON CONFLICT(imdb_id) DO UPDATE SET
+    title = excluded.title,
+    release_date_timestamp = excluded.release_date_timestamp,
+    rating = excluded.rating,
+    type_ = excluded.type_,
+    runtime = excluded.runtime,
+    description = excluded.description,
+    start_year = excluded.start_year,
+    end_year = excluded.end_year
+WHERE (title, release_date_timestamp, rating, type_, runtime, description)
+    IS NOT (excluded.title, excluded.release_date_timestamp, excluded.rating, excluded.type_, excluded.runtime, excluded.description);"""
+SELECT_UPCOMING_SHOWS_PAGE = """SELECT * FROM shows WHERE shows.next_airdate_timestamp >= :today AND ({page})
+ORDER BY {order_by} LIMIT :limit;"""
+SELECT_RUNNING_SHOWS_PAGE = """SELECT * FROM shows WHERE shows.end_year IS NULL AND shows.start_year IS NOT NULL AND ({page})
+ORDER BY {order_by} LIMIT :limit;"""
+CREATE_SHOW_YEARS_INDEX = "CREATE INDEX IF NOT EXISTS idx_shows_years ON shows(end_year, start_year);"
+CREATE_NEXT_AIRDATE_INDEX = "CREATE INDEX IF NOT EXISTS idx_shows_next_airdate ON shows(next_airdate_timestamp);"
+UPDATE_NEXT_AIRDATE = """UPDATE shows SET next_airdate_timestamp = (
+    SELECT MIN(airdate_timestamp) FROM episodes WHERE show_imdb_id = shows.imdb_id AND airdate_timestamp >= ?)
+WHERE imdb_id = ?;"""
+
 SELECT_IMDB_ID_SHOWS = "SELECT imdb_id FROM shows;"
+
+# what the refresh daemon needs to know when a title will change next
+SELECT_REFRESH_SCHEDULE = """SELECT 'movie', imdb_id, release_date_timestamp, NULL, NULL, refreshed_at FROM movies WHERE {movies}
+UNION ALL
+SELECT 'show', imdb_id, NULL, next_airdate_timestamp, end_year, refreshed_at FROM shows WHERE {shows};"""
+UPDATE_REFRESHED_AT = "UPDATE {table_name} SET refreshed_at = ? WHERE imdb_id = ?;"
+SELECT_IMDB_ID_ALL = "SELECT imdb_id FROM movies UNION SELECT imdb_id FROM shows;"
+
+CREATE_IMDB_ID_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS idx_{table_name}_imdb_id ON {table_name}(imdb_id);"
+
+# -- Timeline --
+# the release of every movie and the airdate of every episode, in one table indexed by date. Every item has a row
+# for everyone (username ''), and every movie a user watched a row for that user (watched = 1). The triggers below
+# keep the table in step with movies, watched, episodes and shows, so every write updates it in the same transaction.
+# key is 'movie:<movies.id>' or 'episode:<show imdb id>:<season>:<episode>', at is NULL while the date is unknown
+CREATE_TIMELINE_TABLE = """CREATE TABLE IF NOT EXISTS timeline(
+    key TEXT,
+    username TEXT NOT NULL DEFAULT '',
+    at REAL,
+    kind TEXT,
+    title TEXT,
+    show_title TEXT,
+    season INTEGER,
+    episode INTEGER,
+    movie_id INTEGER,
+    show_imdb_id TEXT,
+    watched INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (key, username)
+    );"""
+CREATE_TIMELINE_INDEX = "CREATE INDEX IF NOT EXISTS idx_timeline_at ON timeline(username, at);"
+TIMELINE_COLUMNS = ('at', 'kind', 'title', 'show_title', 'season', 'episode', 'movie_id', 'show_imdb_id', 'watched')
+# rows of the movies / episodes matching {condition}
+INSERT_MOVIES_TIMELINE = """INSERT OR REPLACE INTO timeline (key, at, kind, title, movie_id)
+SELECT 'movie:' || movies.id, movies.release_date_timestamp, 'movie', movies.title, movies.id FROM movies WHERE {condition};"""
+INSERT_EPISODES_TIMELINE = """INSERT OR REPLACE INTO timeline (key, at, kind, title, show_title, season, episode, show_imdb_id)
+SELECT 'episode:' || episodes.show_imdb_id || ':' || episodes.season || ':' || episodes.episode, episodes.airdate_timestamp,
+    'episode', episodes.title, shows.title, episodes.season, episodes.episode, episodes.show_imdb_id
+FROM episodes LEFT JOIN shows ON shows.imdb_id = episodes.show_imdb_id WHERE {condition};"""
+# rows of the watched movies matching {condition}, copies of the rows of the movies
+INSERT_WATCHED_TIMELINE = """INSERT OR REPLACE INTO timeline (key, username, at, kind, title, movie_id, watched)
+SELECT movie.key, watched.user_username, movie.at, movie.kind, movie.title, movie.movie_id, 1
+FROM watched JOIN timeline AS movie ON movie.key = 'movie:' || watched.movie_id AND movie.username = ''
+WHERE {condition};"""
+TIMELINE_OLD_EPISODE_KEY = "'episode:' || old.show_imdb_id || ':' || old.season || ':' || old.episode"
+# the episodes of a show are the keys between 'episode:<imdb id>:' and 'episode:<imdb id>;' (';' follows ':')
+TIMELINE_SHOW_EPISODES = "key >= 'episode:' || new.imdb_id || ':' AND key < 'episode:' || new.imdb_id || ';'"
+CREATE_TIMELINE_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS timeline_movie_insert AFTER INSERT ON movies BEGIN
+    """ + INSERT_MOVIES_TIMELINE.format(condition="movies.id = new.id") + """
+END;""",
+    """CREATE TRIGGER IF NOT EXISTS timeline_movie_update AFTER UPDATE OF title, release_date_timestamp ON movies BEGIN
+    UPDATE timeline SET at = new.release_date_timestamp, title = new.title WHERE key = 'movie:' || new.id;
+END;""",
+    """CREATE TRIGGER IF NOT EXISTS timeline_movie_delete AFTER DELETE ON movies BEGIN
+    DELETE FROM timeline WHERE key = 'movie:' || old.id;
+END;""",
+    """CREATE TRIGGER IF NOT EXISTS timeline_watched_insert AFTER INSERT ON watched BEGIN
+    """ + INSERT_WATCHED_TIMELINE.format(condition="watched.rowid = new.rowid") + """
+END;""",
+    """CREATE TRIGGER IF NOT EXISTS timeline_watched_delete AFTER DELETE ON watched BEGIN
+    DELETE FROM timeline WHERE key = 'movie:' || old.movie_id AND username = old.user_username;
+END;""",
+    """CREATE TRIGGER IF NOT EXISTS timeline_episode_insert AFTER INSERT ON episodes BEGIN
+    """ + INSERT_EPISODES_TIMELINE.format(
+        condition="episodes.show_imdb_id = new.show_imdb_id AND episodes.season = new.season AND episodes.episode = new.episode") + """
+END;""",
+    """CREATE TRIGGER IF NOT EXISTS timeline_episode_update AFTER UPDATE OF title, airdate_timestamp ON episodes BEGIN
+    UPDATE timeline SET at = new.airdate_timestamp, title = new.title WHERE key = """ + TIMELINE_OLD_EPISODE_KEY + """;
+END;""",
+    """CREATE TRIGGER IF NOT EXISTS timeline_episode_delete AFTER DELETE ON episodes BEGIN
+    DELETE FROM timeline WHERE key = """ + TIMELINE_OLD_EPISODE_KEY + """;
+END;""",
+    # episodes can be stored before their show
+    """CREATE TRIGGER IF NOT EXISTS timeline_show_insert AFTER INSERT ON shows BEGIN
+    UPDATE timeline SET show_title = new.title WHERE """ + TIMELINE_SHOW_EPISODES + """;
+END;""",
+    """CREATE TRIGGER IF NOT EXISTS timeline_show_update AFTER UPDATE OF title ON shows BEGIN
+    UPDATE timeline SET show_title = new.title WHERE """ + TIMELINE_SHOW_EPISODES + """;
+END;""",
+]
+# the items between two dates, in date order: a range of idx_timeline_at, and a lookup of the primary key
+# per item for whether :username watched it
+TIMELINE_WATCHED = "EXISTS (SELECT 1 FROM timeline AS mine WHERE mine.key = timeline.key AND mine.username = :username)"
+SELECT_TIMELINE = """SELECT at, kind, title, show_title, season, episode, movie_id, show_imdb_id, """ + TIMELINE_WATCHED + """
+FROM timeline WHERE username = '' AND at >= :start AND at < :end {unwatched}
+ORDER BY at LIMIT :limit;"""
 #-------------------------------------
 
-connection = sqlite3.connect("data.db")
+database_path = os.environ.get("WATCHLIST_DB", "data.db")
+fts_enabled = None # whether search_movies / search_shows use the full-text index, decided on first use
+
+PAGE_SIZE = 500 # rows fetched per query by the iter_* listing functions
+MAX_CACHED_QUERIES = 256 # results kept by the query cache (0 turns it off)
+BUSY_TIMEOUT = 30 # seconds to wait for another writer before failing with "database is locked"
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL;", # readers and one writer work at the same time (not supported on network drives)
+    "PRAGMA synchronous = NORMAL;", # with WAL, only checkpoints wait for the disk; a crash cannot corrupt the file
+    "PRAGMA cache_size = -65536;", # 64 MiB page cache per connection
+    "PRAGMA mmap_size = 268435456;", # read up to 256 MiB through memory-mapped I/O
+    "PRAGMA temp_store = MEMORY;",
+]
+
+_local = threading.local()
+_write_queue = None
+_write_queue_lock = threading.Lock()
+
+
+def configure(path: str):
+    """
+    Use the database file at path from now on. Connections to the previous file are replaced on their next use.
+    """
+    global database_path, fts_enabled
+    database_path = path
+    fts_enabled = None
+    query_cache.invalidate()
+
+def _connect(isolation_level: str = "") -> sqlite3.Connection:
+    connection = sqlite3.connect(database_path, timeout=BUSY_TIMEOUT, isolation_level=isolation_level)
+    for pragma in PRAGMAS:
+        connection.execute(pragma)
+    return connection
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Return the connection of the current thread, opening it on first use.
+    """
+    if getattr(_local, 'path', None) != database_path:
+        if getattr(_local, 'connection', None) is not None:
+            _local.connection.close()
+        _local.connection = _connect()
+        _local.path = database_path
+    return _local.connection
+
+
+class NotFoundError(Exception):
+    """ A user or title a write refers to is not in the database """
+
+
+class WriteQueue:
+    """
+    A single writer thread that stores the writes of many threads in few transactions.
+
+    Writes waiting in the queue are committed together, up to max_batch writes or max_delay seconds
+    after the first one. Each write runs in its own savepoint, so a failing write only fails its own future.
+
+    Attributes:
+    max_batch: maximum number of writes in one transaction
+    max_delay: seconds to wait for more writes before committing
+    """
+    def __init__(self, max_batch: int = 500, max_delay: float = 0.05):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.__queue = queue.Queue()
+        self.__thread = threading.Thread(target=self.__run, name="database-writer", daemon=True)
+        self.__thread.start()
+
+    def submit(self, statements: List[Tuple[str, Sequence]]) -> Future:
+        """
+        Queue a write made of one or more statements, committed or rolled back together.
+
+        Args:
+        statements (list): (sql, rows) pairs, every statement is executed once per row
+
+        Return:
+        Future: done once the write is committed, with the exception if the write failed
+        """
+        future = Future()
+        self.__queue.put((statements, future))
+        return future
+
+    def close(self):
+        """
+        Commit the queued writes and stop the writer thread.
+        """
+        self.__queue.put(None)
+        self.__thread.join()
+
+    def __run(self):
+        connection, path = None, None
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                break
+            batch = [item]
+            try:
+                deadline = time.monotonic() + self.max_delay
+                while len(batch) < self.max_batch:
+                    try:
+                        item = self.__queue.get(timeout=max(0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        self.__queue.put(None) # stop after this batch
+                        break
+                    batch.append(item)
+
+                if path != database_path:
+                    if connection is not None:
+                        connection.close()
+                    connection, path = None, None # connect again on the next batch if this fails
+                    connection = _connect(isolation_level=None) # transactions are managed below
+                    path = database_path
+                self.__write(connection, batch)
+            except Exception as e: # e.g. the database could not be opened, fail the batch but keep the thread
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def __write(self, connection: sqlite3.Connection, batch: List):
+        errors = {}
+        committed = False
+        try:
+            connection.execute("BEGIN IMMEDIATE;")
+            for index, (statements, _) in enumerate(batch):
+                connection.execute("SAVEPOINT write;")
+                try:
+                    for sql, rows in statements:
+                        connection.executemany(sql, rows)
+                    connection.execute("RELEASE write;")
+                except Exception as e:
+                    connection.execute("ROLLBACK TO write;")
+                    connection.execute("RELEASE write;")
+                    errors[index] = e
+            connection.execute("COMMIT;")
+            committed = True
+        except Exception as e: # the whole transaction failed, e.g. the database stayed locked
+            if connection.in_transaction:
+                try:
+                    connection.execute("ROLLBACK;")
+                except sqlite3.Error:
+                    pass # the transaction is already gone
+            errors = dict.fromkeys(range(len(batch)), e)
+
+        try:
+            # before the futures are done, so the writers read their own writes
+            if committed:
+                query_cache.invalidate()
+        finally:
+            for index, (_, future) in enumerate(batch):
+                if index in errors:
+                    future.set_exception(errors[index])
+                else:
+                    future.set_result(None)
+
+
+def write_queue() -> WriteQueue:
+    """
+    Return the write queue shared by every thread, starting it on first use.
+    """
+    global _write_queue
+    with _write_queue_lock:
+        if _write_queue is None:
+            _write_queue = WriteQueue()
+        return _write_queue
+
+
+class QueryCache:
+    """
+    The results of the read functions, by function and arguments, until the database changes.
+
+    The database changed when a write function of this module ran (see invalidate), or when another
+    connection committed: PRAGMA data_version of a connection that never writes changes with every
+    commit of the other connections, those of other processes included, and is checked on every lookup.
+    A result read while the database changed is not stored, see the generation returned by lookup.
+
+    Attributes:
+    max_entries: results kept, the least recently used ones are dropped first
+    """
+    def __init__(self, max_entries: int = MAX_CACHED_QUERIES):
+        self.max_entries = max_entries
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__watcher = None # connection reading the data_version of database_path
+        self.__watched_path = None
+        self.__data_version = None
+        self.__generation = 0
+        self.__stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def __clear(self):
+        self.__entries.clear()
+        self.__generation += 1
+        self.__stats['invalidations'] += 1
+
+    def __data_version_changed(self) -> bool:
+        if self.__watched_path != database_path:
+            if self.__watcher is not None:
+                self.__watcher.close()
+            self.__watcher = sqlite3.connect(database_path, check_same_thread=False, isolation_level=None)
+            self.__watched_path, self.__data_version = database_path, None
+        data_version = self.__watcher.execute("PRAGMA data_version;").fetchone()[0]
+        changed = data_version != self.__data_version
+        self.__data_version = data_version
+        return changed
+
+    def lookup(self, key: Hashable) -> Tuple[bool, object, int]:
+        """
+        Return whether a result is cached for key, the result, and the generation to store a new result with.
+        """
+        with self.__lock:
+            if self.__data_version_changed():
+                self.__clear()
+            if key in self.__entries:
+                self.__entries.move_to_end(key)
+                self.__stats['hits'] += 1
+                return True, self.__entries[key], self.__generation
+            self.__stats['misses'] += 1
+            return False, None, self.__generation
+
+    def store(self, key: Hashable, value, generation: int):
+        """
+        Keep the result of key, unless the database changed since the lookup that returned generation.
+        """
+        with self.__lock:
+            if generation != self.__generation or not self.max_entries:
+                return
+            self.__entries[key] = value
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+
+    def invalidate(self):
+        """
+        Drop every result, after a write of this process.
+        """
+        with self.__lock:
+            self.__clear()
+            if self.__watcher is not None and self.__watched_path == database_path:
+                self.__data_version_changed() # the write is accounted for, don't clear again on the next lookup
+
+    def stats(self) -> Dict:
+        """
+        Return the lookups answered from the cache (hits) or by a query (misses), the hit rate,
+        the times the cache was cleared and the results it holds.
+        """
+        with self.__lock:
+            lookups = self.__stats['hits'] + self.__stats['misses']
+            return dict(self.__stats, hit_rate=self.__stats['hits'] / lookups if lookups else 0.0, entries=len(self.__entries))
+
+
+query_cache = QueryCache()
+
+
+def _cached(daily: bool = False) -> Callable:
+    """
+    Decorate a read function so that its results come from query_cache.
+    Callers get a copy of the cached list, dict or set, which they are free to modify.
 
+    Args:
+    daily (bool): the result depends on the date (e.g. upcoming episodes), cache it for the day only
+    """
+    def decorator(function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            key = (function.__name__, args, tuple(sorted(kwargs.items())), _start_of_today() if daily else None)
+            hit, value, generation = query_cache.lookup(key)
+            count('database.query_cache.hits' if hit else 'database.query_cache.misses')
+            if not hit:
+                value = function(*args, **kwargs)
+                query_cache.store(key, value, generation)
+            return copy.copy(value)
+        return wrapper
+    return decorator
 
+
+def _invalidates(function: Callable) -> Callable:
+    """
+    Decorate a write function so that the results of query_cache are dropped once it is done.
+    """
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        try:
+            return function(*args, **kwargs)
+        finally:
+            query_cache.invalidate()
+    return wrapper
+
+
+def _start_of_today() -> float:
+    # episodes airing today are still upcoming
+    return datetime.datetime.combine(datetime.date.today(), datetime.time()).timestamp()
+
+@timed()
+@_invalidates
 def create_tables():
+    """
+    Create the tables of a new database, or upgrade the tables of an older one (see migrations.py).
+    """
+    migrations.migrate()
+
+def fts_match_query(search_term: str) -> str:
+    # every word must match as a prefix, quoted so that FTS5 syntax in the input is not interpreted
+    words = search_term.replace('"', ' ').split()
+    return " ".join(f'"{word}"*' for word in words)
+
+def _search(table_name: str, search_term: str) -> Tuple:
+    global fts_enabled
+    connection = get_connection()
+    if fts_enabled is None:
+        with connection:
+            fts_enabled = connection.execute(SELECT_FTS_TABLE.format(table_name=table_name)).fetchone() is not None
     with connection:
-        connection.execute(CREATE_MOVIES_TABLE)
-        connection.execute(CREATE_SHOWS_TABLE)
-        connection.execute(CREATE_USERS_TABLE)
-        connection.execute(CREATE_WATCHED_TABLE)
-        connection.execute(CREATE_RELEASE_INDEX)
+        cursor = connection.cursor()
+        match_query = fts_match_query(search_term)
+        if fts_enabled and match_query:
+            cursor.execute(SEARCH_FTS.format(table_name=table_name), (match_query,))
+        else:
+            cursor.execute(SEARCH.format(table_name=table_name), (f"%{search_term}%", f"%{search_term}%"))
+        return cursor.fetchall()
+
+def _iter_pages(query: str, parameters: Dict, table_name: str, order_by: str, descending: bool,
+                limit: Optional[int], chunk_size: int) -> Iterator[Tuple]:
+    """
+    Run a listing query page by page and yield its rows, with keyset pagination.
+
+    Args:
+    query (str): query with {page} and {order_by} placeholders, and a :limit parameter
+    parameters (dict): the other parameters of the query
+    table_name (str): 'movies' or 'shows', the table the rows come from
+    order_by (str): 'id', 'release_date' or 'next_airdate' (tv shows only, see PAGE_SORT_KEYS)
+    descending (bool): newest (or highest id) first
+    limit (int): maximum number of rows, None for all of them
+    chunk_size (int): number of rows fetched per query
 
+    Return:
+    iterator: the rows, fetched when the previous chunk is consumed
+    """
+    if order_by not in PAGE_SORT_KEYS[table_name]:
+        raise ValueError(f"{table_name} can be ordered by {', '.join(PAGE_SORT_KEYS[table_name])}, not {order_by!r}")
+    column = PAGE_SORT_COLUMNS[order_by]
+    direction, after = (" DESC", "<") if descending else ("", ">")
+    order_by_sql = ", ".join(f"{table_name}.{name}{direction}" for name in ([column] if column else []) + ['id'])
+    segments = PAGE_SEGMENTS[column is not None][::-1] if descending else PAGE_SEGMENTS[column is not None]
+    connection = get_connection()
+    remaining = limit
+    for first_page, next_page in segments:
+        page, keys = first_page, {}
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            # no read transaction stays open between two pages, so a writer is never held up by a slow reader
+            sql = query.format(table_name=table_name, page=page.format(table_name=table_name, column=column, after=after), order_by=order_by_sql)
+            with connection:
+                cursor = connection.execute(sql, {**parameters, **keys, 'limit': size})
+                rows = cursor.fetchall()
+            yield from rows
+            if remaining is not None:
+                remaining -= len(rows)
+            if len(rows) < size:
+                break
+            names = [description[0] for description in cursor.description]
+            last_row = rows[-1]
+            page, keys = next_page, {'id': last_row[names.index('id')], 'key': last_row[names.index(column)] if column else None}
+
+@timed()
+@_invalidates
 def add_user(username: str):
+    connection = get_connection()
     with connection:
         connection.execute(INSERT_USER, (username,))
 
+@timed()
+def add_title(record: TitleRecord):
+    """
+    Store a movie or a tv show found on IMDB (see Search.search_by_id), in the table of its type.
+    """
+    if record.is_tv_show:
+        add_show(*record.to_row())
+    else:
+        add_movie(*record.to_row())
+
 # -- Movies --
 
+@timed()
+@_invalidates
 def add_movie(imdb_id: str, title: str, release_date_timestamp: int, rating: str, type_: str, runtime: str, description: str):
+    connection = get_connection()
     with connection:
         connection.execute(INSERT_MOVIES, (imdb_id, title, release_date_timestamp, rating, type_, runtime, description))
 
-def get_movies(upcoming: bool = False) -> Tuple:
+@timed()
+@_invalidates
+def add_movies(movies: List):
+    """
+    Store many movies in one transaction.
+
+    Args:
+    movies (list): (imdb_id, title, release_date_timestamp, rating, type_, runtime, description) of every movie
+    """
+    connection = get_connection()
     with connection:
-        cursor = connection.cursor()
-        if upcoming:
-            today_timestamp = datetime.datetime.today().timestamp()
-            cursor.execute(SELECT_UPCOMING_MOVIES, (today_timestamp,))
-        else:
-            cursor.execute(SELECT_ALL.format(table_name='movies'))
-        return cursor.fetchall()
+        connection.executemany(INSERT_MOVIES, movies)
+
+@timed()
+def iter_movies(upcoming: bool = False, order_by: str = 'id', descending: bool = False,
+                limit: Optional[int] = None, chunk_size: int = PAGE_SIZE) -> Iterator[Tuple]:
+    """
+    Stream the movies of the watchlist, chunk_size rows per query (see _iter_pages for the arguments).
+    """
+    if upcoming:
+        today_timestamp = datetime.datetime.today().timestamp()
+        return _iter_pages(SELECT_UPCOMING_MOVIES_PAGE, {'today': today_timestamp}, 'movies', order_by, descending, limit, chunk_size)
+    return _iter_pages(SELECT_ALL_PAGE, {}, 'movies', order_by, descending, limit, chunk_size)
+
+@timed()
+@_cached(daily=True)
+def get_movies(upcoming: bool = False) -> Tuple:
+    return list(iter_movies(upcoming))
 
-def watch_movie(username: str, movie_id: str):
+@timed()
+@_invalidates
+def watch_movie(username: str, movie_id: str) -> bool:
+    """
+    Mark a movie (by its id in the watchlist) as watched by a user.
+
+    Return:
+    bool: False if the user already watched it
+
+    Raises:
+    NotFoundError: there is no such user or movie
+    """
+    connection = get_connection()
     with connection:
+        if connection.execute(SELECT_USER, (username,)).fetchone() is None:
+            raise NotFoundError(f"There is no user {username!r}, add the user first.")
+        if connection.execute(SELECT_MOVIE_ID, (movie_id,)).fetchone() is None:
+            raise NotFoundError(f"There is no movie {movie_id} in the watchlist.")
         try:
             connection.execute(INSERT_WATCHED_MOVIE, (username, movie_id))
-        except:
-            print(f"\n{movie_id} is already in the watched movies.\n")
+        except sqlite3.IntegrityError:
+            return False
+    return True
 
+@timed()
+def iter_watched_movies(username: str, order_by: str = 'id', descending: bool = False,
+                        limit: Optional[int] = None, chunk_size: int = PAGE_SIZE) -> Iterator[Tuple]:
+    """
+    Stream the movies watched by a user, chunk_size rows per query (see _iter_pages for the arguments).
+    """
+    return _iter_pages(SELECT_WATCHED_MOVIES_PAGE, {'username': username}, 'movies', order_by, descending, limit, chunk_size)
+
+@timed()
+@_cached()
 def get_watched_movies(username: str) -> Tuple:
-    with connection:
-        cursor = connection.cursor()
-        cursor.execute(SELECT_WATCHED_MOVIES, (username,))
-        return cursor.fetchall()
+    return list(iter_watched_movies(username))
 
+@timed()
+@_cached()
 def search_movies(search_term: str) -> Tuple:
-    with connection:
-        cursor = connection.cursor()
-        cursor.execute(SEARCH.format(table_name='movies'), (f"%{search_term}%",))
-        return cursor.fetchall()
+    return _search('movies', search_term)
 
+@timed()
+@_invalidates
 def delete_movie(movie_id: str):
+    connection = get_connection()
     with connection:
         connection.execute(DELETE.format(table_name='movies'), (movie_id,))
         
 # -- TV Shows --
 
+@timed()
+@_invalidates
 def add_show(imdb_id: str, title: str, release_date_timestamp: str, rating: str, type_: str, runtime: str, description: str):
+    connection = get_connection()
+    with connection:
+        connection.execute(INSERT_SHOWS, (imdb_id, title, release_date_timestamp, rating, type_, runtime, description,
+                                          *parse_years(release_date_timestamp)))
+
+@timed()
+@_invalidates
+def add_shows(shows: List):
+    """
+    Store many tv shows in one transaction.
+
+    Args:
+    shows (list): (imdb_id, title, release_date_timestamp, rating, type_, runtime, description) of every show
+    """
+    connection = get_connection()
     with connection:
-        connection.execute(INSERT_SHOWS, (imdb_id, title, release_date_timestamp, rating, type_, runtime, description))
+        connection.executemany(INSERT_SHOWS, ((*show, *parse_years(show[2])) for show in shows))
 
+@timed()
+@_cached()
 def get_imdb_id() -> Tuple:
+    connection = get_connection()
     with connection:
         cursor = connection.cursor()
         cursor.execute(SELECT_IMDB_ID_SHOWS)
         return cursor.fetchall()
 
-def get_shows() -> Tuple:
+@timed()
+@_cached()
+def get_refresh_schedule(imdb_id: str = None) -> List[Tuple]:
+    """
+    Return what is needed to schedule the refresh of every title (or of one title).
+
+    Return:
+    list: ('movie' or 'show', imdb_id, release_date_timestamp, next_airdate_timestamp, end_year, refreshed_at) of every title
+    """
+    condition = "1" if imdb_id is None else "imdb_id = :imdb_id"
+    connection = get_connection()
     with connection:
         cursor = connection.cursor()
-        cursor.execute(SELECT_ALL.format(table_name='shows'))
+        cursor.execute(SELECT_REFRESH_SCHEDULE.format(movies=condition, shows=condition), {'imdb_id': imdb_id})
         return cursor.fetchall()
 
-def search_shows(search_term: str) -> Tuple:
+@timed()
+@_invalidates
+def set_refreshed(kind: str, imdb_id: str, refreshed_at: float):
+    """
+    Remember when a 'movie' or 'show' was last refreshed from IMDB.
+    """
+    connection = get_connection()
+    with connection:
+        connection.execute(UPDATE_REFRESHED_AT.format(table_name='shows' if kind == 'show' else 'movies'), (refreshed_at, imdb_id))
+
+@timed()
+@_cached()
+def get_all_imdb_ids() -> Set[str]:
+    """
+    Return the IMDB ids of every movie and tv show in the watchlist.
+    """
+    connection = get_connection()
     with connection:
         cursor = connection.cursor()
-        cursor.execute(SEARCH.format(table_name='shows'), (f"%{search_term}%",))
-        return cursor.fetchall()
+        cursor.execute(SELECT_IMDB_ID_ALL)
+        return {imdb_id for imdb_id, in cursor.fetchall()}
+
+@timed()
+def iter_shows(upcoming: bool = False, running: bool = False, order_by: str = 'id', descending: bool = False,
+               limit: Optional[int] = None, chunk_size: int = PAGE_SIZE) -> Iterator[Tuple]:
+    """
+    Stream the tv shows of the watchlist, chunk_size rows per query (see _iter_pages for the other arguments).
+
+    Args:
+    upcoming (bool): only the shows with an episode airing from today on (known once their episodes are synced)
+    running (bool): only the shows that did not end yet
+    """
+    if upcoming:
+        return _iter_pages(SELECT_UPCOMING_SHOWS_PAGE, {'today': _start_of_today()}, 'shows', order_by, descending, limit, chunk_size)
+    if running:
+        return _iter_pages(SELECT_RUNNING_SHOWS_PAGE, {}, 'shows', order_by, descending, limit, chunk_size)
+    return _iter_pages(SELECT_ALL_PAGE, {}, 'shows', order_by, descending, limit, chunk_size)
+
+@timed()
+@_cached(daily=True)
+def get_shows(upcoming: bool = False) -> Tuple:
+    return list(iter_shows(upcoming))
+
+@timed()
+@_cached()
+def search_shows(search_term: str) -> Tuple:
+    return _search('shows', search_term)
 
+@timed()
+@_invalidates
 def delete_show(movie_id: str) -> Tuple:
+    connection = get_connection()
     with connection:
+        connection.execute(DELETE_SHOW_EPISODES.format(table_name='episodes'), (movie_id,))
+        connection.execute(DELETE_SHOW_EPISODES.format(table_name='seasons'), (movie_id,))
         connection.execute(DELETE.format(table_name='shows'), (movie_id,))
+
+# -- Episodes --
+
+@timed()
+def add_episodes(show_imdb_id: str, episodes: List, seasons: Dict):
+    """
+    Store the episodes of some seasons of a tv show. Safe to call from many threads at once:
+    the write goes through the write queue and shares its transaction with the other workers.
+
+    Args:
+    show_imdb_id (str): IMDB id of the tv show
+    episodes (list): (season, episode, title, airdate, airdate_timestamp) of every episode
+    seasons (dict): whether each synced season finished airing, by season number
+    """
+    synced_at = datetime.datetime.today().timestamp()
+    today = _start_of_today()
+    write_queue().submit([
+        (INSERT_EPISODES, [(show_imdb_id, *episode) for episode in episodes]),
+        (INSERT_SEASON, [(show_imdb_id, season, synced_at, finished) for season, finished in seasons.items()]),
+        (UPDATE_NEXT_AIRDATE, [(today, show_imdb_id)]),
+    ]).result()
+
+@timed()
+@_cached()
+def get_seasons(show_imdb_id: str) -> Dict:
+    """
+    Return whether each synced season of a tv show finished airing, by season number.
+    """
+    connection = get_connection()
+    with connection:
+        cursor = connection.cursor()
+        cursor.execute(SELECT_SEASONS, (show_imdb_id,))
+        return {season: bool(finished) for season, finished in cursor.fetchall()}
+
+@timed()
+@_cached(daily=True)
+def get_upcoming_episodes() -> Tuple:
+    connection = get_connection()
+    with connection:
+        cursor = connection.cursor()
+        cursor.execute(SELECT_UPCOMING_EPISODES, (_start_of_today(),))
+        return cursor.fetchall()
+
+# -- Timeline --
+
+@timed()
+@_cached(daily=True)
+def get_timeline(start: float = None, end: float = None, limit: int = None, username: str = None,
+                 unwatched: bool = False) -> List[Tuple]:
+    """
+    Return the movies and episodes released between two dates, in date order, from the timeline table
+    (see TIMELINE_COLUMNS). Every call is one range of an index, however large the watchlist.
+
+    Args:
+    start (float): timestamp of the first date included, today by default
+    end (float): timestamp of the first date excluded, no end by default
+    limit (int): at most this many items, all by default
+    username (str): with whether this user watched each movie (watched is 0 without a user)
+    unwatched (bool): without the movies the user watched
+    """
+    parameters = {
+        'username': username or None,
+        'start': _start_of_today() if start is None else start,
+        'end': float('inf') if end is None else end,
+        'limit': -1 if limit is None else limit,
+    }
+    query = SELECT_TIMELINE.format(unwatched=f"AND NOT {TIMELINE_WATCHED}" if unwatched else "")
+    connection = get_connection()
+    with connection:
+        return connection.execute(query, parameters).fetchall()
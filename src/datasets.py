@@ -0,0 +1,607 @@
+#!/usr/bin/env python
+"""
+Look up movies, tv shows and episodes offline, in a local copy of the IMDb datasets.
+
+IMDb publishes its titles as gzipped TSV files (https://developer.imdb.com/non-commercial-datasets/):
+- title.basics: type, titles, years, runtime and genres of every title
+- title.ratings: average rating and number of votes
+- title.episode: show, season and episode number of every episode
+
+ingest() streams these files into imdb.db (WATCHLIST_DATASETS_DB or configure() set another path): rows are
+decompressed and parsed one line at a time and written in batches of BATCH_SIZE rows, in transactions of
+TRANSACTION_ROWS rows, so memory use does not depend on the size of the files. Ingesting again only writes
+the rows that changed (and deletes the titles IMDb removed); a file that did not change since the last
+ingest is skipped.
+
+Titles are keyed by the number of their IMDB id and titles of movies and shows are indexed with FTS5 (a
+prefix index on the title when sqlite has no FTS5), so lookups by id take microseconds and searches by
+title milliseconds. OfflineSearch answers the lookups of search.Search from this index; set
+WATCHLIST_METADATA=datasets to use it everywhere instead of scraping IMDB (see search.new_search).
+
+The datasets have no plot, cast or exact airdate: the description of a title is its genres, search results
+have no cast, and the airdate of an episode is its year.
+
+Typical usage example:
+> download_all("datasets")
+> ingest("datasets")
+> OfflineSearch().search_by_id("0944947")
+> OfflineSearch(tv_show=True).upcoming_episodes("0944947")
+"""
+from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional
+from database import fts_match_query
+from fetch import FetchError
+from metrics import timed
+from parsers import parse_airdate
+from records import EpisodeRecord, TitleRecord
+from search import Search
+import gzip
+import os
+import re
+import sqlite3
+import threading
+import time
+
+DATASETS_URL = os.environ.get("WATCHLIST_DATASETS_URL", "https://datasets.imdbws.com").rstrip('/')
+
+BATCH_SIZE = 10000 # rows per executemany
+TRANSACTION_ROWS = 500000 # rows per transaction (a few seconds of writing)
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+SEARCH_LIMIT = 25
+NULL = '\\N' # a missing value in the datasets
+
+# dataset: table, columns of the file (stored in this order)
+DATASETS = {
+    'title.basics': ('titles', ['tconst', 'titleType', 'primaryTitle', 'originalTitle', 'isAdult',
+                                'startYear', 'endYear', 'runtimeMinutes', 'genres']),
+    'title.ratings': ('ratings', ['tconst', 'averageRating', 'numVotes']),
+    'title.episode': ('episodes', ['tconst', 'parentTconst', 'seasonNumber', 'episodeNumber']),
+}
+ID_COLUMNS = {'tconst', 'parentTconst'}
+
+# title types of the datasets, as IMDB shows them on a title page
+TITLE_TYPES = {
+    'movie': 'Movie',
+    'short': 'Short',
+    'video': 'Video',
+    'videoGame': 'Video Game',
+    'tvSeries': 'TV Series',
+    'tvMiniSeries': 'TV Mini Series',
+    'tvMovie': 'TV Movie',
+    'tvSpecial': 'TV Special',
+    'tvShort': 'TV Short',
+    'tvEpisode': 'TV Episode',
+    'tvPilot': 'TV Pilot',
+}
+SHOW_TYPES = ('tvSeries', 'tvMiniSeries')
+
+EPISODES_URL = re.compile(r"/title/tt(\d+)/episodes/?(?:\?season=(\d+))?")
+
+#------------- Queries -------------
+# ids are the numbers of the IMDB ids (tt0944947 is 944947), the values are converted by the column affinities
+CREATE_TITLES_TABLE = """CREATE TABLE IF NOT EXISTS titles(
+    id INTEGER PRIMARY KEY,
+    title_type TEXT,
+    primary_title TEXT COLLATE NOCASE,
+    original_title TEXT,
+    is_adult INTEGER,
+    start_year INTEGER,
+    end_year INTEGER,
+    runtime_minutes INTEGER,
+    genres TEXT
+    );"""
+CREATE_RATINGS_TABLE = """CREATE TABLE IF NOT EXISTS ratings(
+    id INTEGER PRIMARY KEY,
+    average_rating REAL,
+    num_votes INTEGER
+    );"""
+CREATE_EPISODES_TABLE = """CREATE TABLE IF NOT EXISTS episodes(
+    id INTEGER PRIMARY KEY,
+    parent_id INTEGER,
+    season INTEGER,
+    episode INTEGER
+    );"""
+# size and modification time of every ingested file, to skip the files that did not change
+CREATE_INGESTS_TABLE = """CREATE TABLE IF NOT EXISTS ingests(
+    dataset TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    rows INTEGER,
+    ingested_at REAL
+    );"""
+
+# indexes are built once the first ingest is done, faster than maintaining them row by row
+CREATE_EPISODES_INDEX = "CREATE INDEX IF NOT EXISTS idx_episodes_parent ON episodes(parent_id, season, episode);"
+CREATE_TITLE_INDEX = "CREATE INDEX IF NOT EXISTS idx_titles_primary_title ON titles(primary_title);"
+
+# only movies and shows are searched by title, not the millions of episodes
+CREATE_FTS_TABLE = "CREATE VIRTUAL TABLE IF NOT EXISTS titles_fts USING fts5(primary_title, original_title, content='titles', content_rowid='id');"
+FILL_FTS = """INSERT INTO titles_fts (rowid, primary_title, original_title)
+SELECT id, primary_title, original_title FROM titles WHERE title_type != 'tvEpisode';"""
+CREATE_FTS_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS titles_fts_insert AFTER INSERT ON titles WHEN new.title_type != 'tvEpisode' BEGIN
+    INSERT INTO titles_fts (rowid, primary_title, original_title) VALUES (new.id, new.primary_title, new.original_title);
+END;""",
+    """CREATE TRIGGER IF NOT EXISTS titles_fts_delete AFTER DELETE ON titles WHEN old.title_type != 'tvEpisode' BEGIN
+    INSERT INTO titles_fts (titles_fts, rowid, primary_title, original_title) VALUES ('delete', old.id, old.primary_title, old.original_title);
+END;""",
+    """CREATE TRIGGER IF NOT EXISTS titles_fts_update_old AFTER UPDATE ON titles WHEN old.title_type != 'tvEpisode' BEGIN
+    INSERT INTO titles_fts (titles_fts, rowid, primary_title, original_title) VALUES ('delete', old.id, old.primary_title, old.original_title);
+END;""",
+    """CREATE TRIGGER IF NOT EXISTS titles_fts_update_new AFTER UPDATE ON titles WHEN new.title_type != 'tvEpisode' BEGIN
+    INSERT INTO titles_fts (rowid, primary_title, original_title) VALUES (new.id, new.primary_title, new.original_title);
+END;""",
+]
+DROP_FTS_TRIGGERS = ["DROP TRIGGER IF EXISTS titles_fts_insert;", "DROP TRIGGER IF EXISTS titles_fts_delete;",
+                     "DROP TRIGGER IF EXISTS titles_fts_update_old;", "DROP TRIGGER IF EXISTS titles_fts_update_new;"]
+SELECT_FTS_TABLE = "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'titles_fts';"
+# the triggers only exist once an ingest of the titles completed
+SELECT_FTS_TRIGGER = "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name = 'titles_fts_insert';"
+CLEAR_FTS = "INSERT INTO titles_fts (titles_fts) VALUES ('delete-all');"
+
+INSERT = "INSERT INTO {table_name} VALUES ({placeholders});"
+# only rows that differ are written (and counted by rowcount)
+UPSERT = """INSERT INTO {table_name} VALUES ({placeholders})
+ON CONFLICT (id) DO UPDATE SET {assignments}
+WHERE ({columns}) IS NOT ({excluded});"""
+SELECT_ANY = "SELECT 1 FROM {table_name} LIMIT 1;"
+SELECT_IDS = "SELECT id FROM {table_name} ORDER BY id;"
+CREATE_STALE_TABLE = "CREATE TEMP TABLE IF NOT EXISTS stale(id INTEGER PRIMARY KEY);"
+INSERT_STALE = "INSERT OR IGNORE INTO stale VALUES (?);"
+DELETE_STALE = "DELETE FROM {table_name} WHERE id IN (SELECT id FROM stale);"
+CLEAR_STALE = "DELETE FROM stale;"
+
+SELECT_INGEST = "SELECT size, mtime FROM ingests WHERE dataset = ?;"
+INSERT_INGEST = "INSERT OR REPLACE INTO ingests VALUES (?, ?, ?, ?, ?);"
+
+SELECT_TITLE = """SELECT titles.id, primary_title, title_type, start_year, end_year, runtime_minutes, genres, average_rating
+FROM titles LEFT JOIN ratings ON ratings.id = titles.id
+WHERE titles.id = ?;"""
+SEARCH_FTS = """SELECT titles.id, titles.primary_title, title_type, start_year, end_year FROM titles_fts
+JOIN titles ON titles.id = titles_fts.rowid
+LEFT JOIN ratings ON ratings.id = titles.id
+WHERE titles_fts MATCH ?
+ORDER BY coalesce(num_votes, 0) DESC, titles.id LIMIT ?;"""
+SEARCH_PREFIX = """SELECT titles.id, primary_title, title_type, start_year, end_year FROM titles
+LEFT JOIN ratings ON ratings.id = titles.id
+WHERE primary_title LIKE ? ESCAPE '\\' AND title_type != 'tvEpisode'
+ORDER BY coalesce(num_votes, 0) DESC, titles.id LIMIT ?;"""
+SELECT_EPISODES = """SELECT episodes.season, episodes.episode, titles.primary_title, titles.start_year FROM episodes
+JOIN titles ON titles.id = episodes.id
+WHERE episodes.parent_id = ? AND episodes.season IS NOT NULL
+ORDER BY episodes.season, episodes.episode;"""
+SELECT_SEASON_EPISODES = """SELECT episodes.season, episodes.episode, titles.primary_title, titles.start_year FROM episodes
+JOIN titles ON titles.id = episodes.id
+WHERE episodes.parent_id = ? AND episodes.season = ?
+ORDER BY episodes.episode;"""
+#-------------------------------------
+
+datasets_database_path = os.environ.get("WATCHLIST_DATASETS_DB", "imdb.db")
+fts_enabled = None # whether searches use the full-text index, decided on first use
+
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL;",
+    "PRAGMA synchronous = NORMAL;",
+    "PRAGMA cache_size = -65536;",
+    "PRAGMA mmap_size = 1073741824;", # the index of all titles is a few GiB
+]
+
+_local = threading.local()
+
+
+def configure(path: str):
+    """
+    Use the datasets database at path from now on. Connections to the previous file are replaced on their next use.
+    """
+    global datasets_database_path, fts_enabled
+    datasets_database_path = path
+    fts_enabled = None
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Return the connection of the current thread to the datasets database, opening it on first use.
+    """
+    if getattr(_local, 'path', None) != datasets_database_path:
+        if getattr(_local, 'connection', None) is not None:
+            _local.connection.close()
+        _local.connection = sqlite3.connect(datasets_database_path, isolation_level=None)
+        for pragma in PRAGMAS:
+            _local.connection.execute(pragma)
+        _local.path = datasets_database_path
+    return _local.connection
+
+
+def _query(query: str, parameters: tuple = ()) -> sqlite3.Cursor:
+    try:
+        return get_connection().execute(query, parameters)
+    except sqlite3.OperationalError as e:
+        if 'no such table' in str(e):
+            raise Exception(f"No IMDb datasets in {datasets_database_path}, ingest them first (python app.py datasets --download).") from e
+        raise
+
+
+def create_tables():
+    """
+    Create the tables of the datasets database, and the full-text index when sqlite supports FTS5.
+    """
+    connection = get_connection()
+    for query in [CREATE_TITLES_TABLE, CREATE_RATINGS_TABLE, CREATE_EPISODES_TABLE, CREATE_INGESTS_TABLE]:
+        connection.execute(query)
+    try:
+        connection.execute(CREATE_FTS_TABLE)
+    except sqlite3.OperationalError: # sqlite without FTS5, titles are searched by prefix (see CREATE_TITLE_INDEX)
+        pass
+
+
+def _imdb_id(id_: int) -> str:
+    # IMDB ids have at least 7 digits: 944947 is tt0944947
+    return f"{id_:07d}"
+
+
+def dataset_path(name: str, directory: str = '.') -> str:
+    return os.path.join(directory, f"{name}.tsv.gz")
+
+
+def download(name: str, directory: str = '.') -> bool:
+    """
+    Download a dataset file to directory, unless the copy there is up to date (conditional request).
+
+    Args:
+    name (str): 'title.basics', 'title.ratings' or 'title.episode'
+    directory (str): directory of the dataset files
+
+    Return:
+    bool: whether a new file was downloaded
+
+    Raises:
+    FetchError: the file could not be downloaded
+    """
+    import requests
+    import fetch
+    path = dataset_path(name, directory)
+    url = f"{DATASETS_URL}/{name}.tsv.gz"
+    headers = {}
+    if os.path.exists(path):
+        headers['if-modified-since'] = formatdate(os.path.getmtime(path), usegmt=True)
+    try:
+        # streamed to disk, the files are hundreds of MiB
+        with fetch.session().get(url, headers=headers, stream=True,
+                                 timeout=(fetch.CONNECT_TIMEOUT, fetch.READ_TIMEOUT)) as response:
+            if response.status_code == 304:
+                return False
+            if response.status_code >= 400:
+                raise FetchError(f"Unable to download {url}: HTTP {response.status_code} {response.reason}")
+            with open(path + '.part', 'wb') as file:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    file.write(chunk)
+            os.replace(path + '.part', path)
+            last_modified = response.headers.get('last-modified')
+    except requests.RequestException as e:
+        raise FetchError(f"Unable to download {url}: {e}") from e
+    if last_modified:
+        try:
+            timestamp = parsedate_to_datetime(last_modified).timestamp()
+            os.utime(path, (timestamp, timestamp))
+        except (TypeError, ValueError, IndexError):
+            pass
+    return True
+
+
+def download_all(directory: str = '.') -> Dict[str, bool]:
+    """
+    Download the dataset files that changed, see download.
+    """
+    os.makedirs(directory, exist_ok=True)
+    return {name: download(name, directory) for name in DATASETS}
+
+
+def read_dataset(path: str, columns: List[str]) -> Iterator[List]:
+    """
+    Stream the rows of a dataset file, decompressed and split one line at a time.
+
+    Args:
+    path (str): .tsv.gz file
+    columns (list): columns the file must start with
+
+    Return:
+    iterator: rows with the IMDB ids as numbers and missing values as None (malformed lines are skipped)
+    """
+    id_positions = [position for position, column in enumerate(columns) if column in ID_COLUMNS]
+    with gzip.open(path, 'rt', encoding='utf-8', newline='') as file:
+        header = file.readline().rstrip('\n').split('\t')
+        if header[:len(columns)] != columns:
+            raise Exception(f"{path} does not have the columns of the dataset ({', '.join(columns)})")
+        for line in file:
+            # values are never quoted, titles may contain quotes
+            values = line.rstrip('\n').split('\t')
+            if len(values) != len(columns):
+                continue
+            row = [None if value == NULL else value for value in values]
+            for position in id_positions:
+                if row[position] is not None:
+                    row[position] = int(row[position][2:])
+            yield row
+
+
+def _batches(rows: Iterable[List], size: int) -> Iterator[List[List]]:
+    rows = iter(rows)
+    batch = list(islice(rows, size))
+    while batch:
+        yield batch
+        batch = list(islice(rows, size))
+
+
+def _table_columns(connection: sqlite3.Connection, table_name: str) -> List[str]:
+    return [column[1] for column in connection.execute(f"PRAGMA table_info({table_name});")]
+
+
+@timed()
+def ingest_dataset(name: str, path: str, force: bool = False) -> Dict:
+    """
+    Load a dataset file into its table, writing only the rows that changed.
+
+    The first ingest inserts every row and builds the indexes afterwards. Later ingests upsert every row
+    (unchanged rows are left alone) and delete the rows missing from the file: as the files are sorted by id,
+    the ids of the table are read alongside the file, so this takes no more memory than the first ingest.
+    When the first ingest of the titles was interrupted, the next one builds the full-text index again.
+
+    Args:
+    name (str): 'title.basics', 'title.ratings' or 'title.episode'
+    path (str): the .tsv.gz file
+    force (bool): ingest the file even if it did not change since the last ingest
+
+    Return:
+    dict: rows read, rows inserted or updated, rows deleted, whether the file was skipped, seconds taken
+    """
+    table_name, columns = DATASETS[name]
+    connection = get_connection()
+    stat = os.stat(path)
+    if not force and connection.execute(SELECT_INGEST, (name,)).fetchone() == (stat.st_size, stat.st_mtime):
+        return {'rows': 0, 'changed': 0, 'deleted': 0, 'skipped': True, 'seconds': 0.0}
+
+    start = time.perf_counter()
+    table_columns = _table_columns(connection, table_name)
+    placeholders = ", ".join("?" * len(table_columns))
+    first_ingest = connection.execute(SELECT_ANY.format(table_name=table_name)).fetchone() is None
+    has_fts = table_name == 'titles' and connection.execute(SELECT_FTS_TABLE).fetchone() is not None
+    # a first ingest that was interrupted left titles without the triggers: the index is filled again at the end
+    fill_fts = has_fts and (first_ingest or connection.execute(SELECT_FTS_TRIGGER).fetchone() is None)
+    if first_ingest:
+        statement = INSERT.format(table_name=table_name, placeholders=placeholders)
+        if has_fts: # indexed at once at the end
+            for query in DROP_FTS_TRIGGERS:
+                connection.execute(query)
+        existing_ids = None
+    else:
+        statement = UPSERT.format(table_name=table_name, placeholders=placeholders,
+                                  assignments=", ".join(f"{column} = excluded.{column}" for column in table_columns[1:]),
+                                  columns=", ".join(table_columns[1:]),
+                                  excluded=", ".join(f"excluded.{column}" for column in table_columns[1:]))
+        # a second connection reads the ids as they were before this ingest (WAL snapshot)
+        reader = sqlite3.connect(datasets_database_path, isolation_level=None)
+        reader.execute("BEGIN;")
+        existing_ids = (id_ for id_, in reader.execute(SELECT_IDS.format(table_name=table_name)))
+        connection.execute(CREATE_STALE_TABLE)
+        connection.execute(CLEAR_STALE)
+
+    rows = changed = deleted = uncommitted = 0
+    next_existing = next(existing_ids, None) if existing_ids is not None else None
+    previous_id = -1
+    in_order = True
+    cursor = connection.cursor()
+    cursor.execute("BEGIN;")
+    try:
+        for batch in _batches(read_dataset(path, columns), BATCH_SIZE):
+            if existing_ids is not None and in_order:
+                stale = []
+                for row in batch:
+                    if row[0] <= previous_id:
+                        in_order = False # not sorted: stale ids cannot be told apart, keep them all
+                        break
+                    previous_id = row[0]
+                    while next_existing is not None and next_existing < row[0]:
+                        stale.append((next_existing,))
+                        next_existing = next(existing_ids, None)
+                    if next_existing == row[0]:
+                        next_existing = next(existing_ids, None)
+                cursor.executemany(INSERT_STALE, stale)
+
+            cursor.executemany(statement, batch)
+            changed += cursor.rowcount
+            rows += len(batch)
+            uncommitted += len(batch)
+            if uncommitted >= TRANSACTION_ROWS:
+                cursor.execute("COMMIT;")
+                cursor.execute("BEGIN;")
+                uncommitted = 0
+
+        if existing_ids is not None:
+            if in_order:
+                while next_existing is not None:
+                    cursor.execute(INSERT_STALE, (next_existing,))
+                    next_existing = next(existing_ids, None)
+                cursor.execute(DELETE_STALE.format(table_name=table_name))
+                deleted = cursor.rowcount
+            cursor.execute(CLEAR_STALE)
+
+        if table_name == 'episodes':
+            cursor.execute(CREATE_EPISODES_INDEX)
+        elif table_name == 'titles' and not has_fts:
+            cursor.execute(CREATE_TITLE_INDEX)
+        if fill_fts:
+            cursor.execute(CLEAR_FTS)
+            cursor.execute(FILL_FTS)
+        if has_fts:
+            for query in CREATE_FTS_TRIGGERS:
+                cursor.execute(query)
+        cursor.execute(INSERT_INGEST, (name, stat.st_size, stat.st_mtime, rows, time.time()))
+        cursor.execute("COMMIT;")
+    except BaseException:
+        cursor.execute("ROLLBACK;")
+        raise
+    finally:
+        if existing_ids is not None:
+            reader.close()
+    return {'rows': rows, 'changed': changed, 'deleted': deleted, 'skipped': False,
+            'seconds': round(time.perf_counter() - start, 3)}
+
+
+def ingest(directory: str = '.', force: bool = False) -> Dict[str, Dict]:
+    """
+    Load the dataset files of directory (title.basics.tsv.gz...) into the datasets database.
+    Missing files are skipped, so e.g. the ratings can be refreshed on their own.
+
+    Return:
+    dict: summary of every dataset, see ingest_dataset
+    """
+    global fts_enabled
+    create_tables()
+    fts_enabled = None
+    summaries = {}
+    for name in DATASETS:
+        path = dataset_path(name, directory)
+        if not os.path.exists(path):
+            continue
+        print(f"Ingesting {path}...")
+        summaries[name] = ingest_dataset(name, path, force)
+        summary = summaries[name]
+        if summary['skipped']:
+            print(f"{name}: unchanged since the last ingest")
+        else:
+            print(f"{name}: {summary['rows']} rows, {summary['changed']} changed, {summary['deleted']} deleted in {summary['seconds']:.1f} s")
+    return summaries
+
+
+def _release_date(title_type: str, start_year: Optional[int], end_year: Optional[int]) -> str:
+    if start_year is None:
+        return 'NA'
+    if title_type in SHOW_TYPES:
+        # like IMDB: '2011–2019', '2022–' while running, '2016' for a single year
+        if end_year is None:
+            return f"{start_year}–" if title_type == 'tvSeries' else str(start_year)
+        return str(start_year) if end_year == start_year else f"{start_year}–{end_year}"
+    return str(start_year)
+
+
+def _runtime(minutes: Optional[int]) -> str:
+    if not minutes:
+        return 'NA'
+    hours, minutes = divmod(minutes, 60)
+    if not hours:
+        return f"{minutes}m"
+    return f"{hours}h {minutes}m" if minutes else f"{hours}h"
+
+
+@timed()
+def find_title(imdb_id: str) -> TitleRecord:
+    """
+    Find a title in the datasets by IMDB id.
+
+    Return:
+    TitleRecord: the title, with its genres as description
+
+    Raises:
+    Exception: the id is not in the datasets
+    """
+    row = _query(SELECT_TITLE, (int(imdb_id),)).fetchone()
+    if row is None:
+        raise Exception(f"tt{imdb_id} is not in the IMDb datasets.")
+    id_, title, title_type, start_year, end_year, runtime_minutes, genres, rating = row
+    return TitleRecord(_imdb_id(id_), title, _release_date(title_type, start_year, end_year),
+                       TITLE_TYPES.get(title_type, title_type), 'NA' if rating is None else f"{rating:g}/10",
+                       _runtime(runtime_minutes), (genres or '').replace(',', ', '))
+
+
+@timed()
+def find_titles(search_term: str, limit: int = SEARCH_LIMIT) -> List[List]:
+    """
+    Search the movies and tv shows of the datasets by title, most voted first.
+
+    Return:
+    list: [imdb_id, title, release_date, type, cast] of every result (like Search.search_by_title, without cast)
+    """
+    global fts_enabled
+    if fts_enabled is None:
+        fts_enabled = get_connection().execute(SELECT_FTS_TABLE).fetchone() is not None
+    match_query = fts_match_query(search_term)
+    if not match_query:
+        return []
+    if fts_enabled:
+        rows = _query(SEARCH_FTS, (match_query, limit))
+    else:
+        prefix = search_term.strip().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        rows = _query(SEARCH_PREFIX, (f"{prefix}%", limit))
+    return [[_imdb_id(id_), title, _release_date(title_type, start_year, end_year), TITLE_TYPES.get(title_type, title_type), '']
+            for id_, title, title_type, start_year, end_year in rows]
+
+
+@timed()
+def find_episodes(imdb_id: str, season: str = None) -> List[EpisodeRecord]:
+    """
+    Find the episodes of a tv show (of one season), with their year as airdate.
+
+    Return:
+    list: EpisodeRecord (title, season, episode, airdate) of every episode, in order
+    """
+    if season is None:
+        rows = _query(SELECT_EPISODES, (int(imdb_id),))
+    else:
+        rows = _query(SELECT_SEASON_EPISODES, (int(imdb_id), int(season)))
+    return [EpisodeRecord(title, str(season), str(episode or ''), '' if year is None else str(year))
+            for season, episode, title, year in rows]
+
+
+def _upcoming(episodes: List[EpisodeRecord]) -> List[EpisodeRecord]:
+    # same rule as parsers.parse_episodes: an airdate that is a date, not passed yet
+    now_timestamp = datetime.now().timestamp()
+    return [episode for episode in episodes
+            if episode.airdate and (parse_airdate(episode.airdate) or 0) >= now_timestamp]
+
+
+class OfflineSearch(Search):
+    """
+    Search movies, tv shows and episodes in the local IMDb datasets instead of scraping IMDB.
+
+    Same methods and results as search.Search (the prompts included), see the limits of the datasets above.
+    """
+    def search_by_title(self, title: str) -> List:
+        return find_titles(title)
+
+    def search_by_id(self, imdb_id: str) -> TitleRecord:
+        return find_title(imdb_id)
+
+    def episode_guide(self, imdb_id: str) -> List:
+        """
+        Find the title and the seasons of a tv show, and its latest season that started airing.
+        """
+        title = find_title(imdb_id).title
+        episodes = find_episodes(imdb_id)
+        if not episodes:
+            raise Exception(f"Found no episodes of tt{imdb_id} in the IMDb datasets.")
+        all_seasons = list(dict.fromkeys(episode.season for episode in episodes))
+        this_year = datetime.now().year
+        aired_seasons = [episode.season for episode in episodes if episode.airdate and int(episode.airdate) <= this_year]
+        return [title, all_seasons, aired_seasons[-1] if aired_seasons else all_seasons[0]]
+
+    def upcoming_episodes(self, imdb_id: str) -> List:
+        title = find_title(imdb_id).title
+        results = _upcoming(find_episodes(imdb_id))
+        if results:
+            return [results, title]
+        return [f"Found no upcoming episodes for {title}.", title]
+
+    def scrape_episodes(self, url: str, upcoming: bool = False) -> List[EpisodeRecord]:
+        """
+        Find the episodes of the season of an episodes guide url (see search.episodes_url).
+        """
+        match = EPISODES_URL.search(url)
+        if not match:
+            raise Exception(f"{url} is not the url of an episodes guide.")
+        imdb_id, season = match.groups()
+        if season is None:
+            season = self.episode_guide(imdb_id)[2]
+        episodes = [episode for episode in find_episodes(imdb_id, season) if episode.airdate]
+        return _upcoming(episodes) if upcoming else episodes
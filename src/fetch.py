@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+"""
+Download web pages politely and survive a flaky or throttling server.
+
+Every request made by the search module goes through fetch():
+- a token bucket limits the requests per second of the whole process (bursts of up to BURST requests)
+- failed requests (connection errors, timeouts, 429 and 5xx responses) are retried up to MAX_RETRIES times,
+  after an exponential backoff with random jitter, or after the delay asked for by a Retry-After header
+- a circuit breaker per host stops sending requests to a host after FAILURE_THRESHOLD failures in a row,
+  fails them at once for RESET_TIMEOUT seconds, then lets one trial request decide whether it recovered
+- connections and reads have their own timeouts (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+A request that still fails raises FetchError.
+
+Typical usage example:
+> configure(rate=2, connect_timeout=3, read_timeout=10)
+> response = fetch("https://www.imdb.com/title/tt0944947/")
+> stats()
+"""
+from email.utils import parsedate_to_datetime
+from typing import TYPE_CHECKING, Dict, Optional
+from urllib.parse import urlparse
+from metrics import count, record, span, timed
+import random
+import threading
+import time
+
+# requests is slow to import, see search.py
+if TYPE_CHECKING:
+    import requests
+
+RATE = 5.0 # requests per second, across all hosts and threads
+BURST = 10 # requests that can be sent at once after a quiet period
+MAX_RETRIES = 3 # retries of a failed request (so MAX_RETRIES + 1 attempts)
+BACKOFF_BASE = 0.5 # seconds before the first retry, doubled for every later one (before jitter)
+MAX_BACKOFF = 30.0 # longest wait between two attempts, Retry-After included
+FAILURE_THRESHOLD = 5 # failures in a row that open the circuit of a host
+RESET_TIMEOUT = 60.0 # seconds an open circuit rejects requests before a trial request
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10.0
+MAX_REQUESTS_PER_HOST = 4 # open requests to a single host across all threads
+POOL_SIZE = 32 # keep-alive connections per host, enough for every worker of search.py
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+HEADERS = {'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/53.0.2785.143 Safari/537.36'}
+
+_lock = threading.Lock()
+_session = None
+_rate_limiter = None
+_circuit_breakers = {}
+_host_semaphores = {}
+_stats = {'requests': 0, 'retries': 0, 'failures': 0, 'rejected': 0, 'throttled': 0, 'waited': 0.0}
+
+
+class FetchError(Exception):
+    """ A page could not be downloaded """
+
+
+class TokenBucket:
+    """
+    Allow rate requests per second on average, and bursts of up to capacity requests.
+    Thread safe: threads waiting for a token sleep outside of the lock.
+    """
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.__tokens = float(capacity)
+        self.__updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def __refill(self, now: float):
+        self.__tokens = min(self.capacity, self.__tokens + (now - self.__updated) * self.rate)
+        self.__updated = now
+
+    def acquire(self) -> float:
+        """
+        Take a token, waiting until one is available.
+
+        Return:
+        float: seconds waited
+        """
+        with self.__lock:
+            now = time.monotonic()
+            self.__refill(now)
+            # take the token right away, even if it is not there yet: later callers queue behind this one
+            self.__tokens -= 1
+            wait = -self.__tokens / self.rate if self.__tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class CircuitBreaker:
+    """
+    Track the failures of a host: closed (requests go through), open (requests are rejected)
+    and half open (one trial request goes through, its result closes or opens the circuit again).
+    """
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.__trial = False
+        self.__lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        return 'half open' if time.monotonic() - self.opened_at >= self.reset_timeout else 'open'
+
+    def allow(self) -> bool:
+        """
+        Return whether a request may be sent now.
+        """
+        with self.__lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half open' and not self.__trial:
+                self.__trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.__lock:
+            self.failures, self.opened_at, self.__trial = 0, None, False
+
+    def record_failure(self):
+        with self.__lock:
+            self.failures += 1
+            if self.__trial or self.failures >= self.failure_threshold:
+                self.opened_at, self.__trial = time.monotonic(), False
+
+
+def configure(rate: float = None, burst: int = None, connect_timeout: float = None, read_timeout: float = None,
+              max_retries: int = None):
+    """
+    Change the limits of every later request. Arguments left to None keep their current value.
+
+    Args:
+    rate (float): requests per second
+    burst (int): requests that can be sent at once
+    connect_timeout (float): seconds to wait for a connection
+    read_timeout (float): seconds to wait for the server between two bytes of a response
+    max_retries (int): retries of a failed request
+    """
+    global RATE, BURST, CONNECT_TIMEOUT, READ_TIMEOUT, MAX_RETRIES, _rate_limiter
+    with _lock:
+        RATE = RATE if rate is None else rate
+        BURST = BURST if burst is None else burst
+        CONNECT_TIMEOUT = CONNECT_TIMEOUT if connect_timeout is None else connect_timeout
+        READ_TIMEOUT = READ_TIMEOUT if read_timeout is None else read_timeout
+        MAX_RETRIES = MAX_RETRIES if max_retries is None else max_retries
+        _rate_limiter = None
+
+
+def session() -> "requests.Session":
+    """
+    Return the keep-alive session shared by every request, with a connection pool sized for the workers.
+    """
+    import requests
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.headers.update(HEADERS)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=POOL_SIZE)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
+
+def rate_limiter() -> TokenBucket:
+    global _rate_limiter
+    with _lock:
+        if _rate_limiter is None:
+            _rate_limiter = TokenBucket(RATE, BURST)
+        return _rate_limiter
+
+
+def circuit_breaker(host: str) -> CircuitBreaker:
+    with _lock:
+        if host not in _circuit_breakers:
+            _circuit_breakers[host] = CircuitBreaker()
+        return _circuit_breakers[host]
+
+
+def _host_semaphore(host: str) -> threading.BoundedSemaphore:
+    """
+    Return the semaphore limiting concurrent requests to a host.
+    """
+    with _lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(MAX_REQUESTS_PER_HOST)
+        return _host_semaphores[host]
+
+
+def _count(name: str, value: float = 1):
+    with _lock:
+        _stats[name] += value
+
+
+def stats() -> Dict:
+    """
+    Return the counters of the requests made so far: requests sent, retries, failed fetches,
+    requests rejected by an open circuit, requests delayed by the rate limit and seconds waited for it.
+    """
+    with _lock:
+        return dict(_stats, circuits={host: breaker.state for host, breaker in _circuit_breakers.items()})
+
+
+def retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Return the seconds to wait asked for by a Retry-After header (a number of seconds or an HTTP date).
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def backoff(attempt: int, wait_asked: Optional[float] = None) -> float:
+    """
+    Return the seconds to wait before retrying after attempt (0 for the first one) failed:
+    a random time up to an exponentially growing bound ("full jitter", so that clients failing together
+    do not retry together), but never less than the server asked for.
+    """
+    delay = random.uniform(0, min(MAX_BACKOFF, BACKOFF_BASE * 2 ** attempt))
+    if wait_asked is not None:
+        delay = max(delay, wait_asked)
+    return min(delay, MAX_BACKOFF)
+
+
+@timed()
+def fetch(url: str, headers: dict = None) -> "requests.Response":
+    """
+    Download a page, within the rate limit, retrying failed requests.
+
+    Args:
+    url (str): input web address
+    headers (dict): extra request headers, e.g. validators of a cached page
+
+    Return:
+    requests.Response: a successful (2xx) or not modified (304) response
+
+    Raises:
+    FetchError: the host is unreachable, keeps failing, or answered with another error status
+    """
+    import requests
+    host = urlparse(url).netloc
+    breaker = circuit_breaker(host)
+    error = None
+    for attempt in range(MAX_RETRIES + 1):
+        if not breaker.allow():
+            _count('rejected')
+            raise FetchError(f"{host} failed {breaker.failures} times in a row, requests are paused for up to {RESET_TIMEOUT:g} seconds")
+        waited = rate_limiter().acquire()
+        if waited:
+            _count('throttled')
+            _count('waited', waited)
+            record('fetch.rate_limit_wait', waited)
+
+        wait_asked = None
+        _count('requests')
+        try:
+            with _host_semaphore(host), span('fetch.request'):
+                response = session().get(url, headers=headers, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+            count('fetch.bytes', len(response.content))
+        except requests.ConnectionError as e:
+            error = f"connection error, make sure you are connected to Internet ({e})"
+        except requests.Timeout as e:
+            error = f"timeout ({e})"
+        except requests.RequestException as e:
+            breaker.record_success() # a bad url or too many redirects, not a sign of a failing host
+            _count('failures')
+            raise FetchError(f"Unable to download {url}: {e}") from e
+        else:
+            if response.status_code not in RETRY_STATUSES:
+                breaker.record_success()
+                if response.status_code >= 400:
+                    _count('failures')
+                    raise FetchError(f"Unable to download {url}: HTTP {response.status_code} {response.reason}")
+                return response
+            error = f"HTTP {response.status_code} {response.reason}"
+            wait_asked = retry_after(response.headers.get('retry-after'))
+
+        breaker.record_failure()
+        if attempt == MAX_RETRIES or (wait_asked is not None and wait_asked > MAX_BACKOFF):
+            break
+        _count('retries')
+        time.sleep(backoff(attempt, wait_asked))
+
+    _count('failures')
+    raise FetchError(f"Unable to download {url} after {attempt + 1} attempts: {error}")
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""
+Import many movies and tv shows into the watchlist from a file of IMDB ids.
+
+Accepted files:
+- a list of IMDB ids, one per line ('tt0111161', '0111161' or a title url)
+- a CSV file with a 'Const', 'tconst' or 'imdb_id' column, e.g. an IMDb ratings or watchlist export
+
+Titles are looked up concurrently and stored in large batches. Ids already in the watchlist are skipped,
+so an interrupted import resumes where it stopped when it is started again (recently fetched pages
+come from the response cache).
+
+Typical usage example:
+> summary = import_file("ratings.csv")
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List
+import csv
+import re
+from search import new_search, MAX_WORKERS
+import database
+
+BATCH_SIZE = 500 # titles stored per transaction
+PROGRESS_EVERY = 50 # titles between two progress lines
+
+IMDB_ID = re.compile(r"(?:tt)?(\d{5,})")
+ID_COLUMNS = ['const', 'tconst', 'imdb_id']
+
+
+def read_imdb_ids(path: str) -> List[str]:
+    """
+    Read the IMDB ids of a file, without the 'tt' prefix and without duplicates.
+
+    Args:
+    path (str): a list of ids (one per line) or a CSV file with an id column
+
+    Return:
+    list: IMDB ids in the order of the file
+    """
+    with open(path, newline='', encoding='utf-8-sig') as file:
+        first_line = file.readline()
+        file.seek(0)
+        header = [column.strip().lower() for column in next(csv.reader([first_line]), [])]
+        column = next((column for column in ID_COLUMNS if column in header), None)
+        if column is not None:
+            values = (row[header.index(column)] for row in csv.reader(file) if len(row) > header.index(column))
+        else:
+            values = (line for line in file)
+
+        imdb_ids = []
+        for value in values:
+            match = IMDB_ID.search(value)
+            if match:
+                imdb_ids.append(match.group(1))
+    return list(dict.fromkeys(imdb_ids))
+
+
+def fetch_title(imdb_id: str) -> List:
+    """
+    Look up a title on IMDB.
+
+    Return:
+    list: 'show' or 'movie', and the row to store (as expected by database.add_shows / database.add_movies)
+    """
+    result = new_search().search_by_id(imdb_id)
+    return ['show' if result.is_tv_show else 'movie', result.to_row()]
+
+
+def import_file(path: str, max_workers: int = MAX_WORKERS, batch_size: int = BATCH_SIZE) -> Dict:
+    """
+    Import the titles of a file of IMDB ids, skipping the ones already in the watchlist.
+
+    Args:
+    path (str): file of IMDB ids, see read_imdb_ids
+    max_workers (int): number of titles looked up at the same time
+    batch_size (int): number of titles stored per transaction
+
+    Return:
+    dict: number of movies and shows added, ids skipped, and the ids that failed with their error
+    """
+    imdb_ids = read_imdb_ids(path)
+    stored = database.get_all_imdb_ids()
+    pending = [imdb_id for imdb_id in imdb_ids if imdb_id not in stored]
+    summary = {'movies': 0, 'shows': 0, 'skipped': len(imdb_ids) - len(pending), 'failed': {}}
+    print(f"\n-- Importing {len(pending)} titles ({summary['skipped']} already in the watchlist) --")
+
+    batches = {'movie': [], 'show': []}
+    def flush():
+        # the database is only written from this thread, the workers only download and parse
+        database.add_movies(batches['movie'])
+        database.add_shows(batches['show'])
+        summary['movies'] += len(batches['movie'])
+        summary['shows'] += len(batches['show'])
+        batches['movie'], batches['show'] = [], []
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {executor.submit(fetch_title, imdb_id): imdb_id for imdb_id in pending}
+    try:
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                kind, row = future.result()
+                batches[kind].append(row)
+            except Exception as e:
+                summary['failed'][futures[future]] = str(e)
+
+            if len(batches['movie']) + len(batches['show']) >= batch_size:
+                flush()
+            if done % PROGRESS_EVERY == 0 or done == len(pending):
+                print(f"[{done}/{len(pending)}] looked up, {len(summary['failed'])} failed")
+    finally:
+        # keep what was looked up so far when the import is interrupted
+        flush()
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+    print(f"-- Added {summary['movies']} movies and {summary['shows']} tv shows, "
+          f"skipped {summary['skipped']}, {len(summary['failed'])} failed --\n")
+    return summary
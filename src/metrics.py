@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""
+Measure where the time goes: downloads, HTML parsing, the response cache and database queries.
+
+Timed code is recorded as spans, named by phase ('fetch.*', 'search.*', 'cache.*', 'parsers.*',
+'database.*'): the number of calls, total / max duration and errors of every span. Counters add up
+what the spans moved (bytes downloaded, rows returned, cache hits...). Functions are timed with the timed decorator,
+blocks of code with the span context manager.
+
+Recording a span costs about a microsecond, so it is always on. The summary is printed by
+`python app.py --profile`, and export() writes the metrics for scheduled runs in the Prometheus
+text format (a .prom file, e.g. for the node exporter's textfile collector) or as JSON.
+
+Typical usage example:
+> @timed()
+> def parse_title(html): ...
+> with span('fetch.request'):
+>     response = session.get(url)
+> count('fetch.bytes', len(response.content))
+> print(summary())
+> export("watchlist.prom")
+"""
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, Iterator
+import inspect
+import threading
+import time
+
+PREFIX = "watchlist" # prefix of the exported Prometheus metrics
+
+_lock = threading.Lock()
+_spans = {} # name: [calls, total seconds, max seconds, errors]
+_counters = {} # name: value
+
+
+def record(name: str, seconds: float, error: bool = False):
+    """
+    Record one call of a span that took seconds.
+    """
+    with _lock:
+        stats = _spans.get(name)
+        if stats is None:
+            stats = _spans[name] = [0, 0.0, 0.0, 0]
+        stats[0] += 1
+        stats[1] += seconds
+        if seconds > stats[2]:
+            stats[2] = seconds
+        if error:
+            stats[3] += 1
+
+
+def count(name: str, value: float = 1):
+    """
+    Add value to a counter, e.g. count('fetch.bytes', len(body)).
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+@contextmanager
+def span(name: str):
+    """
+    Time the block of code it wraps (errors are recorded too).
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        record(name, time.perf_counter() - start, error=True)
+        raise
+    record(name, time.perf_counter() - start)
+
+
+def _timed_iterator(iterator: Iterator, span_name: str, rows_name: str) -> Iterator:
+    """
+    Time an iterator and count its rows. Only the time spent in the iterator counts,
+    not the time the caller spends between two rows.
+    """
+    elapsed, rows, error = 0.0, 0, False
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                row = next(iterator)
+            except StopIteration:
+                elapsed += time.perf_counter() - start
+                return
+            elapsed += time.perf_counter() - start
+            rows += 1
+            yield row
+    except Exception:
+        error = True
+        raise
+    finally:
+        record(span_name, elapsed, error)
+        count(rows_name, rows)
+
+
+def timed(name: str = None, rows: bool = True) -> Callable:
+    """
+    Decorate a function to time every call as a span (its module and name by default).
+
+    The rows a function returns (a list, tuple or set) are counted as '<name>.rows', unless rows is False
+    (e.g. a function returning a fixed size list). When it returns a generator, the span times the iteration
+    of the generator instead of the call, and counts the rows it yields.
+    """
+    def decorator(function: Callable) -> Callable:
+        span_name = name or f"{function.__module__}.{function.__name__}"
+        rows_name = f"{span_name}.rows"
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            except BaseException:
+                record(span_name, time.perf_counter() - start, error=True)
+                raise
+            if inspect.isgenerator(result):
+                return _timed_iterator(result, span_name, rows_name)
+            record(span_name, time.perf_counter() - start)
+            if rows and type(result) in (list, tuple, set): # lists of rows, not a single record (a NamedTuple)
+                count(rows_name, len(result))
+            return result
+        return wrapper
+    return decorator
+
+
+def snapshot() -> Dict:
+    """
+    Return a copy of every span and counter recorded so far.
+    """
+    with _lock:
+        spans = {name: {'calls': calls, 'seconds': total, 'max_seconds': longest, 'errors': errors}
+                 for name, (calls, total, longest, errors) in _spans.items()}
+        return {'spans': spans, 'counters': dict(_counters)}
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+
+
+def summary() -> str:
+    """
+    Format the spans as a table grouped by phase, slowest phase first, followed by the counters.
+    Spans nest (search.fetch_page includes its fetch.* and cache.* spans), so phases overlap.
+    """
+    metrics = snapshot()
+    phases = {}
+    for name, stats in metrics['spans'].items():
+        phases.setdefault(name.split('.')[0], []).append((name, stats))
+    lines = [f"{'span':<40}{'calls':>8}{'total ms':>12}{'mean ms':>10}{'max ms':>10}{'errors':>8}"]
+    for phase, spans in sorted(phases.items(), key=lambda item: -sum(stats['seconds'] for _, stats in item[1])):
+        total = sum(stats['seconds'] for _, stats in spans)
+        lines.append(f"{phase:<40}{sum(stats['calls'] for _, stats in spans):>8}{total * 1000:>12.1f}")
+        for name, stats in sorted(spans, key=lambda item: -item[1]['seconds']):
+            lines.append(f"  {name:<38}{stats['calls']:>8}{stats['seconds'] * 1000:>12.1f}"
+                         f"{stats['seconds'] * 1000 / stats['calls']:>10.2f}{stats['max_seconds'] * 1000:>10.1f}{stats['errors']:>8}")
+    if metrics['counters']:
+        lines.append("")
+        lines.extend(f"{name:<40}{value:>12.12g}" for name, value in sorted(metrics['counters'].items()))
+    return "\n".join(lines)
+
+
+def to_prometheus() -> str:
+    """
+    Format the metrics in the Prometheus text exposition format.
+    """
+    metrics = snapshot()
+    lines = [f"# HELP {PREFIX}_span_seconds Time spent in a span.", f"# TYPE {PREFIX}_span_seconds summary"]
+    for name, stats in sorted(metrics['spans'].items()):
+        lines.append(f'{PREFIX}_span_seconds_count{{span="{name}"}} {stats["calls"]}')
+        lines.append(f'{PREFIX}_span_seconds_sum{{span="{name}"}} {stats["seconds"]:.6f}')
+    lines += [f"# HELP {PREFIX}_span_errors_total Calls of a span that raised.", f"# TYPE {PREFIX}_span_errors_total counter"]
+    lines += [f'{PREFIX}_span_errors_total{{span="{name}"}} {stats["errors"]}' for name, stats in sorted(metrics['spans'].items())]
+    lines += [f"# HELP {PREFIX}_events_total Bytes, rows and cache hits counted by the spans.", f"# TYPE {PREFIX}_events_total counter"]
+    lines += [f'{PREFIX}_events_total{{name="{name}"}} {value:.12g}' for name, value in sorted(metrics['counters'].items())]
+    return "\n".join(lines) + "\n"
+
+
+def export(path: str):
+    """
+    Write the metrics to path: Prometheus text format for a .prom file, JSON otherwise.
+    The file is replaced atomically, so a collector never reads half of it.
+    """
+    import json
+    import os
+    if path.endswith('.prom'):
+        content = to_prometheus()
+    else:
+        content = json.dumps(dict(snapshot(), time=time.time()), indent=2)
+    with open(f"{path}.tmp", 'w') as output:
+        output.write(content)
+    os.replace(f"{path}.tmp", path)
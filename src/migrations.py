@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+"""
+Create and upgrade the schema of the watchlist database.
+
+The schema version of a database is kept in PRAGMA user_version: 0 for a new database (or one created
+before migrations existed), then the number of the last migration applied. Every migration upgrades
+the database by one version.
+
+A new database gets the latest tables from the first migration, so later migrations find little to do.
+Older databases are upgraded step by step. Data is backfilled in batches of BATCH_SIZE rows, each batch
+in its own short transaction, so that a large database is never locked for the whole upgrade and an
+interrupted upgrade loses at most one batch. Migrations only run from one process at a time (at start-up).
+
+Typical usage example:
+> migrate()
+> schema_version()
+"""
+from typing import Callable, Dict, Iterator, List, Tuple
+import sqlite3
+import time
+from parsers import parse_years
+import database
+
+BATCH_SIZE = 5000 # rows written per transaction by the backfills
+
+SELECT_VERSION = "PRAGMA user_version;"
+SET_VERSION = "PRAGMA user_version = {version};"
+SELECT_COLUMNS = "PRAGMA table_info({table_name});"
+ADD_COLUMN = "ALTER TABLE {table_name} ADD COLUMN {column} {type_};"
+COUNT_TABLES = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table';"
+SELECT_INDEX = "SELECT name FROM sqlite_master WHERE type = 'index' AND name = ?;"
+COUNT_ROWS = "SELECT COUNT(*) FROM {table_name} WHERE id > ? AND id <= ?;"
+SELECT_MAX_ID = "SELECT MAX(id) FROM {table_name};"
+# last id of the next batch of rows
+SELECT_BATCH_END = "SELECT MAX(id) FROM (SELECT id FROM {table_name} WHERE id > ? AND id <= ? ORDER BY id LIMIT ?);"
+
+# -- Full-text index --
+CLEAR_FTS = "INSERT INTO {table_name}_fts ({table_name}_fts) VALUES ('delete-all');"
+INSERT_FTS_BATCH = """INSERT INTO {table_name}_fts (rowid, title, description)
+SELECT id, title, description FROM {table_name} WHERE id > ? AND id <= ?;"""
+
+# -- Unique imdb_id --
+# rows of a title stored more than once, except the oldest one (which is kept)
+DUPLICATE_IDS = """SELECT id FROM {table_name} WHERE imdb_id IS NOT NULL
+AND id NOT IN (SELECT MIN(id) FROM {table_name} GROUP BY imdb_id)"""
+# the kept row gets the information of the most recently added duplicate
+MERGE_DUPLICATES = """UPDATE {table_name} SET (title, release_date_timestamp, rating, type_, runtime, description) = (
+    SELECT newest.title, newest.release_date_timestamp, newest.rating, newest.type_, newest.runtime, newest.description
+    FROM {table_name} AS newest WHERE newest.imdb_id = {table_name}.imdb_id ORDER BY newest.id DESC LIMIT 1)
+WHERE id IN (SELECT MIN(id) FROM {table_name} WHERE imdb_id IS NOT NULL GROUP BY imdb_id HAVING COUNT(*) > 1);"""
+# a user who watched two copies of a movie keeps one watched row, the other one is deleted below
+REPOINT_WATCHED_DUPLICATES = """UPDATE OR IGNORE watched SET movie_id = (
+    SELECT MIN(kept.id) FROM movies AS kept JOIN movies AS duplicate ON duplicate.imdb_id = kept.imdb_id
+    WHERE duplicate.id = watched.movie_id)
+WHERE movie_id IN ({duplicate_ids});"""
+DELETE_WATCHED_DUPLICATES = "DELETE FROM watched WHERE movie_id IN ({duplicate_ids});"
+DELETE_DUPLICATES = "DELETE FROM {table_name} WHERE id IN ({duplicate_ids});"
+
+# -- Dates of tv shows --
+SHOW_DATE_COLUMNS = {'start_year': 'INTEGER', 'end_year': 'INTEGER', 'next_airdate_timestamp': 'REAL'}
+SELECT_SHOW_DATES_BATCH = "SELECT id, release_date_timestamp FROM shows WHERE id > ? AND id <= ?;"
+UPDATE_SHOW_YEARS = "UPDATE shows SET start_year = ?, end_year = ? WHERE id = ?;"
+UPDATE_NEXT_AIRDATES_BATCH = """UPDATE shows SET next_airdate_timestamp = (
+    SELECT MIN(airdate_timestamp) FROM episodes WHERE show_imdb_id = shows.imdb_id AND airdate_timestamp >= ?)
+WHERE id > ? AND id <= ?;"""
+
+# -- Refresh schedule --
+REFRESH_COLUMNS = {'refreshed_at': 'REAL'}
+DROP_FTS_UPDATE_TRIGGER = "DROP TRIGGER IF EXISTS {table_name}_fts_update;"
+
+# -- Timeline --
+CLEAR_TIMELINE = "DELETE FROM timeline;"
+TIMELINE_MOVIES_BATCH = "movies.id > ? AND movies.id <= ?"
+TIMELINE_SHOW_EPISODES = "episodes.show_imdb_id = ?"
+TIMELINE_USER_WATCHED = "watched.user_username = ?"
+SELECT_EPISODE_SHOWS = "SELECT DISTINCT show_imdb_id FROM episodes;"
+SELECT_WATCHED_USERS = "SELECT DISTINCT user_username FROM watched;"
+#-------------------------------------
+
+
+def schema_version(connection: sqlite3.Connection = None) -> int:
+    """
+    Return the schema version of the database (the number of migrations applied).
+    """
+    connection = connection or database.get_connection()
+    return connection.execute(SELECT_VERSION).fetchone()[0]
+
+
+def _id_batches(connection: sqlite3.Connection, table_name: str, batch_size: int, label: str) -> Iterator[Tuple[int, int]]:
+    """
+    Split the rows of a table into batches of consecutive ids and print the progress after every batch.
+    Rows added after the first batch are not included (they are already written by the current code).
+
+    Return:
+    iterator: (first id excluded, last id included) of every batch
+    """
+    last_id = connection.execute(SELECT_MAX_ID.format(table_name=table_name)).fetchone()[0] or 0
+    total = connection.execute(COUNT_ROWS.format(table_name=table_name), (0, last_id)).fetchone()[0]
+    done, batch_start = 0, 0
+    while batch_start < last_id:
+        batch_end = connection.execute(SELECT_BATCH_END.format(table_name=table_name), (batch_start, last_id, batch_size)).fetchone()[0]
+        if batch_end is None:
+            break
+        yield batch_start, batch_end
+        done += connection.execute(COUNT_ROWS.format(table_name=table_name), (batch_start, batch_end)).fetchone()[0]
+        print(f"   {label}: {done}/{total} rows")
+        batch_start = batch_end
+
+
+def _add_columns(connection: sqlite3.Connection, table_name: str, columns: Dict[str, str]) -> List[str]:
+    """
+    Add the columns a table does not have yet. Returns the added columns.
+    """
+    existing = {row[1] for row in connection.execute(SELECT_COLUMNS.format(table_name=table_name))}
+    added = [column for column in columns if column not in existing]
+    for column in added:
+        connection.execute(ADD_COLUMN.format(table_name=table_name, column=column, type_=columns[column]))
+    return added
+
+
+def create_tables(connection: sqlite3.Connection, batch_size: int):
+    """
+    Create the tables that do not exist yet, with their latest columns.
+    """
+    with connection:
+        connection.execute(database.CREATE_MOVIES_TABLE)
+        connection.execute(database.CREATE_SHOWS_TABLE)
+        connection.execute(database.CREATE_USERS_TABLE)
+        connection.execute(database.CREATE_WATCHED_TABLE)
+        connection.execute(database.CREATE_RELEASE_INDEX)
+        connection.execute(database.CREATE_EPISODES_TABLE)
+        connection.execute(database.CREATE_SEASONS_TABLE)
+        connection.execute(database.CREATE_AIRDATE_INDEX)
+
+
+def create_fts_index(connection: sqlite3.Connection, batch_size: int):
+    """
+    Index the title and description of movies and shows, if sqlite is compiled with FTS5
+    (otherwise the local search keeps using LIKE).
+    """
+    try:
+        with connection:
+            for table_name in ('movies', 'shows'):
+                connection.execute(database.CREATE_FTS_TABLE.format(table_name=table_name))
+                connection.execute(database.CREATE_FTS_INSERT_TRIGGER.format(table_name=table_name))
+                connection.execute(database.CREATE_FTS_DELETE_TRIGGER.format(table_name=table_name))
+                connection.execute(database.CREATE_FTS_UPDATE_TRIGGER.format(table_name=table_name))
+                # start from an empty index, also when an interrupted run of this migration left a partial one
+                connection.execute(CLEAR_FTS.format(table_name=table_name))
+    except sqlite3.OperationalError:
+        return # no FTS5 module
+    finally:
+        database.fts_enabled = None # decided again on the next search
+
+    # the triggers index the rows written from now on, the rows already stored are indexed in batches
+    for table_name in ('movies', 'shows'):
+        for batch_start, batch_end in _id_batches(connection, table_name, batch_size, f"{table_name}_fts"):
+            with connection:
+                connection.execute(INSERT_FTS_BATCH.format(table_name=table_name), (batch_start, batch_end))
+
+
+def unique_imdb_ids(connection: sqlite3.Connection, batch_size: int):
+    """
+    Merge the movies and tv shows that were stored more than once, and make imdb_id unique.
+    Watched movies are moved to the row that is kept.
+
+    This is one transaction: the unique index can only be created once no duplicates are left.
+    """
+    with connection:
+        for table_name in ('movies', 'shows'):
+            if connection.execute(SELECT_INDEX, (f"idx_{table_name}_imdb_id",)).fetchone():
+                continue
+            duplicate_ids = DUPLICATE_IDS.format(table_name=table_name)
+            connection.execute(MERGE_DUPLICATES.format(table_name=table_name))
+            if table_name == 'movies':
+                connection.execute(REPOINT_WATCHED_DUPLICATES.format(duplicate_ids=duplicate_ids))
+                connection.execute(DELETE_WATCHED_DUPLICATES.format(duplicate_ids=duplicate_ids))
+            removed = connection.execute(DELETE_DUPLICATES.format(table_name=table_name, duplicate_ids=duplicate_ids)).rowcount
+            connection.execute(database.CREATE_IMDB_ID_INDEX.format(table_name=table_name))
+            if removed:
+                print(f"   {table_name}: merged {removed} duplicates")
+
+
+def show_dates(connection: sqlite3.Connection, batch_size: int):
+    """
+    Store the start / end years and the next airdate of tv shows as numbers, and index them.
+    """
+    with connection:
+        _add_columns(connection, 'shows', SHOW_DATE_COLUMNS)
+        connection.execute(database.CREATE_SHOW_YEARS_INDEX)
+        connection.execute(database.CREATE_NEXT_AIRDATE_INDEX)
+    backfill_show_dates(connection, batch_size)
+
+
+def backfill_show_dates(connection: sqlite3.Connection = None, batch_size: int = BATCH_SIZE):
+    """
+    Compute the start / end years and the next airdate of every tv show from its release date and its episodes.
+    """
+    connection = connection or database.get_connection()
+    today = database._start_of_today()
+    for batch_start, batch_end in _id_batches(connection, 'shows', batch_size, "shows"):
+        with connection:
+            rows = connection.execute(SELECT_SHOW_DATES_BATCH, (batch_start, batch_end)).fetchall()
+            connection.executemany(UPDATE_SHOW_YEARS, [(*parse_years(release_date), id_) for id_, release_date in rows])
+            connection.execute(UPDATE_NEXT_AIRDATES_BATCH, (today, batch_start, batch_end))
+
+
+def refresh_schedule(connection: sqlite3.Connection, batch_size: int):
+    """
+    Remember when every title was last refreshed, for the refresh daemon. The full-text index is
+    only updated when the title or the description changes, not on every refresh.
+    """
+    with connection:
+        for table_name in ('movies', 'shows'):
+            _add_columns(connection, table_name, REFRESH_COLUMNS)
+            if connection.execute(database.SELECT_FTS_TABLE.format(table_name=table_name)).fetchone():
+                connection.execute(DROP_FTS_UPDATE_TRIGGER.format(table_name=table_name))
+                connection.execute(database.CREATE_FTS_UPDATE_TRIGGER.format(table_name=table_name))
+
+
+def timeline(connection: sqlite3.Connection, batch_size: int):
+    """
+    Keep the releases of movies and the airdates of episodes in one table indexed by date, for the timeline.
+    """
+    with connection:
+        connection.execute(database.CREATE_TIMELINE_TABLE)
+        connection.execute(database.CREATE_TIMELINE_INDEX)
+        for trigger in database.CREATE_TIMELINE_TRIGGERS:
+            connection.execute(trigger)
+        # start from an empty timeline, also when an interrupted run of this migration left a partial one
+        connection.execute(CLEAR_TIMELINE)
+
+    # the triggers add the rows written from now on, the rows already stored are added in batches
+    for batch_start, batch_end in _id_batches(connection, 'movies', batch_size, "timeline of movies"):
+        with connection:
+            connection.execute(database.INSERT_MOVIES_TIMELINE.format(condition=TIMELINE_MOVIES_BATCH), (batch_start, batch_end))
+    # episodes have no id, they are added one tv show at a time
+    shows = [show_imdb_id for show_imdb_id, in connection.execute(SELECT_EPISODE_SHOWS)]
+    for done, show_imdb_id in enumerate(shows, start=1):
+        with connection:
+            connection.execute(database.INSERT_EPISODES_TIMELINE.format(condition=TIMELINE_SHOW_EPISODES), (show_imdb_id,))
+        if done % batch_size == 0 or done == len(shows):
+            print(f"   timeline of episodes: {done}/{len(shows)} tv shows")
+    # and the watched movies one user at a time, once the movies are in
+    users = [username for username, in connection.execute(SELECT_WATCHED_USERS)]
+    for done, username in enumerate(users, start=1):
+        with connection:
+            connection.execute(database.INSERT_WATCHED_TIMELINE.format(condition=TIMELINE_USER_WATCHED), (username,))
+        print(f"   timeline of watched movies: {done}/{len(users)} users")
+
+
+# the migration to version n is MIGRATIONS[n - 1], never change the order or remove one
+MIGRATIONS: List[Tuple[str, Callable]] = [
+    ("create the tables", create_tables),
+    ("full-text index of titles and descriptions", create_fts_index),
+    ("unique IMDB ids", unique_imdb_ids),
+    ("numeric dates of tv shows", show_dates),
+    ("refresh schedule", refresh_schedule),
+    ("timeline of movies and episodes", timeline),
+]
+
+
+def migrate(batch_size: int = BATCH_SIZE) -> int:
+    """
+    Apply the migrations the database is missing, in order.
+
+    Args:
+    batch_size (int): rows written per transaction by the backfills
+
+    Return:
+    int: the schema version of the database
+    """
+    connection = database.get_connection()
+    version = schema_version(connection)
+    # creating a new database is not worth reporting
+    verbose = connection.execute(COUNT_TABLES).fetchone()[0] > 0
+    for number, (description, migration) in enumerate(MIGRATIONS[version:], start=version + 1):
+        if verbose:
+            print(f"-- Upgrading the database to version {number}/{len(MIGRATIONS)}: {description} --")
+        start = time.perf_counter()
+        migration(connection, batch_size)
+        # the version only moves once the whole migration is done, an interrupted one runs again
+        connection.execute(SET_VERSION.format(version=number))
+        if verbose:
+            print(f"   done in {time.perf_counter() - start:.2f}s")
+        version = number
+    return version
@@ -3,13 +3,35 @@
 Designed model to interact with search and database modules (the building blocks of app.py). 
 """
 import sys
-from typing import Tuple
-from search import Search
-import pandas as pd
+from typing import Callable, Iterable, Tuple
+from search import new_search, response_cache
 import datetime
+import importer
+import sync
 sys.path.insert(0,'..')
 import database
 
+PAGE_SIZE = 25 # rows printed before asking whether to continue
+
+
+def print_paged(heading: str, rows: Iterable, format_row: Callable) -> int:
+    """
+    Print rows as they arrive, pausing every PAGE_SIZE rows until the user asks for more.
+
+    Return:
+    int: number of rows printed (nothing is printed when there are no rows)
+    """
+    count = 0
+    for count, row in enumerate(rows, start=1):
+        if count == 1:
+            print(f"\n-- {heading} --")
+        print(format_row(row))
+        if count % PAGE_SIZE == 0 and input("-- Press Enter for more, q to stop: ").lower() == 'q':
+            break
+    if count:
+        print("-- End --\n")
+    return count
+
 
 class MovieWatchlistMenu:
     """ Movie watchlist menu options """
@@ -27,15 +49,18 @@ class TVWatchlistMenu:
     ADD_TO_WATCHLIST = '1'
     SEARCH = '2'
     VIEW_ALL_SHOWS = '3'
-    VIEW_UPCOMING_EPISODES = '4'
-    DELETE = '5'
-    EXIT = '6'
+    VIEW_UPCOMING_SHOWS = '4'
+    VIEW_UPCOMING_EPISODES = '5'
+    REFRESH_EPISODES = '6'
+    DELETE = '7'
+    EXIT = '8'
 
 class AddToWatchlistMenu:
     """ Add to watchlist menu options """
     SEARCH_BY_TITLE = '1'
     ADD_TO_WATCHLIST = '2'
-    EXIT = '3'
+    IMPORT = '3'
+    EXIT = '4'
 
 
 #------------------------------
@@ -76,45 +101,44 @@ Your selection: """
             else:
                print("\nInvalid input, please try again!\n")
 
-    def __print_movie_list(self, heading: str, movies: Tuple):
-        print(f"\n-- {heading} Movies --")
-        for id_, imdb_id, title, release_date, rating, _, runtime, _ in movies:
+    def __print_movie_list(self, heading: str, movies: Iterable) -> int:
+        def format_movie(movie: Tuple) -> str:
+            id_, imdb_id, title, release_date, rating, _, runtime = movie[:7]
             movie_date = datetime.datetime.fromtimestamp(release_date)
             human_date = movie_date.strftime("%Y")
-            print(f"{id_} (IMDB ID: {imdb_id!r}): {title!r} (on {human_date}) - {rating} - {runtime}")
-        print("-- End --\n")   
+            return f"{id_} (IMDB ID: {imdb_id!r}): {title!r} (on {human_date}) - {rating} - {runtime}"
+        return print_paged(f"{heading} Movies", movies, format_movie)
 
     def search_locally(self):
-        search_term = input("Enter the partial movie title: ")
+        search_term = input("Enter (partial) words of the movie title or description: ")
         movies = database.search_movies(search_term)
-        if movies:
-            self.__print_movie_list("Found", movies)
-        else:
+        if not self.__print_movie_list("Found", movies):
             print("\nFound no movies for that search term!\n")
 
     def view_all_movies(self):
-        movies = database.get_movies()
-        self.__print_movie_list('All', movies)
+        movies = database.iter_movies()
+        if not self.__print_movie_list('All', movies):
+            print("\nThere are no movies in the watchlist!\n")
 
     def view_watched_movies(self):
         username = input("Username: ")
-        movies = database.get_watched_movies(username)
-        if movies:
-            self.__print_movie_list("Watched", movies)
-        else:
+        movies = database.iter_watched_movies(username)
+        if not self.__print_movie_list("Watched", movies):
             print(f"\n{username} has watched no movies yet!\n") 
 
     def view_upcoming_movies(self):
-        movies = database.get_movies(True)
-        if movies:
-            self.__print_movie_list("Upcoming", movies)
-        else:
+        movies = database.iter_movies(upcoming=True, order_by='release_date')
+        if not self.__print_movie_list("Upcoming", movies):
             print(f"\nThere are no upcoming movies in the watchlist!\n")  
 
     def __watch_movie(self):
         username = input("Username: ")
         movie_id = input("Movie ID (NOT IMDB ID): ")
-        database.watch_movie(username, movie_id)
+        try:
+            if not database.watch_movie(username, movie_id):
+                print(f"\n{movie_id} is already in the watched movies.\n")
+        except database.NotFoundError as e:
+            print(f"\n{e}\n")
     
     def __delete_movie(self):
         print("\nWARNING: this will delete the movie for all users.\n")
@@ -136,9 +160,11 @@ class TVWatchlist:
 1) Add tv show. 
 2) Search (local database only).
 3) View all TV shows in your watchlist.
-4) View upcoming episodes.
-5) Delete tv show.
-6) Go back.
+4) View upcoming and still running TV shows.
+5) View upcoming episodes.
+6) Refresh episodes (online).
+7) Delete tv show.
+8) Go back.
 
 Your selection: """
 
@@ -150,44 +176,59 @@ Your selection: """
                 self.search_locally()
             elif user_input == TVWatchlistMenu.VIEW_ALL_SHOWS:
                 self.view_all_shows()                    
+            elif user_input == TVWatchlistMenu.VIEW_UPCOMING_SHOWS:
+                self.view_upcoming_shows()
             elif user_input == TVWatchlistMenu.VIEW_UPCOMING_EPISODES:
                 self.view_upcoming_episodes()
+            elif user_input == TVWatchlistMenu.REFRESH_EPISODES:
+                self.refresh_episodes()
             elif user_input == TVWatchlistMenu.DELETE:
                 self.__delete_show()                                    
             else:
                 print("\nInvalid input, please try again!\n")
 
     def search_locally(self):
-        search_term = input("Enter the partial show title: ")
+        search_term = input("Enter (partial) words of the show title or description: ")
         shows = database.search_shows(search_term)
-        if shows:
-            self.__print_show_list("Found", shows)
-        else:
+        if not self.__print_show_list("Found", shows):
             print("\nFound no tv shows for that search term!\n")
 
-    def __print_show_list(self, heading: str, movies: Tuple):
-        print(f"\n-- {heading} TV Shows --")
-        for id_, imdb_id, title, release_date, rating, _, runtime, _ in movies:
-            print(f"{id_} (IMDB ID: {imdb_id!r}): {title!r} ({release_date}) - {rating} - {runtime}")
-        print("-- End --\n")   
+    def __print_show_list(self, heading: str, shows: Iterable) -> int:
+        def format_show(show: Tuple) -> str:
+            id_, imdb_id, title, release_date, rating, _, runtime = show[:7]
+            return f"{id_} (IMDB ID: {imdb_id!r}): {title!r} ({release_date}) - {rating} - {runtime}"
+        return print_paged(f"{heading} TV Shows", shows, format_show)
 
     def view_all_shows(self):
-        shows = database.get_shows()
-        self.__print_show_list('All', shows)
+        shows = database.iter_shows()
+        if not self.__print_show_list('All', shows):
+            print("\nThere are no tv shows in the watchlist!\n")
+
+    def view_upcoming_shows(self):
+        shows = database.iter_shows(upcoming=True, order_by='next_airdate')
+        if not self.__print_show_list('Upcoming', shows):
+            print("\nThere are no upcoming tv shows in the watchlist! Try refreshing the episodes first.\n")
+        shows = database.iter_shows(running=True)
+        if not self.__print_show_list('Still Running', shows):
+            print("\nThere are no running tv shows in the watchlist!\n")
     
     def view_upcoming_episodes(self):
-        imdb_ids = database.get_imdb_id()
-        search = Search()
-        for id_ in imdb_ids:
-            results, title = search.upcoming_episodes(id_[0])
-            if isinstance(results, pd.DataFrame):
-                print(f"\n-- {title} --")
-                print(results.to_string(index=False))
-                print("-------- \n")
-            else:
-                print(results)
-                print("-------- \n")
-    
+        def format_episode(episode: Tuple) -> str:
+            _, show_title, season, episode_num, title, airdate = episode
+            return f"{airdate}: {show_title!r} S{season:02}E{episode_num:02} - {title!r}"
+        episodes = database.get_upcoming_episodes()
+        if not print_paged("Upcoming Episodes", episodes, format_episode):
+            print("\nThere are no upcoming episodes in the watchlist! Try refreshing the episodes first.\n")
+
+    def refresh_episodes(self):
+        imdb_ids = [id_[0] for id_ in database.get_imdb_id()]
+        print("\n-- Refreshing Episodes --")
+        for _, title, message in sync.sync_shows(imdb_ids):
+            print(f"{title}: {message}")
+        stats = response_cache().stats()
+        print(f"-- {stats['hits']} pages from cache, {stats['misses']} downloaded, {stats['revalidated']} revalidated "
+              f"(saved {stats['seconds_saved']:.1f}s of network time) --\n")
+
     def __delete_show(self):
         print("\nWARNING: this will delete the tv show for all users.\n")
         imdb_id = input("TV Show ID (NOT IMDB ID): ")
@@ -212,7 +253,8 @@ class AddToWatchlist:
         ADD_TO_WATCHLIST_PROMPT = """Please select one of the following options:
 1) Search online by title. 
 2) Add to watchlist using an IMDB id (find it using option '1').
-3) Go back.
+3) Import IMDB ids from a file (a list of ids or an IMDb CSV export).
+4) Go back.
 
 Your selection: """
         while (user_input := input(ADD_TO_WATCHLIST_PROMPT)) != AddToWatchlistMenu.EXIT:
@@ -221,50 +263,34 @@ Your selection: """
                 self.search_by_title()
             elif user_input == AddToWatchlistMenu.ADD_TO_WATCHLIST:
                 self.__add_to_wachlist()
+            elif user_input == AddToWatchlistMenu.IMPORT:
+                self.import_file()
             else:
                print("\nInvalid input, please try again!\n")
 
     def search_by_title(self):
-        search = Search(self.tv_show)
+        search = new_search(self.tv_show)
         return search.prompt_search_by_title()
 
     def search_by_id(self):
-        search = Search(self.tv_show)
+        search = new_search(self.tv_show)
         print("\nWARNING: you need an IMDB id here. Copy it from the output of option '1'.\n")
         return search.prompt_search_by_id()
 
+    def import_file(self):
+        path = input("Path of the file: ")
+        try:
+            summary = importer.import_file(path)
+        except OSError as e:
+            print(f"\nError: unable to read {path!r}: {e}\n")
+            return
+        for imdb_id, error in summary['failed'].items():
+            print(f"Failed to import tt{imdb_id}: {error}")
+
     def __add_to_wachlist(self):
-        results = self.search_by_id()
-        if results is not None:
+        result = self.search_by_id()
+        if result is not None:
             user_input = input('Would you like to add this to your watchlist (Y/n)? ').lower()
             if user_input != 'n':
-                if self.tv_show:
-                    release_date = results.release_date[0]
-                    database.add_show(  results.imdb_id[0],
-                                        results.title[0],
-                                        release_date,
-                                        results.rating[0],
-                                        results.type[0],
-                                        results.runtime[0],
-                                        results.discription[0])
-                    
-                else:
-                    date_time = results.release_date[0]
-                    release_date = datetime.datetime.strptime(date_time, "%Y").timestamp()
-                    database.add_movie( results.imdb_id[0],
-                                        results.title[0],
-                                        release_date,
-                                        results.rating[0],
-                                        results.type[0],
-                                        results.runtime[0],
-                                        results.discription[0])
-                print(f"\n-- {results.title[0]!r} is added to your watchlist --\n\n")
-
-
-
-
-
-
-
-
-
+                database.add_title(result)
+                print(f"\n-- {result.title!r} is added to your watchlist --\n\n")
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Parse downloaded pages in worker processes, so bulk scrapes use every core.
+
+Parsing HTML is CPU bound: the download threads of the search module wait on the network in parallel,
+but their parsing runs one page at a time under the GIL. With a parse pool, the threads hand the pages
+to a pool of processes and wait for the records (small NamedTuples) to come back, while the next
+downloads go on.
+
+Workers are started with forkserver (spawn where there is no forkserver), not forked from the calling
+process: the pool is started from a download thread, and a fork copies the locks other threads hold at
+that moment (metrics, caches, urllib3), locked forever in the child.
+
+The pool is off by default (pages are parsed in the calling thread, which is faster for a few pages):
+set WATCHLIST_PARSE_WORKERS (0 = off) or call configure() before a bulk refresh or import.
+
+Typical usage example:
+> configure(workers=4)
+> record = parse(parsers.parse_title, html, "0944947")
+> ParsePool(4).map(parsers.parse_episodes, pages)
+"""
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Callable, Iterable, List, Optional
+import multiprocessing
+import os
+import sys
+import threading
+from metrics import span
+
+WORKERS = int(os.environ.get('WATCHLIST_PARSE_WORKERS', '0') or 0)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _start_method() -> str:
+    return 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+def _call(parser: Callable, args: tuple, html: str):
+    return parser(html, *args)
+
+
+def _warm_up():
+    # import bs4 and lxml once per worker, not on its first page
+    import parsers
+    parsers.parse_page("<html></html>", 'title')
+
+
+class ParsePool:
+    """
+    A pool of processes running the parsers of parsers.py.
+
+    Attributes:
+    workers: number of processes (the number of cores by default)
+    """
+    def __init__(self, workers: int = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.__executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_up,
+                                              mp_context=multiprocessing.get_context(_start_method()))
+
+    def submit(self, parser: Callable, html: str, *args) -> Future:
+        """
+        Parse a page in a worker: parser is a function of parsers.py, called as parser(html, *args).
+        """
+        return self.__executor.submit(parser, html, *args)
+
+    def map(self, parser: Callable, pages: Iterable[str], *args, chunksize: int = 1) -> List:
+        """
+        Parse many pages with the same parser, results in the order of pages.
+        chunksize pages are sent to a worker at once (larger chunks for many small pages).
+        """
+        return list(self.__executor.map(partial(_call, parser, args), pages, chunksize=chunksize))
+
+    def close(self, wait: bool = True, cancel_futures: bool = False):
+        """
+        Stop the workers, once the submitted pages are parsed (wait) or right away.
+        cancel_futures cancels the pages not started yet (Python 3.9 or higher).
+        """
+        if sys.version_info >= (3, 9):
+            self.__executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+        else:
+            self.__executor.shutdown(wait=wait)
+
+
+def configure(workers: int):
+    """
+    Parse pages in workers processes from now on (0 to parse them in the calling thread).
+    Pages already submitted to the previous pool are parsed before it closes, the ones submitted
+    while it closes are parsed in their calling thread.
+    """
+    global WORKERS, _pool
+    with _pool_lock:
+        WORKERS = workers
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def pool() -> Optional[ParsePool]:
+    """
+    Return the pool shared by the search module, started on first use, or None when it is off.
+    """
+    global _pool
+    with _pool_lock:
+        if WORKERS and _pool is None:
+            _pool = ParsePool(WORKERS)
+        return _pool
+
+
+def parse(parser: Callable, html: str, *args):
+    """
+    Run parser(html, *args) in the shared pool, or in the calling thread when the pool is off.
+    """
+    shared_pool = pool()
+    if shared_pool is None:
+        return parser(html, *args)
+    future = None
+    try:
+        # the parsers' own spans are recorded in the workers, this one is the time the caller waited
+        with span(f"parse_pool.{parser.__name__}"):
+            future = shared_pool.submit(parser, html, *args)
+            return future.result()
+    except BrokenProcessPool:
+        # a worker died (e.g. killed for memory): start a new pool on the next page, parse this one here
+        global _pool
+        with _pool_lock:
+            if _pool is shared_pool:
+                _pool = None
+                # release the workers still alive, the pages queued in the broken pool would fail anyway
+                shared_pool.close(wait=False, cancel_futures=True)
+        return parser(html, *args)
+    except RuntimeError:
+        if future is not None:
+            raise # raised by the parser
+        # configure() closed the pool after pool() returned it
+        return parser(html, *args)
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+"""
+Parse the IMDB pages scraped by the search module.
+
+The elements every page is read from are declared in one table (SELECTORS). Only those elements
+and their children are parsed (bs4 SoupStrainer), instead of building a tree of the whole page.
+The parser backend is lxml when it is installed and html.parser otherwise. Set the
+WATCHLIST_HTML_PARSER environment variable to pick one explicitly.
+
+Typical usage example:
+> parse_title(html, "16358384")
+> parse_episodes(html, upcoming=True)
+> parse_page(html, "title", backend="html.parser")
+"""
+from datetime import datetime
+from functools import lru_cache
+from importlib.util import find_spec
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+from metrics import timed
+from records import EpisodeRecord, TitleRecord
+import os
+import re
+
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+
+# tree builders of bs4 that support partial parsing, from the fastest to the slowest
+BACKENDS = ['lxml', 'html.parser']
+
+# (tag, attribute, value) of the elements each page is read from
+SELECTORS = {
+    'title_search': {
+        'result': ('div', 'class', 'ipc-metadata-list-summary-item__tc'),
+    },
+    'title': {
+        'title': ('h1', 'data-testid', 'hero-title-block__title'),
+        'description': ('span', 'data-testid', 'plot-xl'),
+        'metadata': ('ul', 'data-testid', 'hero-title-block__metadata'),
+        'rating': ('div', 'data-testid', 'hero-rating-bar__aggregate-rating__score'),
+    },
+    'episodes': {
+        'show_title': ('h3', 'itemprop', 'name'),
+        'seasons': ('select', 'id', 'bySeason'),
+        'episode': ('div', 'class', 'info'),
+    },
+}
+
+# airdates on the episode guides, from the most to the least precise
+AIRDATE_FORMATS = ["%d %b. %Y", "%d %b %Y", "%b. %Y", "%b %Y", "%Y"]
+
+# years a tv show aired: '2011–2019' (ended), '2019–' (still running) or '2019' (aired within one year)
+YEARS = re.compile(r"(\d{4})(\s*[–-]\s*)?(\d{4})?")
+
+PARSE_ERROR = "Unable to parse the information. Probably the HTML elements have been changed. Please report this issue on Github."
+
+
+def available_backends() -> List[str]:
+    """
+    Return the parser backends that can be used in this environment.
+    """
+    return [backend for backend in BACKENDS if backend == 'html.parser' or find_spec(backend)]
+
+
+def default_backend() -> str:
+    """
+    Return the backend selected by WATCHLIST_HTML_PARSER, or the fastest installed one.
+    """
+    backend = os.environ.get('WATCHLIST_HTML_PARSER')
+    if backend:
+        if backend not in available_backends():
+            raise ValueError(f"Unknown or not installed HTML parser {backend!r}, use one of {available_backends()}.")
+        return backend
+    return available_backends()[0]
+
+
+def _matches(selector: tuple, name: str, attrs: Dict) -> bool:
+    tag, attribute, value = selector
+    if name != tag or not attrs:
+        return False
+    attr_value = attrs.get(attribute)
+    if attribute == 'class' and attr_value is not None:
+        classes = attr_value.split() if isinstance(attr_value, str) else attr_value
+        return value in classes
+    return attr_value == value
+
+
+@lru_cache(maxsize=None)
+def _strainer(page: str):
+    """
+    Return a SoupStrainer keeping the elements matched by any selector of page (and their children).
+    """
+    from bs4 import SoupStrainer
+
+    selectors = tuple(SELECTORS[page].values())
+
+    class SelectorStrainer(SoupStrainer):
+        def search_tag(self, markup_name=None, markup_attrs={}): # bs4 < 4.13
+            if isinstance(markup_name, str):
+                return any(_matches(selector, markup_name, dict(markup_attrs)) for selector in selectors)
+            return super().search_tag(markup_name, markup_attrs)
+
+        def allow_tag_creation(self, nsprefix, name, attrs): # bs4 >= 4.13
+            return any(_matches(selector, name, dict(attrs or {})) for selector in selectors)
+
+    return SelectorStrainer()
+
+
+def parse_page(html: str, page: str, backend: str = None) -> "BeautifulSoup":
+    """
+    Parse the elements of a page that its selectors need.
+
+    Args:
+    html (str): html of the page
+    page (str): kind of page, a key of SELECTORS
+    backend (str): parser backend, default_backend() if not given
+
+    Return:
+    BeautifulSoup: tree of the selected elements only
+    """
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(html, backend or default_backend(), parse_only=_strainer(page))
+
+
+def select(content: "BeautifulSoup", page: str, name: str) -> List:
+    """
+    Return the elements of a parsed page matched by one of its selectors.
+    """
+    tag, attribute, value = SELECTORS[page][name]
+    if attribute == 'class':
+        return content.find_all(tag, class_=value)
+    return content.find_all(tag, attrs={attribute: value})
+
+
+def parse_airdate(airdate: str) -> Optional[float]:
+    """
+    Convert an airdate of the episode guide (e.g. '3 Mar. 2023', 'May 2023' or '2023') to a timestamp.
+    Returns None when the airdate is not a date.
+    """
+    for date_format in AIRDATE_FORMATS:
+        try:
+            return datetime.strptime(airdate, date_format).timestamp()
+        except ValueError:
+            pass
+    return None
+
+
+def parse_years(release_date: str) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Parse the first and last year of a tv show from its release date on IMDB.
+
+    Return:
+    tuple: start year and end year (None while the show is still running), (None, None) when it is not a date
+    """
+    match = YEARS.search(str(release_date or ''))
+    if not match:
+        return None, None
+    start_year, still_running, end_year = match.groups()
+    if end_year:
+        return int(start_year), int(end_year)
+    return int(start_year), None if still_running else int(start_year)
+
+
+@timed()
+def parse_title_search(html: str, backend: str = None) -> List:
+    """
+    Parse the results of a search by title.
+
+    Return:
+    list: [imdb_id, title, ...details] of every result
+    """
+    content = parse_page(html, 'title_search', backend)
+    root = select(content, 'title_search', 'result')
+    if not root:
+        raise Exception(PARSE_ERROR)
+
+    search_results = []
+    for items in root:
+        imdb_id = items.find('a').attrs['href'].split('/')[2][2:]
+        title = items.find('a').text
+        search_results.append([imdb_id, title]+[a.text for a in items.findAll('li')])
+    return search_results
+
+
+@timed()
+def parse_title(html: str, imdb_id: str, backend: str = None) -> TitleRecord:
+    """
+    Parse the page of a movie or tv show.
+
+    Return:
+    TitleRecord: imdb_id, title, release_date, type, rating, runtime and description
+    """
+    content = parse_page(html, 'title', backend)
+
+    title = select(content, 'title', 'title')[0].text
+
+    description = select(content, 'title', 'description')[0].text
+
+    root = select(content, 'title', 'metadata')[0].findAll('li')
+
+    if not (title and description and root):
+        raise Exception(PARSE_ERROR)
+
+    try:
+        rating = select(content, 'title', 'rating')[0].text
+    except IndexError:
+        rating = 'NA'
+
+    if len(root) == 4:
+        type_ = root[0].text
+        release_date = root[1].find('span').text
+        runtime = root[-1].text
+
+    elif len(root) == 3:
+        type_ = 'Movie'
+        release_date = root[0].find('span').text
+        runtime = root[-1].text
+
+    elif len(root) == 2:
+        type_ = root[0].text
+        release_date = root[1].find('span').text
+        runtime = 'NA'
+
+    elif len(root) == 1:
+        type_ = 'Movie'
+        release_date = root[0].find('span').text
+        runtime = 'NA'
+
+    else:
+        raise Exception("Unable to parse the information. Please report this issue on Github.")
+
+    return TitleRecord(imdb_id, title, release_date, type_, rating, runtime, description)
+
+
+@timed(rows=False)
+def parse_episode_guide(html: str, backend: str = None) -> List:
+    """
+    Parse the title and the seasons of a tv show from its episodes guide.
+
+    Return:
+    list: title, all seasons and the season the guide opens on (the latest aired one)
+    """
+    content = parse_page(html, 'episodes', backend)
+
+    movie_title = select(content, 'episodes', 'show_title')[0].find('a').text.strip()
+
+    seasons = select(content, 'episodes', 'seasons')[0]
+    selected_season = seasons.find('option', attrs={'selected':'selected'}).text.strip()
+    all_seasons = [season.text.strip() for season in seasons.findAll('option') if season.text.strip().isdigit()]
+
+    if movie_title and selected_season.isdigit() and int(selected_season) < 70:
+        return [movie_title, all_seasons, selected_season]
+    else:
+        raise Exception(PARSE_ERROR)
+
+
+@timed()
+def parse_episodes(html: str, upcoming: bool = False, backend: str = None) -> List[EpisodeRecord]:
+    """
+    Parse the episodes of one season from the episodes guide.
+
+    Args:
+    html (str): html of the season's page
+    upcoming (bool): only keep episodes that did not air yet
+
+    Return:
+    list: EpisodeRecord (title, season, episode, airdate) of every episode with an airdate
+    """
+    content = parse_page(html, 'episodes', backend)
+    episodes = select(content, 'episodes', 'episode')
+    season = select(content, 'episodes', 'seasons')[0].find('option', attrs={'selected':'selected'}).text.strip()
+    now_timestamp = datetime.now().timestamp()
+    results = []
+    for episode in episodes:
+        airdate = episode.find('div', class_='airdate').text.strip()
+        if not airdate:
+            continue
+        if upcoming:
+            episode_timestamp = parse_airdate(airdate)
+            if episode_timestamp is None or episode_timestamp < now_timestamp:
+                continue
+        title = episode.a['title']
+        episode_num = episode.meta['content']
+        results.append(EpisodeRecord(title, season, episode_num, airdate))
+
+    return results
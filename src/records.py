@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Records of the movies, tv shows and episodes found on IMDB.
+
+Records are NamedTuples: small immutable tuples with named fields, cheap to create for every lookup.
+Tables of records are only turned into pandas DataFrames when asked to (to_dataframe).
+
+Typical usage example:
+> record = Search().search_by_id("16358384")
+> record.title, record.is_tv_show
+> database.add_title(record)
+> to_dataframe(Search().upcoming_episodes("0944947")[0], EpisodeRecord)
+"""
+from datetime import datetime
+from typing import TYPE_CHECKING, NamedTuple, Sequence, Tuple, Type
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+class TitleRecord(NamedTuple):
+    """ A movie or tv show, from its IMDB page """
+    imdb_id: str
+    title: str
+    release_date: str # year of a movie, years of a tv show (e.g. '2011–2019')
+    type_: str
+    rating: str
+    runtime: str
+    description: str
+
+    @property
+    def is_tv_show(self) -> bool:
+        return self.type_.startswith("TV")
+
+    def to_row(self) -> Tuple:
+        """
+        Return the row stored by database.add_movies / database.add_shows.
+        The release year of a movie is stored as a timestamp, so that upcoming movies can be queried.
+        """
+        release_date = self.release_date if self.is_tv_show else datetime.strptime(self.release_date, "%Y").timestamp()
+        return (self.imdb_id, self.title, release_date, self.rating, self.type_, self.runtime, self.description)
+
+
+class SearchResult(NamedTuple):
+    """ A result of a search by title """
+    imdb_id: str
+    title: str
+    release_date: str
+    type_: str
+    cast: str
+
+    @property
+    def is_tv_show(self) -> bool:
+        return self.type_.startswith("TV")
+
+
+class EpisodeRecord(NamedTuple):
+    """ An episode of a tv show, from its episodes guide """
+    title: str
+    season: str
+    episode: str
+    airdate: str
+
+
+def to_dataframe(records: Sequence[NamedTuple], record_type: Type[NamedTuple] = None) -> "pd.DataFrame":
+    """
+    Convert records to a pandas DataFrame, with a column per field.
+
+    Args:
+    records (sequence): records of the same type
+    record_type (type): type of the records, gives the columns when there are no records
+
+    Return:
+    DataFrame: one row per record
+    """
+    import pandas as pd
+    fields = (record_type or type(records[0]))._fields if (record_type or records) else []
+    return pd.DataFrame(list(records), columns=[field.rstrip('_') for field in fields])
+
+
+def to_table(records: Sequence[NamedTuple], record_type: Type[NamedTuple]) -> str:
+    """
+    Format records as a text table with a header line and right-aligned columns.
+    """
+    rows = [[field.rstrip('_') for field in record_type._fields]] + [[str(value) for value in record] for record in records]
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    return "\n".join(" ".join(value.rjust(width) for value, width in zip(row, widths)) for row in rows)
@@ -5,18 +5,144 @@ Scrape movies and tv shows information from IMDB.
 Typical usage example:
 > search = Search(tv_show=False)
 > search.search_by_title("avengers")
-> search.search_by_id("16358384")
+> search.search_by_id("16358384").title
 
 To interact with users:
 > search = Search(tv_show=False)
 > search.prompt_search_by_title()
 > search.prompt_search_by_id()
 """
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
-from bs4 import BeautifulSoup
-from datetime import datetime
-import pandas as pd
-import requests
+from cache import ResponseCache
+from fetch import FetchError, fetch
+from metrics import count, timed
+from parsers import parse_episode_guide, parse_episodes, parse_title, parse_title_search
+from records import EpisodeRecord, SearchResult, TitleRecord, to_table
+import os
+import threading
+
+MAX_WORKERS = 8 # shows refreshed at the same time
+MAX_SEASON_WORKERS = 4 # season pages of one show fetched at the same time
+
+IMDB_URL = os.environ.get("WATCHLIST_IMDB_URL", "https://www.imdb.com").rstrip('/') # e.g. a local stand-in server
+METADATA = os.environ.get("WATCHLIST_METADATA", "imdb") # 'imdb' to scrape IMDB, 'datasets' for the local IMDb datasets
+
+_response_cache = None
+_shared_lock = threading.Lock()
+
+
+def title_url(imdb_id: str) -> str:
+    """
+    Return the url of the IMDB page of a movie or tv show.
+    """
+    return f'{IMDB_URL}/title/tt{imdb_id}/'
+
+
+def title_search_url(title: str) -> str:
+    """
+    Return the url of the IMDB search of titles matching title.
+    """
+    return f"{IMDB_URL}/find/?q={title}&s=tt"
+
+
+def episodes_url(imdb_id: str, season: str = None) -> str:
+    """
+    Return the url of a tv show's episodes guide, opened on the given season or on the latest aired one.
+    """
+    if season is None:
+        return f'{IMDB_URL}/title/tt{imdb_id}/episodes/'
+    return f"{IMDB_URL}/title/tt{imdb_id}/episodes?season={season}"
+
+
+def clean_search_results(search_results: List) -> List[SearchResult]:
+    """
+    Clean output data of search_by_title function.
+
+    Args:
+    search_results (list): output of search_by_title function
+
+    Return:
+    list: SearchResult (imdb_id, title, release_date, type, cast) of every result
+    """
+    final_results = []
+    for result in search_results:
+        if len(result) == 7:
+            final_results.append(SearchResult(result[0], result[1], result[2], result[-1], result[-2]))
+        elif len(result) == 6:
+            final_results.append(SearchResult(result[0], result[1], result[2], result[-1], ''))
+        elif len(result) == 5:
+            final_results.append(SearchResult(*result))
+        elif len(result) == 4:
+            final_results.append(SearchResult(result[0], result[1], result[2], 'Movie', result[3]))
+        elif len(result) in [2,3]:
+            final_results.append(SearchResult(result[0], result[1], 'NA', 'NA', 'NA'))
+        elif len(result) == 1:
+            final_results.append(SearchResult(result[0], 'NA', 'NA', 'NA', 'NA'))
+        else:
+            raise Exception("Unable to parse the information. Probably the HTML elements have been changed. Please report this issue on Github.")
+
+    return final_results
+
+
+def new_search(tv_show: bool = False) -> "Search":
+    """
+    Return a Search of the configured metadata source: IMDB, or the local IMDb datasets (see datasets.py).
+    """
+    if METADATA == 'datasets':
+        from datasets import OfflineSearch
+        return OfflineSearch(tv_show)
+    return Search(tv_show)
+
+
+def response_cache() -> ResponseCache:
+    """
+    Return the on-disk cache of downloaded pages shared by every Search.
+    """
+    global _response_cache
+    with _shared_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache()
+        return _response_cache
+
+
+@timed()
+def fetch_page(url: str) -> str:
+    """
+    Get the html of a page, serving it from the on-disk cache while it is fresh
+    and revalidating it with a conditional request once it is stale.
+
+    Args:
+    url (str): input web address
+
+    return:
+    str: html of the page
+
+    Raises:
+    FetchError: the page could not be downloaded
+    """
+    cache = response_cache()
+    entry = cache.lookup(url)
+    if entry is not None and entry.fresh:
+        count('cache.hits')
+        return entry.body
+
+    validators = {}
+    if entry is not None and entry.etag:
+        validators['if-none-match'] = entry.etag
+    if entry is not None and entry.last_modified:
+        validators['if-modified-since'] = entry.last_modified
+
+    response = fetch(url, validators)
+    if response.status_code == 304 and entry is not None:
+        count('cache.revalidated')
+        cache.revalidated(url)
+        return entry.body
+    count('cache.misses')
+    cache.store(url, response.text, response.headers.get('etag'),
+                response.headers.get('last-modified'), response.elapsed.total_seconds())
+    return response.text
+
 
 class Search:
     """
@@ -30,36 +156,21 @@ class Search:
         Init Search class with tv_show flag.
         """
         self.tv_show = tv_show
+        self.__pages = {}
 
-    def __get_response(self, url: str):
+    def __get_page(self, url: str) -> str:
         """
-        Get response from the web.
+        Get the html of a page, reusing it if this instance already downloaded it (see fetch_page).
 
         Args:
         url (str): input web address
 
         return:
-        requests.model
+        str: html of the page
         """
-        headers = {'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/53.0.2785.143 Safari/537.36'}
-        try:
-            response = requests.get(url, headers=headers, timeout=5)
-            response.raise_for_status()
-
-        except requests.ConnectionError as e:
-            print(f"Connection Error. Make sure you are connected to Internet.\n{e}")
-        except requests.Timeout as e:
-            print(f"Timeout Error: {e}")
-        except requests.RequestException as e:
-            print(f"General Error: {e}")
-        except requests.TooManyRedirects as e:
-            print(f"Too many redirects: {e}")
-        except requests.HTTPError as e:
-            print(f"HTTP Error: {e}")
-        except KeyboardInterrupt:
-            print("Keyboard interrupt: program is closed.")
-
-        return response
+        if url not in self.__pages:
+            self.__pages[url] = fetch_page(url)
+        return self.__pages[url]
 
     def search_by_title(self, title: str) -> List:
         """
@@ -71,113 +182,36 @@ class Search:
         Return:
         list: list of searched items 
         """
-        url = f"https://www.imdb.com/find/?q={title}&s=tt"
-        response = self.__get_response(url)
-        content = BeautifulSoup(response.text, 'html.parser')
-
-        root = content.findAll('div', class_='ipc-metadata-list-summary-item__tc')
-        if root:
-            search_results = []
-            for items in root:
-                imdb_id = items.find('a').attrs['href'].split('/')[2][2:]
-                title = items.find('a').text
-                search_results.append([imdb_id, title]+[a.text for a in items.findAll('li')])
-            
-            return search_results
-        else:
-            raise Exception("Unable to parse the information. Probably the HTML elements have been changed. Please report this issue on Github.")
+        import parse_pool # with multiprocessing, only once a page is parsed
+        return parse_pool.parse(parse_title_search, self.__get_page(title_search_url(title)))
 
-        
-    def __clean_search_by_title_results(self, search_results: List) -> pd.DataFrame:
-        final_results = []
+    def search_by_id(self, imdb_id: str) -> TitleRecord:
         """
-        Clean output data of search_by_title function.
+        Find relevent movies or tv shows from IMDB based on the entered ID.
 
         Args:
-        search_results (list): output of search_by_title function
+        imdb_id (str): IMDB id
 
         Return:
-        DataFrame: cleaned data
+        TitleRecord: searched item
         """
-        for result in search_results:
-            if len(result) == 7:
-                final_results.append([result[0], result[1], result[2], result[-1], result[-2]])
-            elif len(result) == 6:
-                final_results.append([result[0], result[1], result[2], result[-1], ''])
-            elif len(result) == 5:
-                final_results.append(result)
-            elif len(result) == 4:
-                final_results.append([result[0], result[1], result[2], 'Movie', result[3]])
-            elif len(result) in [2,3]:
-                final_results.append([result[0], result[1], 'NA', 'NA', 'NA'])
-            elif len(result) == 1:
-                final_results.append([result[0], 'NA', 'NA', 'NA', 'NA'])
-            else:
-                raise Exception("Unable to parse the information. Probably the HTML elements have been changed. Please report this issue on Github.")
-
-        results = pd.DataFrame(final_results)
-        results.columns = ["imdb_id", "title", "release_date", "type", "cast"]
-        return results
-
+        import parse_pool
+        return parse_pool.parse(parse_title, self.__get_page(title_url(imdb_id)), imdb_id)
 
-    def search_by_id(self, imdb_id: str) -> pd.DataFrame:
+        
+    def episode_guide(self, imdb_id: str) -> List:
         """
-        Find relevent movies or tv shows from IMDB based on the entered ID.
+        Find the title and the seasons of a tv show from its episodes guide.
 
         Args:
         imdb_id (str): IMDB id
 
         Return:
-        list: searched item
+        list: title, all seasons and the season the guide opens on (the latest aired one)
         """
-        url = f'https://www.imdb.com/title/tt{imdb_id}/'
-        response = self.__get_response(url)
-        content = BeautifulSoup(response.text, 'html.parser')
-
-        title = content.findAll('h1', attrs={'data-testid':'hero-title-block__title'})[0].text
-
-        description = content.findAll('span', attrs={'data-testid':'plot-xl'})[0].text
-
-        root = content.findAll('ul', attrs={'data-testid':'hero-title-block__metadata'})[0].findAll('li')
-
-        if title and description and root:
-            try:
-                rating = content.findAll('div', attrs={'data-testid':'hero-rating-bar__aggregate-rating__score'})[0].text
-            except:
-                rating = 'NA'
-
-            if len(root) == 4:
-                type_ = root[0].text
-                release_date = root[1].find('span').text
-                runtime = root[-1].text
-
-            elif len(root) == 3:
-                type_ = 'Movie'
-                release_date = root[0].find('span').text
-                runtime = root[-1].text
-
-            elif len(root) == 2:
-                type_ = root[0].text
-                release_date = root[1].find('span').text
-                runtime = 'NA'
-
-            elif len(root) == 1:
-                type_ = 'Movie'
-                release_date = root[0].find('span').text
-                runtime = 'NA'
-            
-            else:
-                raise Exception("Unable to parse the information. Please report this issue on Github.")
-
-            final_results = [imdb_id, title, release_date, type_, rating, runtime, description]
-            results = pd.DataFrame(final_results)
-            results.index = ["imdb_id", "title", "release_date", "type", "rating", "runtime", "discription"]
-            return results
+        import parse_pool
+        return parse_pool.parse(parse_episode_guide, self.__get_page(episodes_url(imdb_id)))
 
-        else:
-            raise Exception("Unable to parse the information. Probably the HTML elements have been changed. Please report this issue on Github.")
-
-        
     def upcoming_episodes(self, imdb_id: str) -> List:
         """
         Find upcoming episodes from IMDB based on the entered ID.
@@ -186,43 +220,26 @@ class Search:
         imdb_id (str): IMDB id
 
         Return:
-        list: searched items
+        list: EpisodeRecord of the upcoming episodes (or a message when there are none) and the title of the show
         """
-        url = f'https://www.imdb.com/title/tt{imdb_id}/episodes/'
-        response = self.__get_response(url)
-        content = BeautifulSoup(response.text, 'html.parser')
+        movie_title, all_seasons, selected_season = self.episode_guide(imdb_id)
 
-        movie_title = content.findAll('h3', attrs={'itemprop':'name'})[0].find('a').text.strip()
+        # the guide opens on the selected season, so only later seasons need a new download
+        urls = [episodes_url(imdb_id)] + [episodes_url(imdb_id, season)
+                                          for season in all_seasons if int(season) > int(selected_season)]
+        with ThreadPoolExecutor(max_workers=min(len(urls), MAX_SEASON_WORKERS)) as executor:
+            season_results = executor.map(lambda season_url: self.scrape_episodes(season_url, upcoming=True), urls)
+            results = [episode for episodes in season_results for episode in episodes]
 
-        selected_season = content.findAll('option', attrs={'selected':'selected'})[0].text.strip()
-        seasons = content.findAll('select', attrs={'id':'bySeason'})[0].text
-        all_seasons = [season for season in seasons if season.isdigit()]
-
-        if movie_title and selected_season.isdigit() and int(selected_season) < 70:
-            if selected_season != all_seasons[-1]:
-                url_1 = f"https://www.imdb.com/title/tt{imdb_id}/episodes?season={selected_season}"
-                url_2 = f"https://www.imdb.com/title/tt{imdb_id}/episodes?season={all_seasons[-1]}"
-
-                results = self.scrape_episodes(url_1, upcoming=True) +\
-                          self.scrape_episodes(url_2, upcoming=True)
-            
-            else:
-                results = self.scrape_episodes(url, upcoming=True)
-
-            if results:
-                search_results = pd.DataFrame(results)
-                search_results.columns = ["title", "season", "episode", "airdate"]
-                return [search_results, movie_title]
-            
-            else:
-                results = f"Found no upcoming episodes for {movie_title}."
-                return [results, movie_title]
+        if results:
+            return [results, movie_title]
 
         else:
-            raise Exception("Unable to parse the information. Probably the HTML elements have been changed. Please report this issue on Github.")
+            results = f"Found no upcoming episodes for {movie_title}."
+            return [results, movie_title]
 
 
-    def scrape_episodes(self, url: str, upcoming: bool = False) -> List:
+    def scrape_episodes(self, url: str, upcoming: bool = False) -> List[EpisodeRecord]:
         """
         Find all episodes from IMDB based on the entered ID.
 
@@ -230,30 +247,10 @@ class Search:
         url (str): url of tv show's episodes guide
 
         Return:
-        list: searched items
+        list: EpisodeRecord of every episode
         """
-        response = self.__get_response(url)  
-        content = BeautifulSoup(response.text, 'html.parser')
-        episodes = content.find_all('div', class_='info')
-        season = content.findAll('option', attrs={'selected':'selected'})[0].text.strip()
-        results = []
-        for episode in episodes:
-            airdate = episode.find('div', class_='airdate').text.strip()
-            if airdate and upcoming:
-                episode_timestamp = datetime.strptime(airdate, "%d %b. %Y").timestamp()
-                now_timestamp = datetime.now().timestamp()
-                if episode_timestamp >= now_timestamp:
-                    title = episode.a['title']
-                    episode_num = episode.meta['content']
-                    results.append([title, season, episode_num, airdate])
-
-            elif airdate and not upcoming:
-                    title = episode.a['title']
-                    episode_num = episode.meta['content']
-                    results.append([title, season, episode_num, airdate])
-                
-        return results
-
+        import parse_pool
+        return parse_pool.parse(parse_episodes, self.__get_page(url), upcoming)
 
     def prompt_search_by_title(self):
         """
@@ -262,46 +259,44 @@ class Search:
         try:
             title = input("Enter a partial title: ")
             search_results = self.search_by_title(title)
-            results = self.__clean_search_by_title_results(search_results)
-            if self.tv_show:
-                results = results[results['type'].str.startswith("TV")]
-                print("\n-- Search Results --\n")
-                print(results.head(25).to_string(index=False))
-                print("\n-- End --\n")
-            else:
-                print("\n-- Search Results --\n")
-                results = results[~results['type'].str.startswith("TV")]
-                print(results.head(25).to_string(index=False))
-                print("\n-- End --\n")
+            results = [result for result in clean_search_results(search_results)
+                       if result.is_tv_show == self.tv_show]
+            print("\n-- Search Results --\n")
+            print(to_table(results[:25], SearchResult))
+            print("\n-- End --\n")
+        except FetchError as e:
+            print(f"\nError: {e}\n")
         except:
             print("\nError: Invalid input. Please try again.\n")
     
 
-    def prompt_search_by_id(self) -> pd.DataFrame:
+    def prompt_search_by_id(self) -> TitleRecord:
         """
         Interact with user for the search_by_id function
         """
         try:
             imdb_id = input("Enter an IMDB ID (only numbers): ")
-            results = self.search_by_id(imdb_id).T
+            result = self.search_by_id(imdb_id)
 
-            if self.tv_show and not results['type'][0].startswith("TV"):
+            if self.tv_show and not result.is_tv_show:
                 print("\nThis is a movie. You can only search for tv shows here.\n")
                 return None
-            elif not self.tv_show and results['type'][0].startswith("TV"):
+            elif not self.tv_show and result.is_tv_show:
                 print("\nThis is a tv show. You can only search for movies here.\n")
                 return None
             else:
                 print("\n-- Search Results --")
-                print(f"IMDB ID: {results.imdb_id[0]}")
-                print(f"Title: {results.title[0]}")
-                print(f"Release Date: {results.release_date[0]}")
-                print(f"Rating: {results.rating[0]}")
-                print(f"Runtime: {results.runtime[0]}")
-                print(f"Type: {results.type[0]}")
-                print(f"Description: {results.discription[0]}")
+                print(f"IMDB ID: {result.imdb_id}")
+                print(f"Title: {result.title}")
+                print(f"Release Date: {result.release_date}")
+                print(f"Rating: {result.rating}")
+                print(f"Runtime: {result.runtime}")
+                print(f"Type: {result.type_}")
+                print(f"Description: {result.description}")
                 print("-- End --\n")
 
-            return results
+            return result
+        except FetchError as e:
+            print(f"\nError: {e}\n")
         except:
             print("\nError: Invalid ID. Please try again.\n")
@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+"""
+Share one watchlist between many clients through a local HTTP server with a JSON API.
+
+Instead of every user opening data.db from their own process (and waiting on each other's locks),
+one server process answers them all. Requests are handled by a fixed pool of worker threads, every
+worker with its own connection to the database. Reads are cached in memory until the next write:
+writes through the server clear the cache, and so does a commit of any other connection (PRAGMA
+data_version), so writes of other processes are picked up too. GET responses carry an ETag, and a request sending it back in
+If-None-Match gets an empty 304 Not Modified.
+
+Endpoints (rows are named like the JSON output of cli.py):
+- GET /movies, /shows: ?upcoming=1, ?running=1 (shows), ?order_by=id|release_date|next_airdate (shows), ?desc=1, ?limit=100
+- GET /users/<username>/watched: the movies watched by a user, same options as /movies
+- GET /episodes/upcoming
+- GET /search/movies?q=, /search/shows?q=: search the watchlist
+- GET /imdb/titles/<imdb_id>, /imdb/search?q=: look up IMDB (through the response cache)
+- POST /titles {"imdb_id": "0944947"}: look up a title on IMDB and add it to the watchlist
+- POST /users {"username": "bob"}, POST /watched {"username": "bob", "movie_id": 12}
+- DELETE /movies/<id>, /shows/<id>
+- POST /batch [{"method": "GET", "path": "/movies?limit=5"}, ...]: several requests in one round trip,
+  answered with a list of {"status": ..., "body": ...}
+
+Typical usage example:
+> python app.py serve --port 8080 --workers 8
+> curl -s localhost:8080/movies?upcoming=1
+> curl -s -X POST localhost:8080/batch -d '[{"method": "GET", "path": "/shows"}, {"method": "GET", "path": "/episodes/upcoming"}]'
+"""
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+from cli import record_to_dict, row_to_dict
+import database
+
+MAX_WORKERS = 8 # requests handled at the same time
+DEFAULT_LIMIT = 100 # rows of a list endpoint without ?limit=
+MAX_BODY = 1024 * 1024 # bytes of a request body
+MAX_BATCH = 100 # requests of a /batch
+MAX_CACHE_ENTRIES = 1000
+KEEP_ALIVE_TIMEOUT = 2 # seconds an idle keep-alive connection holds its worker before it is closed
+
+
+class HTTPError(Exception):
+    """ An error answered with its status code """
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class ReadCache:
+    """
+    Responses of the read endpoints, kept until the database changes.
+
+    The cache is cleared by every write through the server, and when another connection committed,
+    e.g. a write by another process: PRAGMA data_version of a connection that never writes changes
+    with every commit of the other connections.
+    """
+    def __init__(self, max_entries: int = MAX_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.__entries = {}
+        self.__stamp = None
+        self.__lock = threading.Lock()
+        self.__watcher = None # connection reading the data_version of the database
+        self.__watched_path = None
+        self.hits = self.misses = 0
+
+    def __read_stamp(self) -> Tuple:
+        if self.__watched_path != database.database_path:
+            if self.__watcher is not None:
+                self.__watcher.close()
+            self.__watcher = sqlite3.connect(database.database_path, check_same_thread=False, isolation_level=None)
+            self.__watched_path = database.database_path
+        return self.__watched_path, self.__watcher.execute("PRAGMA data_version;").fetchone()[0]
+
+    def database_stamp(self) -> Tuple:
+        """
+        Return the version of the database, which changes with every commit (and with the database file).
+        """
+        with self.__lock:
+            return self.__read_stamp()
+
+    def get(self, key: str) -> Optional[Tuple[str, bytes]]:
+        with self.__lock:
+            stamp = self.__read_stamp()
+            if stamp != self.__stamp:
+                self.__entries.clear()
+                self.__stamp = stamp
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return entry
+
+    def put(self, key: str, entry: Tuple[str, bytes], stamp: Tuple):
+        with self.__lock:
+            if stamp != self.__stamp:
+                return # the database changed while the response was being built
+            if len(self.__entries) >= self.max_entries:
+                self.__entries.pop(next(iter(self.__entries)))
+            self.__entries[key] = entry
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__stamp = None
+
+    def close(self):
+        with self.__lock:
+            if self.__watcher is not None:
+                self.__watcher.close()
+            self.__watcher = self.__watched_path = None
+
+
+def _flag(query: Dict, name: str) -> bool:
+    return query.get(name, '0').lower() in ('1', 'true', 'yes')
+
+
+def _int(query: Dict, name: str, default: Optional[int]) -> Optional[int]:
+    try:
+        return int(query[name]) if name in query else default
+    except ValueError:
+        raise HTTPError(400, f"{name} must be a number")
+
+
+def _list_options(query: Dict, table_name: str) -> Dict:
+    order_by = query.get('order_by', 'id')
+    if order_by not in database.PAGE_SORT_KEYS[table_name]:
+        raise HTTPError(400, f"order_by of {table_name} must be one of {list(database.PAGE_SORT_KEYS[table_name])}")
+    return {'order_by': order_by, 'descending': _flag(query, 'desc'), 'limit': _int(query, 'limit', DEFAULT_LIMIT)}
+
+
+def _field(body, name: str):
+    if not isinstance(body, dict) or name not in body:
+        raise HTTPError(400, f"the request body needs a {name!r} field")
+    return body[name]
+
+
+def list_movies(match, query, body):
+    rows = database.iter_movies(upcoming=_flag(query, 'upcoming'), **_list_options(query, 'movies'))
+    return [row_to_dict(row, database.MOVIE_COLUMNS) for row in rows]
+
+
+def list_shows(match, query, body):
+    rows = database.iter_shows(upcoming=_flag(query, 'upcoming'), running=_flag(query, 'running'), **_list_options(query, 'shows'))
+    return [row_to_dict(row, database.SHOW_COLUMNS) for row in rows]
+
+
+def list_watched(match, query, body):
+    rows = database.iter_watched_movies(unquote(match['username']), **_list_options(query, 'movies'))
+    return [row_to_dict(row, database.MOVIE_COLUMNS) for row in rows]
+
+
+def list_upcoming_episodes(match, query, body):
+    return [row_to_dict(row, database.UPCOMING_EPISODE_COLUMNS) for row in database.get_upcoming_episodes()]
+
+
+def search_watchlist(match, query, body):
+    search_term = query.get('q', '')
+    if match['kind'] == 'movies':
+        return [row_to_dict(row, database.MOVIE_COLUMNS) for row in database.search_movies(search_term)]
+    return [row_to_dict(row, database.SHOW_COLUMNS) for row in database.search_shows(search_term)]
+
+
+def imdb_title(match, query, body):
+    from search import new_search
+    return record_to_dict(new_search().search_by_id(match['imdb_id']))
+
+
+def imdb_search(match, query, body):
+    from search import clean_search_results, new_search
+    results = clean_search_results(new_search().search_by_title(query.get('q', '')))
+    return [dict(record_to_dict(result), kind='show' if result.is_tv_show else 'movie') for result in results]
+
+
+def add_title(match, query, body):
+    from search import new_search
+    record = new_search().search_by_id(str(_field(body, 'imdb_id')))
+    database.add_title(record)
+    return dict(record_to_dict(record), kind='show' if record.is_tv_show else 'movie', added=True)
+
+
+def add_user(match, query, body):
+    username = _field(body, 'username')
+    try:
+        database.add_user(username)
+    except database.sqlite3.IntegrityError:
+        raise HTTPError(409, f"{username} already exists")
+    return {'username': username, 'added': True}
+
+
+def watch_movie(match, query, body):
+    username, movie_id = _field(body, 'username'), _field(body, 'movie_id')
+    try:
+        added = database.watch_movie(username, movie_id)
+    except database.NotFoundError as e:
+        raise HTTPError(404, str(e))
+    if not added:
+        raise HTTPError(409, f"{username} already watched {movie_id}")
+    return {'username': username, 'movie_id': movie_id, 'watched': True}
+
+
+def delete_title(match, query, body):
+    if match['kind'] == 'movies':
+        database.delete_movie(match['id'])
+    else:
+        database.delete_show(match['id'])
+    return {'id': int(match['id']), 'deleted': True}
+
+
+# (method, path pattern, handler, whether its response is cached until the next write)
+ROUTES = [
+    ('GET', r"/movies", list_movies, True),
+    ('GET', r"/shows", list_shows, True),
+    ('GET', r"/users/(?P<username>[^/]+)/watched", list_watched, True),
+    ('GET', r"/episodes/upcoming", list_upcoming_episodes, True),
+    ('GET', r"/search/(?P<kind>movies|shows)", search_watchlist, True),
+    ('GET', r"/imdb/titles/(?:tt)?(?P<imdb_id>\d+)", imdb_title, False),
+    ('GET', r"/imdb/search", imdb_search, False),
+    ('POST', r"/titles", add_title, False),
+    ('POST', r"/users", add_user, False),
+    ('POST', r"/watched", watch_movie, False),
+    ('DELETE', r"/(?P<kind>movies|shows)/(?P<id>\d+)", delete_title, False),
+]
+ROUTES = [(method, re.compile(pattern + "/?$"), handler, cached) for method, pattern, handler, cached in ROUTES]
+
+
+class WatchlistServer(HTTPServer):
+    """
+    HTTP server answering requests on a fixed pool of worker threads (see ThreadingHTTPServer for
+    the thread per request version), with the read cache shared by all of them.
+    """
+    def __init__(self, address: Tuple[str, int], max_workers: int = MAX_WORKERS):
+        super().__init__(address, WatchlistHandler)
+        self.cache = ReadCache()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='watchlist-server')
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.__process_request, request, client_address)
+
+    def __process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+        self.cache.close()
+
+    def dispatch(self, method: str, path: str, body=None) -> Tuple[int, bytes, Optional[str]]:
+        """
+        Answer a request.
+
+        Return:
+        tuple: status, JSON body and ETag (for GET requests)
+        """
+        url = urlsplit(path)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            if url.path.rstrip('/') == '/batch':
+                if method != 'POST':
+                    raise HTTPError(405, "use POST for /batch")
+                return 200, self.__json(self.__batch(body)), None
+            for route_method, pattern, handler, cached in ROUTES:
+                match = pattern.match(url.path)
+                if match is None:
+                    continue
+                if route_method != method:
+                    raise HTTPError(405, f"use {route_method} for {url.path}")
+                return self.__call(method, path, handler, match, query, body, cached)
+            raise HTTPError(404, f"no endpoint at {url.path}")
+        except HTTPError as e:
+            return e.status, self.__json({'error': str(e)}), None
+        except Exception as e:
+            from fetch import FetchError
+            status = 502 if isinstance(e, FetchError) else 500
+            return status, self.__json({'error': str(e)}), None
+
+    def __call(self, method: str, path: str, handler: Callable, match, query: Dict, body, cached: bool):
+        if cached:
+            entry = self.cache.get(path)
+            if entry is not None:
+                return (200, entry[1], entry[0])
+            stamp = self.cache.database_stamp()
+        payload = self.__json(handler(match.groupdict(), query, body))
+        if method != 'GET':
+            self.cache.clear()
+            return 200, payload, None
+        etag = '"' + hashlib.sha1(payload).hexdigest() + '"'
+        if cached:
+            self.cache.put(path, (etag, payload), stamp)
+        return 200, payload, etag
+
+    def __batch(self, requests) -> List[Dict]:
+        if not isinstance(requests, list) or len(requests) > MAX_BATCH:
+            raise HTTPError(400, f"the body of /batch must be a list of at most {MAX_BATCH} requests")
+        for index, request in enumerate(requests):
+            if not isinstance(request, dict) or not isinstance(request.get('path'), str):
+                raise HTTPError(400, f"request {index} of /batch needs a 'path' string")
+            if not isinstance(request.get('method', 'GET'), str):
+                raise HTTPError(400, f"the 'method' of request {index} of /batch must be a string")
+        responses = []
+        for request in requests:
+            if request['path'].rstrip('/').startswith('/batch'):
+                responses.append({'status': 400, 'body': {'error': "/batch requests cannot be nested"}})
+                continue
+            status, payload, _ = self.dispatch(request.get('method', 'GET').upper(), request['path'], request.get('body'))
+            responses.append({'status': status, 'body': json.loads(payload)})
+        return responses
+
+    @staticmethod
+    def __json(payload) -> bytes:
+        return json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+
+class WatchlistHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive
+    timeout = KEEP_ALIVE_TIMEOUT
+
+    def __handle(self, method: str):
+        body = None
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY:
+            self.__respond(413, json.dumps({'error': "request body too large"}).encode('utf-8'))
+            self.close_connection = True
+            return
+        if length:
+            try:
+                body = json.loads(self.rfile.read(length))
+            except ValueError:
+                self.__respond(400, json.dumps({'error': "the request body is not valid JSON"}).encode('utf-8'))
+                return
+        status, payload, etag = self.server.dispatch(method, self.path, body)
+        if etag is not None and self.headers.get('If-None-Match') == etag:
+            self.__respond(304, b'', etag)
+        else:
+            self.__respond(status, payload, etag)
+
+    def __respond(self, status: int, payload: bytes, etag: str = None):
+        self.send_response(status)
+        if etag is not None:
+            self.send_header('ETag', etag)
+        if status != 304:
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self.__handle('GET')
+
+    def do_POST(self):
+        self.__handle('POST')
+
+    def do_DELETE(self):
+        self.__handle('DELETE')
+
+    def log_request(self, code='-', size='-'):
+        pass # one line per request is too much for a busy server, errors are still reported (log_error)
+
+
+def serve(host: str = '127.0.0.1', port: int = 8080, max_workers: int = MAX_WORKERS):
+    """
+    Answer requests until interrupted (Ctrl+C).
+    """
+    server = WatchlistServer((host, port), max_workers)
+    print(f"-- Serving {database.database_path} on http://{host}:{server.server_address[1]} "
+          f"with {max_workers} workers (Ctrl+C to stop) --")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n-- Server stopped --")
+    finally:
+        server.server_close()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+"""
+Statistics of the watchlist: watched movies per user, ratings, runtimes and releases per year.
+
+The columns needed are read from the movies, shows, watched and users tables in one read transaction,
+into NumPy arrays, and every aggregate is computed on whole arrays. Texts such as a runtime ('2h 15m')
+or a rating ('8.7/10') take few distinct values, so each distinct text is parsed once (pandas.factorize)
+and the numbers are spread back to the rows by indexing: millions of rows take a fraction of a second.
+
+Typical usage example:
+> watchlist = load()
+> statistics = compute(watchlist)
+> print(format_stats(statistics))
+"""
+from datetime import datetime
+from typing import TYPE_CHECKING, Callable, Dict, NamedTuple, Optional
+from metrics import timed
+import re
+import database
+
+# numpy and pandas are slow to import, only the stats need them
+if TYPE_CHECKING:
+    import numpy as np
+
+RATING_BINS = list(range(11)) # ratings 0-1, 1-2... 9-10 (10 is in the last bin)
+
+# every column is read as one text (group_concat), split by numpy or in one str.split, instead of a tuple per row;
+# the aggregates of a query see the rows in the same order, so the columns stay aligned
+SEPARATOR = '\x1f' # between texts (unit separator), numbers are separated by commas
+SELECT_MOVIE_COLUMNS = """SELECT count(*), group_concat(id), group_concat(ifnull(rating, ''), char(31)),
+group_concat(ifnull(runtime, ''), char(31)), group_concat(ifnull(CAST(release_date_timestamp AS INTEGER), 'nan'))
+FROM movies;"""
+SELECT_SHOW_COLUMNS = """SELECT count(*), group_concat(ifnull(rating, ''), char(31)), group_concat(ifnull(start_year, 'nan'))
+FROM shows;"""
+# one row per user, read in the order of the unique (user_username, movie_id) index
+SELECT_WATCHED_COLUMNS = "SELECT user_username, group_concat(movie_id) FROM watched GROUP BY user_username;"
+SELECT_USERS = "SELECT username FROM users ORDER BY username;"
+
+RUNTIME = re.compile(r"^\s*(?:(\d+)\s*h)?\s*(?:(\d+)\s*m)?")
+RATING = re.compile(r"^\s*(\d+(?:\.\d+)?)")
+
+
+class Watchlist(NamedTuple):
+    """ The columns of the watchlist the statistics are computed from, one array per column """
+    movie_ids: "np.ndarray" # sorted
+    movie_ratings: "np.ndarray" # texts, e.g. '8.7/10' or 'NA'
+    movie_runtimes: "np.ndarray" # texts, e.g. '2h 15m' or 'NA'
+    movie_releases: "np.ndarray" # timestamps of January 1st of the release year
+    show_ratings: "np.ndarray"
+    show_start_years: "np.ndarray" # NaN when unknown
+    watched_users: "np.ndarray" # positions in users
+    watched_movie_ids: "np.ndarray"
+    users: "np.ndarray" # usernames
+
+
+def parse_runtime(runtime: Optional[str]) -> float:
+    """
+    Return the minutes of a runtime of IMDB ('2h 15m', '1h', '45m'), NaN when it has none.
+    """
+    match = RUNTIME.match(runtime or '')
+    if not match or not any(match.groups()):
+        return float('nan')
+    hours, minutes = match.groups()
+    return int(hours or 0) * 60 + int(minutes or 0)
+
+
+def parse_rating(rating: Optional[str]) -> float:
+    """
+    Return the rating of IMDB ('8.7/10'), NaN when it has none ('NA').
+    """
+    match = RATING.match(rating or '')
+    return float(match.group(1)) if match else float('nan')
+
+
+def parse_column(texts: "np.ndarray", parse: Callable[[Optional[str]], float]) -> "np.ndarray":
+    """
+    Parse a column of texts to floats, parsing every distinct text once.
+    """
+    import numpy as np
+    import pandas as pd
+    codes, distinct_texts = pd.factorize(texts) # code -1 for None
+    values = np.array([parse(text) for text in distinct_texts] + [np.nan], dtype=float)
+    return values[codes]
+
+
+def _numbers(text: Optional[str], dtype) -> "np.ndarray":
+    import numpy as np
+    return np.fromstring(text or '', dtype=dtype, sep=',')
+
+
+def _texts(text: Optional[str], rows: int) -> "np.ndarray":
+    import numpy as np
+    return np.array(text.split(SEPARATOR) if rows else [], dtype=object)
+
+
+@timed()
+def load() -> Watchlist:
+    """
+    Read the columns of the watchlist needed by compute, in one read transaction.
+    """
+    import numpy as np
+    connection = database.get_connection()
+    with connection:
+        connection.execute("BEGIN;") # the four tables as of the same moment
+        movies, movie_ids, movie_ratings, movie_runtimes, movie_releases = connection.execute(SELECT_MOVIE_COLUMNS).fetchone()
+        shows, show_ratings, show_start_years = connection.execute(SELECT_SHOW_COLUMNS).fetchone()
+        watched = connection.execute(SELECT_WATCHED_COLUMNS).fetchall()
+        users = [username for username, in connection.execute(SELECT_USERS)]
+
+    movie_ids = _numbers(movie_ids, 'int64')
+    movie_columns = [_texts(movie_ratings, movies), _texts(movie_runtimes, movies), _numbers(movie_releases, float)]
+    order = np.argsort(movie_ids, kind='stable')
+    if (order != np.arange(movie_ids.size)).any(): # not read in id order
+        movie_ids, movie_columns = movie_ids[order], [column[order] for column in movie_columns]
+
+    # users who watched movies, but were deleted from users, are kept
+    users += sorted({username for username, _ in watched} - set(users))
+    positions = {username: position for position, username in enumerate(users)}
+    watched_movie_ids = [_numbers(movie_ids_, 'int64') for _, movie_ids_ in watched]
+    watched_users = np.repeat(np.array([positions[username] for username, _ in watched], dtype='int64'),
+                              [movie_ids_.size for movie_ids_ in watched_movie_ids])
+    return Watchlist(movie_ids, *movie_columns, _texts(show_ratings, shows), _numbers(show_start_years, float),
+                     watched_users, np.concatenate(watched_movie_ids) if watched_movie_ids else np.zeros(0, dtype='int64'),
+                     np.array(users, dtype=object))
+
+
+def _counts(keys: "np.ndarray") -> Dict:
+    """
+    Return the number of times every distinct key (small integers, e.g. years) appears, by key.
+    """
+    import numpy as np
+    if not keys.size:
+        return {}
+    smallest = keys.min()
+    counts = np.bincount(keys - smallest)
+    return {int(smallest + offset): int(counts[offset]) for offset in np.flatnonzero(counts)}
+
+
+def _histogram(ratings: "np.ndarray") -> Dict:
+    import numpy as np
+    rated = ratings[~np.isnan(ratings)]
+    histogram, _ = np.histogram(rated, bins=RATING_BINS)
+    return {'rated': int(rated.size), 'unrated': int(ratings.size - rated.size),
+            'mean': round(float(rated.mean()), 2) if rated.size else None,
+            'histogram': {f"{low}-{low + 1}": int(count) for low, count in zip(RATING_BINS, histogram)}}
+
+
+def _january_offset() -> float:
+    # release timestamps are January 1st at midnight, local time: shift them to UTC before taking the year
+    january = datetime(2000, 1, 1).astimezone()
+    return january.utcoffset().total_seconds()
+
+
+@timed()
+def compute(watchlist: Watchlist) -> Dict:
+    """
+    Compute the statistics of the watchlist.
+
+    Return:
+    dict: movies and shows counts, watched movies and minutes per user, rating histograms,
+    runtime totals of the movies, and the movies and shows released every year
+    """
+    import numpy as np
+    movie_minutes = parse_column(watchlist.movie_runtimes, parse_runtime)
+    known_minutes = ~np.isnan(movie_minutes)
+
+    # watched movies -> rows of the movies, by id (ids are sorted); rows of deleted movies are dropped
+    positions = np.searchsorted(watchlist.movie_ids, watchlist.watched_movie_ids)
+    positions = np.minimum(positions, max(watchlist.movie_ids.size - 1, 0))
+    found = watchlist.movie_ids[positions] == watchlist.watched_movie_ids if watchlist.movie_ids.size else positions < 0
+    watched_users = watchlist.watched_users[found]
+    watched_minutes = np.nan_to_num(movie_minutes[positions[found]])
+    watched_per_user = np.bincount(watched_users, minlength=watchlist.users.size)
+    minutes_per_user = np.bincount(watched_users, weights=watched_minutes, minlength=watchlist.users.size)
+
+    releases = watchlist.movie_releases[~np.isnan(watchlist.movie_releases)] + _january_offset()
+    release_years = releases.astype('int64').astype('datetime64[s]').astype('datetime64[Y]').astype(int) + 1970
+    show_years = watchlist.show_start_years[~np.isnan(watchlist.show_start_years)].astype(int)
+
+    return {
+        'movies': int(watchlist.movie_ids.size),
+        'shows': int(watchlist.show_ratings.size),
+        'users': int(watchlist.users.size),
+        'watched': {user: {'movies': int(movies), 'minutes': int(minutes)}
+                    for user, movies, minutes in zip(watchlist.users, watched_per_user, minutes_per_user)},
+        'ratings': {'movies': _histogram(parse_column(watchlist.movie_ratings, parse_rating)),
+                    'shows': _histogram(parse_column(watchlist.show_ratings, parse_rating))},
+        'runtime': {'movies_minutes': int(movie_minutes[known_minutes].sum()),
+                    'movies_without_runtime': int(movie_minutes.size - known_minutes.sum()),
+                    'mean_movie_minutes': round(float(movie_minutes[known_minutes].mean()), 1) if known_minutes.any() else None,
+                    'watched_minutes': int(watched_minutes.sum())},
+        'releases_per_year': {'movies': _counts(release_years), 'shows': _counts(show_years)},
+    }
+
+
+def watchlist_stats() -> Dict:
+    """
+    Load the watchlist and compute its statistics, see compute.
+    """
+    return compute(load())
+
+
+def _hours(minutes: int) -> str:
+    return f"{minutes // 60}h {minutes % 60}m"
+
+
+def _bar(count: int, largest: int, width: int = 30) -> str:
+    return "#" * (round(count / largest * width) if largest else 0)
+
+
+def format_stats(statistics: Dict) -> str:
+    """
+    Format the statistics as text, with bar charts of the histograms.
+    """
+    lines = [f"{statistics['movies']} movies, {statistics['shows']} tv shows, {statistics['users']} users"]
+
+    runtime = statistics['runtime']
+    lines += ["", "-- Runtime --",
+              f"All movies: {_hours(runtime['movies_minutes'])} (mean {runtime['mean_movie_minutes'] or 'NA'} min, "
+              f"{runtime['movies_without_runtime']} without runtime)",
+              f"Watched: {_hours(runtime['watched_minutes'])}"]
+
+    lines += ["", "-- Watched movies per user --"]
+    for user, watched in sorted(statistics['watched'].items(), key=lambda item: -item[1]['movies']):
+        lines.append(f"{user}: {watched['movies']} movies, {_hours(watched['minutes'])}")
+
+    for kind, ratings in statistics['ratings'].items():
+        lines += ["", f"-- Ratings of {kind} (mean {ratings['mean'] or 'NA'}, {ratings['unrated']} unrated) --"]
+        largest = max(ratings['histogram'].values())
+        lines += [f"{bin_:>5} {count:>7} {_bar(count, largest)}" for bin_, count in ratings['histogram'].items()]
+
+    for kind, per_year in statistics['releases_per_year'].items():
+        lines += ["", f"-- {kind.capitalize()} per year --"]
+        largest = max(per_year.values(), default=0)
+        lines += [f"{year:>5} {count:>7} {_bar(count, largest)}" for year, count in per_year.items()]
+    return "\n".join(lines)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Keep the episodes of the tv shows in the watchlist in sync with IMDB.
+
+Only seasons that were never synced or are still airing are downloaded again,
+so refreshing a long running show costs one or two pages instead of its whole guide.
+
+Typical usage example:
+> for imdb_id, title, message in sync_shows(["0944947", "0903747"]):
+>     print(title, message)
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Iterable, Iterator, List
+from parsers import parse_airdate
+from search import new_search, episodes_url, MAX_WORKERS, MAX_SEASON_WORKERS
+import database
+
+
+def sync_show(imdb_id: str) -> List:
+    """
+    Download the seasons of a tv show that are new or still airing and store their episodes.
+
+    Args:
+    imdb_id (str): IMDB id of the tv show
+
+    Return:
+    list: title of the show, number of episodes and number of seasons synced
+    """
+    synced_seasons = database.get_seasons(imdb_id)
+    search = new_search(tv_show=True)
+    title, all_seasons, selected_season = search.episode_guide(imdb_id)
+    stale_seasons = [season for season in all_seasons if not synced_seasons.get(int(season))]
+
+    def fetch_season(season: str) -> List:
+        # the guide itself is the page of the selected season, reuse it
+        url = episodes_url(imdb_id) if season == selected_season else episodes_url(imdb_id, season)
+        return [season, search.scrape_episodes(url)]
+
+    now = datetime.now().timestamp()
+    episodes, seasons = [], {}
+    with ThreadPoolExecutor(max_workers=max(1, min(len(stale_seasons), MAX_SEASON_WORKERS))) as executor:
+        for season, season_episodes in executor.map(fetch_season, stale_seasons):
+            airdates = []
+            for episode in season_episodes:
+                if not episode.episode:
+                    continue # not numbered yet (the datasets leave the number of some episodes empty)
+                airdate_timestamp = parse_airdate(episode.airdate)
+                airdates.append(airdate_timestamp)
+                episodes.append((int(season), int(episode.episode), episode.title, episode.airdate, airdate_timestamp))
+            # a season is finished once a later season exists and all of its episodes have aired
+            seasons[int(season)] = (season != all_seasons[-1] and bool(airdates)
+                                    and all(airdate is not None and airdate < now for airdate in airdates))
+
+    database.add_episodes(imdb_id, episodes, seasons)
+    return [title, len(episodes), len(seasons)]
+
+
+def sync_shows(imdb_ids: Iterable[str], max_workers: int = MAX_WORKERS) -> Iterator[List]:
+    """
+    Download new and still airing seasons of several tv shows concurrently and store their episodes.
+
+    Shows are yielded as soon as they are stored, not in the order of imdb_ids.
+    A show that fails to download or parse yields an error message instead of stopping the others.
+
+    Args:
+    imdb_ids (iterable): IMDB ids of the shows
+    max_workers (int): number of shows downloaded at the same time
+
+    Return:
+    iterator: [imdb_id, title, message] for every show
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(sync_show, imdb_id): imdb_id for imdb_id in dict.fromkeys(imdb_ids)}
+        for future in as_completed(futures):
+            imdb_id = futures[future]
+            try:
+                title, episodes, seasons = future.result()
+            except Exception as e:
+                yield [imdb_id, imdb_id, f"Unable to sync episodes of tt{imdb_id}: {e}"]
+                continue
+
+            yield [imdb_id, title, f"{episodes} episodes synced from {seasons} seasons"]